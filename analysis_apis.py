@@ -6,6 +6,7 @@ import os
 import io
 import datetime
 import json
+import threading
 from os import path
 from pathlib import Path
 
@@ -41,28 +42,40 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error
 
 import gtfs_kit as gk
 
+from feed_cache import cached_trip_stats, cached_route_stats, route_stats_cache
+from feed_loader import load_feed
+from feed_index import feed_index
+from gtfs_time import NO_TIME
+from journey_planner import plan_journeys
+from isochrone import DEFAULT_BANDS, compute_isochrone
+from paging import list_response
+from shape_store import shape_store
+from frame_json import init_app
+
 app = Flask(__name__)
 CORS(app)
+# jsonify() encodes DataFrames in the payload straight from their columns
+init_app(app)
 
 path = Path('data/gtfs-nyc-2023.zip')
-feed = gk.read_feed(path, dist_units='km')
+# Memory-maps the snapshot built by `python feed_loader.py` when there is one,
+# otherwise parses and cleans the zip
+feed = load_feed(path)
 # print(feed.validate())
 
-def clean_feed_data(feed):
-  # Removing the space from the Arrival and Departure Time
-  feed.stop_times['arrival_time'] = feed.stop_times['arrival_time'].str.replace(' ', '')
-  feed.stop_times['departure_time'] = feed.stop_times['departure_time'].str.replace(' ', '')
+# trip_stats is shared by all the /api/* endpoints, compute it once at load
+cached_trip_stats(feed)
 
-  routes_with_no_trips = []
-  for idx, row in feed.routes.iterrows():
-    if len(feed.trips[feed.trips['route_id'] == row['route_id']]) == 0:
-      routes_with_no_trips.append(row['route_id'])
-  # Removing all the routes with no trips i.e. routes_with_no_trips
-  feed.routes = feed.routes[~feed.routes['route_id'].isin(routes_with_no_trips)]
+# Id lookups for routes, stops, trips and stop times, and the shape point arrays
+feed_index(feed)
+shape_store(feed)
 
-  return feed
+# Optionally compute route_stats for every active service date in the background,
+# so the dashboard requests are pure cache lookups
+route_stats_cache.maxsize = int(os.environ.get('ROUTE_STATS_CACHE_SIZE', route_stats_cache.maxsize))
+if os.environ.get('PREWARM_ROUTE_STATS', '0') == '1':
+    threading.Thread(target=route_stats_cache.prewarm, args=(feed,), daemon=True).start()
 
-feed = clean_feed_data(feed=feed)
 # print(feed.validate())
 
 @app.route('/', methods=['GET'])
@@ -72,81 +85,70 @@ def home():
 @app.route('/routes', methods=['GET'])
 def get_routes():
     """
-    API to get the list of routes from the GTFS feed.
+    API to get the list of routes from the GTFS feed, ordered by route_id.
+    Supports fields, limit/cursor pagination and format=ndjson streaming.
     """
-    routes_df = feed.routes.fillna('NA')  # Replace NaN with a placeholder like 'NA'
-    routes_json = routes_df.to_dict(orient='records')
-    
-    # print("Routes JSON (after replacing NaN):", routes_json)  # Log modified response
-    return jsonify(routes_json), 200
+    return list_response(feed_index(feed).routes.frame, 'route_id', request.args)
 
 @app.route('/route/<route_id>', methods=['GET'])
 def get_route_by_id(route_id):
     """
     API to get the details of a specific route by its ID.
     """
-    route = feed.routes[feed.routes['route_id'] == route_id]
+    route = feed_index(feed).route(route_id)
 
     if not route.empty:
-        route = route.fillna('NA')  # Replace NaN with 'NA'
-        route_json = route.to_dict(orient='records')
-        return jsonify(route_json), 200
+        return jsonify(route), 200
     else:
         return jsonify({'error': 'Route not found'}), 404
 
 @app.route('/stops', methods=['GET'])
 def get_stops():
     """
-    API to get the list of all stops from the GTFS feed, replacing NaN values.
+    API to get the list of all stops from the GTFS feed, ordered by stop_id.
+    Supports fields, limit/cursor pagination and format=ndjson streaming.
     """
-    stops_df = feed.stops.fillna("NA")  # Replace NaN with "NA" or choose None to send null
-    stops_json = stops_df.to_dict(orient='records')
-    return jsonify(stops_json), 200
+    return list_response(feed_index(feed).stops.frame, 'stop_id', request.args)
 
 @app.route('/stop/<stop_id>', methods=['GET'])
 def get_stop_by_id(stop_id):
     """
     API to get the details of a specific stop by its ID.
     """
-    stop = feed.stops[feed.stops['stop_id'] == stop_id]
+    stop = feed_index(feed).stop(stop_id)
     if not stop.empty:
-        stop_json = stop.to_dict(orient='records')
-        return jsonify(stop_json), 200
+        return jsonify(stop), 200
     else:
         return jsonify({'error': 'Stop not found'}), 404
 
 @app.route('/trips', methods=['GET'])
 def get_trips():
     """
-    API to get the list of all trips from the GTFS feed.
+    API to get the list of all trips from the GTFS feed, ordered by trip_id.
+    Supports fields, limit/cursor pagination and format=ndjson streaming.
     """
-    trips_df = feed.trips.fillna('NA')  # Replace NaN with a placeholder like 'NA'
-    trips_json = trips_df.to_dict(orient='records')
-    
-    # print("Trips JSON (after replacing NaN):", trips_json)  # Optional: Log modified response
-    return jsonify(trips_json), 200
+    return list_response(feed_index(feed).trips.frame, 'trip_id', request.args)
   
 @app.route('/trip/<trip_id>', methods=['GET'])
 def get_trip_by_id(trip_id):
     """
     API to get the details of a specific trip by its ID.
     """
-    trip = feed.trips[feed.trips['trip_id'] == trip_id]
+    trip = feed_index(feed).trip(trip_id)
     if not trip.empty:
-        trip_json = trip.fillna('NA').to_dict(orient='records')  # Replace NaN with 'NA'
-        return jsonify(trip_json), 200
+        return jsonify(trip), 200
     else:
         return jsonify({'error': 'Trip not found'}), 404
 
 @app.route('/stop_times/trip/<trip_id>', methods=['GET'])
 def get_stop_times_by_trip(trip_id):
     """
-    API to get the stop times for a specific trip ID.
+    API to get the stop times for a specific trip ID, ordered by stop_sequence.
+    Supports fields, limit/cursor pagination and format=ndjson streaming.
     """
-    stop_times = feed.stop_times[feed.stop_times['trip_id'] == trip_id]
+    stop_times = feed_index(feed).stop_times_for_trip(trip_id)
     if not stop_times.empty:
-        stop_times_json = stop_times.to_dict(orient='records')
-        return jsonify(stop_times_json), 200
+        return list_response(stop_times, 'stop_sequence', request.args)
     else:
         return jsonify({'error': 'No stop times found for this trip'}), 404
 
@@ -159,8 +161,7 @@ def search_routes_by_name(route_name):
                           feed.routes['route_long_name'].str.contains(route_name, case=False, na=False))]
 
     if not routes.empty:
-        routes_json = routes.to_dict(orient='records')
-        return jsonify(routes_json), 200
+        return jsonify(routes), 200
     else:
         return jsonify({'error': 'No routes found matching the short name'}), 404
 
@@ -173,14 +174,14 @@ def get_routes_with_trips():
         return jsonify({"error": "route_id is required"}), 400
 
     # Filter trips based on the provided route_id
-    trips_filtered = feed.trips[feed.trips['route_id'] == route_id]
+    trips_filtered = feed_index(feed).trips_for_route(route_id)
 
     if trips_filtered.empty:
         return jsonify({"error": "No trips found for the given route_id"}), 404
     
     return jsonify({
         "route_id": route_id,
-        "trips": trips_filtered.to_dict(orient='records')
+        "trips": trips_filtered
     }), 200
 
 @app.route('/calendar_dates', methods=['GET'])
@@ -188,7 +189,7 @@ def get_calendar_dates():
     """
     API to get the list of calendar dates from the GTFS feed.
     """
-    calendar_dates = feed.calendar.to_dict(orient='records')
+    calendar_dates = feed.calendar
     return jsonify(calendar_dates), 200
 
 @app.route('/api/route_stats', methods=['GET'])
@@ -204,48 +205,25 @@ def get_route_stats():
     
     # date = "".join(date.split("-"))
     
-    # Compute trip_stats
-    trip_stats = feed.compute_trip_stats()
-
     # Compute route_stats for the specific date
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     cols_round_off = ['mean_headway', 'mean_trip_distance', 'mean_trip_duration', 'service_distance', 'service_duration', 'service_speed']
     route_stats[cols_round_off] = route_stats[cols_round_off].round(2)
     route_stats['mean_trip_duration'] = route_stats['mean_trip_duration'] * 60
     route_stats['service_duration'] = route_stats['service_duration'] * 60
-    route_stats[['mean_headway', 'min_headway', 'max_headway']].fillna(0, inplace=True)
-    route_stats.fillna('NA',  inplace=True)
+    cols_headway = ['mean_headway', 'min_headway', 'max_headway']
+    route_stats[cols_headway] = route_stats[cols_headway].fillna(0)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']], on='route_id', how='left')
 
-    # Convert route_stats DataFrame to JSON and return it
-    route_stats_json = route_stats.to_dict(orient='records')
-    return jsonify({'route_stats': route_stats_json})
-
-def classify_time_of_day(start_time):
-    """Classify time of day based on the start_time (HH:MM:SS)."""
-    hour = int(start_time.split(":")[0])
-    
-    if 4 <= hour < 8:
-        return 'Morning'
-    elif 8 <= hour < 12:
-        return "Peak Morning"
-    elif 12 <= hour < 16:
-        return 'Afternoon'
-    elif 16 <= hour < 20:
-        return 'Peak Evening'
-    elif 20 <=  hour < 24:
-        return 'Night'
-    else:
-        return 'Mid Night'
-
-def classify_time_period(start_time):
-    """Classify time period based on the start_time (HH:MM:SS)."""
-    hour = int(start_time.split(":")[0])
+    # The route_stats DataFrame is encoded column by column, NaN as null
+    return jsonify({'route_stats': route_stats})
 
-    for i in range(0, 23, 2):
-        if i <= hour < i + 2:
-            return f'{i}:00-{i+1}:59'
-  
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """
+    API to get the hit/miss counters of the per-date route_stats cache.
+    """
+    return jsonify({'route_stats': route_stats_cache.stats()}), 200
 
 @app.route('/api/trip_stats', methods=['GET'])
 def get_trip_stats():
@@ -259,20 +237,17 @@ def get_trip_stats():
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
     # Compute trip_stats
-    trip_stats = feed.compute_trip_stats()
-
-    # Add time of day classification
-    trip_stats['time_of_day'] = trip_stats['start_time'].apply(classify_time_of_day)
-    trip_stats['time_period'] = trip_stats['start_time'].apply(classify_time_period)
+    trip_stats = cached_trip_stats(feed)
 
-    # Now we can analyze trip duration and speed by time of day
-    trip_duration_analysis = trip_stats.groupby('time_of_day').agg({
+    # Now we can analyze trip duration and speed by time of day, time_of_day and
+    # time_period are categorical columns of the cached trip_stats
+    trip_duration_analysis = trip_stats.groupby('time_of_day', observed=True).agg({
         'trip_id': ['count'],
         'duration': ['mean', 'min', 'max'],  # Analyze duration (in minutes)
         'speed': ['mean', 'min', 'max']     # Analyze speed (km/h)
     }).reset_index()
 
-    trip_period_analysis = trip_stats.groupby("time_period").agg({
+    trip_period_analysis = trip_stats.groupby("time_period", observed=True).agg({
         'trip_id': ['count'],
         'duration': ['mean', 'min', 'max'],  # Analyze duration (in minutes)
         'speed': ['mean', 'min', 'max'] 
@@ -282,19 +257,17 @@ def get_trip_stats():
     trip_period_cols = ['mean_duration', 'min_duration', 'max_duration', 'mean_speed', 'min_speed', 'max_speed']
 
     
-    # Convert analysis DataFrame to JSON
+    # Round the analysis DataFrames, jsonify encodes them
     trip_duration_analysis.columns = ['time_of_day', 'num_trips', 'mean_duration', 'min_duration', 'max_duration',
                                       'mean_speed', 'min_speed', 'max_speed']
     trip_duration_analysis[trip_duration_cols] = trip_duration_analysis[trip_duration_cols].round(2)
-    trip_duration_analysis_json = trip_duration_analysis.to_dict(orient='records')
 
     trip_period_analysis.columns = ['period_time', 'num_trips', 'mean_duration', 'min_duration', 'max_duration',
                                       'mean_speed', 'min_speed', 'max_speed']
     trip_period_analysis[trip_period_cols] = trip_period_analysis[trip_period_cols].round(2)
-    trip_period_analysis_json = trip_period_analysis.to_dict(orient='records')
     
-    return jsonify({'trip_duration_analysis': trip_duration_analysis_json, 
-                    'trip_period_analysis': trip_period_analysis_json})
+    return jsonify({'trip_duration_analysis': trip_duration_analysis, 
+                    'trip_period_analysis': trip_period_analysis})
 
 
 @app.route('/api/frequent_routes', methods=['GET'])
@@ -308,20 +281,15 @@ def get_frequent_routes():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    # Compute trip_stats
-    trip_stats = feed.compute_trip_stats()
-
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']])
 
     frequent_routes = route_stats.sort_values(by=['max_headway', 'min_headway']).reset_index(drop=True)
     most_frequent_routes =  frequent_routes.head(10)
     least_frequent_routes =  frequent_routes.iloc[-10::-1]
 
-    most_frequent_routes_json =  most_frequent_routes.to_dict(orient='records')
-    least_frequent_routes_json =  least_frequent_routes.to_dict(orient='records')
-    return jsonify({'most_frequent_routes': most_frequent_routes_json, 
-                    'least_frequent_routes': least_frequent_routes_json}), 200
+    return jsonify({'most_frequent_routes': most_frequent_routes, 
+                    'least_frequent_routes': least_frequent_routes}), 200
 
 @app.route('/api/shortest_longest_routes', methods=['GET'])
 def get_shortest_longest_routes():
@@ -333,18 +301,15 @@ def get_shortest_longest_routes():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    # Compute trip_stats
-    trip_stats = feed.compute_trip_stats()
-
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats['mean_trip_distance'] = route_stats['mean_trip_distance'].round(2)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']],on='route_id', how='left')
 
     shortest_routes = route_stats.sort_values(by='mean_trip_distance').head(10)
     longest_routes = route_stats.sort_values(by='mean_trip_distance', ascending=False).head(10)
 
-    return jsonify({'shortest_routes': shortest_routes.to_dict(orient='records'), 
-                    'longest_routes': longest_routes.to_dict(orient='records')})
+    return jsonify({'shortest_routes': shortest_routes, 
+                    'longest_routes': longest_routes})
 
 @app.route('/api/slowest_fastest_routes', methods=['GET'])
 def get_slowest_fastest_routes():
@@ -355,10 +320,7 @@ def get_slowest_fastest_routes():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    # Compute trip_stats
-    trip_stats = feed.compute_trip_stats()
-
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats['service_speed'] = route_stats['service_speed'].round(2)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']])
 
@@ -366,8 +328,8 @@ def get_slowest_fastest_routes():
     fastest_routes = route_stats.sort_values(by='service_speed', ascending=False).head(10)
 
     return jsonify({
-        'slowest_routes': slowest_routes.to_dict(orient='records'),
-        'fastest_routes': fastest_routes.to_dict(orient='records')
+        'slowest_routes': slowest_routes,
+        'fastest_routes': fastest_routes
     }), 200
 
 
@@ -380,16 +342,13 @@ def get_peak_hour_traffic():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    trip_stats = feed.compute_trip_stats()
+    trip_stats = cached_trip_stats(feed)
 
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']],on='route_id', how='left')
 
-    trip_stats['time_of_day'] = trip_stats['start_time'].apply(classify_time_of_day)
-    trip_stats['time_period'] = trip_stats['start_time'].apply(classify_time_period)
-
     # routes with most traffic during peak hours
-    peak_hour_trips =  trip_stats[trip_stats['time_of_day'].str.contains("peak", case=False)]
+    peak_hour_trips =  trip_stats[trip_stats['time_of_day'].str.contains("peak", case=False, na=False)]
     peak_hour_routes = peak_hour_trips.groupby('route_id').agg({
         'trip_id': 'count',
         'time_period': 'unique',
@@ -397,7 +356,7 @@ def get_peak_hour_traffic():
     peak_hour_routes['time_period'] = peak_hour_routes['time_period'].apply(lambda x: list(x))
     peak_hour_routes = peak_hour_routes.merge(route_stats)
 
-    return  jsonify({'peak_hour_routes': peak_hour_routes.to_dict(orient='records')}), 200
+    return  jsonify({'peak_hour_routes': peak_hour_routes}), 200
 
 
 @app.route('/api/distance_coverage_optimization', methods=['GET'])
@@ -409,18 +368,13 @@ def get_distance_coverage_optimization():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    trip_stats = feed.compute_trip_stats()
-
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']])
 
-    trip_stats['time_of_day'] = trip_stats['start_time'].apply(classify_time_of_day)
-    trip_stats['time_period'] = trip_stats['start_time'].apply(classify_time_period)
-
     inefficient_routes = route_stats[(route_stats['mean_trip_distance'] > 15) & (route_stats['num_trips'] < 10)]
     inefficient_routes.sort_values(by='mean_trip_distance', ascending=False)
 
-    return  jsonify({'inefficient_routes': inefficient_routes.to_dict(orient='records')}), 200
+    return  jsonify({'inefficient_routes': inefficient_routes}), 200
 
 @app.route('/api/route_efficiency',  methods=['GET'])
 def  get_route_efficiency():
@@ -431,14 +385,11 @@ def  get_route_efficiency():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYYMMDD.'}), 400
     
-    trip_stats = feed.compute_trip_stats()
+    trip_stats = cached_trip_stats(feed)
 
-    route_stats = feed.compute_route_stats(trip_stats, dates=[date])
+    route_stats = cached_route_stats(feed, date)
     route_stats = route_stats.merge(feed.routes[['route_id', 'route_long_name', 'route_color']])
 
-    trip_stats['time_of_day'] = trip_stats['start_time'].apply(classify_time_of_day)
-    trip_stats['time_period'] = trip_stats['start_time'].apply(classify_time_period)
-
     route_trips = trip_stats.groupby(by=['route_id']).agg(
         avg_stops=('num_stops', 'mean'),
         avg_trip_speed=('speed', 'mean')
@@ -459,35 +410,20 @@ def  get_route_efficiency():
                                        0.1 * (route_stats['mean_headway'] / max_headway))
     
     return  jsonify({
-        'most_efficient_routes': route_stats.sort_values(by=['efficiency_score'], ascending=False).iloc[:10].to_dict(orient='records'),
-        'least_efficient_routes':  route_stats.sort_values(by=['efficiency_score'], ascending=True).iloc[:10].to_dict(orient='records')
+        'most_efficient_routes': route_stats.sort_values(by=['efficiency_score'], ascending=False).iloc[:10],
+        'least_efficient_routes':  route_stats.sort_values(by=['efficiency_score'], ascending=True).iloc[:10]
     }), 200
 
-def clean_time(x):
-    date = datetime.datetime.today()
-    hr, min, sec = x.split(':')
-    if x.startswith('24'):
-        date = date + datetime.timedelta(days=1)
-        hr = '00'
-    x = f"{date.strftime('%Y-%m-%d')} {hr}:{min}:{sec}"
-    return x
-
 def get_in_between_stops(trip_id, start_stop_id, end_stop_id):
-    stop_times = feed.stop_times
+    # Already ordered by stop_sequence, copied since the columns below are added to it
+    trip_stop_times = feed_index(feed).stop_times_for_trip(trip_id).copy()
 
-    trip_stop_times = stop_times[stop_times['trip_id'] == trip_id].sort_values(by=['stop_sequence'])
-
-    trip_stop_times['at'] = pd.to_datetime(trip_stop_times['arrival_time'].apply(clean_time))
-    trip_stop_times['dt'] = pd.to_datetime(trip_stop_times['departure_time'].apply(clean_time))
-    # print(trip_stop_times)
-
-    trip_stop_times['time_diff'] = trip_stop_times.groupby(by="trip_id")['at'].diff().dt.total_seconds() / 60
+    # arrival_secs is the integer arrival time parsed at load, so the diff stays on plain integers
+    trip_stop_times['time_diff'] = trip_stop_times['arrival_secs'].replace(NO_TIME, np.nan).diff() / 60
     trip_stop_times['time_diff'] = trip_stop_times['time_diff'].fillna(0)
 
     trip_stop_times['shape_dist_traveled'] = trip_stop_times['shape_dist_traveled'].fillna(0)
 
-    trip_stop_times = trip_stop_times.drop(['at', 'dt'], axis=1)
-
     start_sequence = trip_stop_times[trip_stop_times['stop_id'] == start_stop_id]['stop_sequence'].values[0]
     end_sequence = trip_stop_times[trip_stop_times['stop_id'] == end_stop_id]['stop_sequence'].values[0]
 
@@ -501,10 +437,7 @@ def get_in_between_stops(trip_id, start_stop_id, end_stop_id):
     return in_between_stops_details
 
 def get_stop_id(stop_name):
-    stop_row = feed.stops[feed.stops['stop_name'] == stop_name]
-    if not stop_row.empty:
-        return stop_row['stop_id'].values[0]
-    return None
+    return feed_index(feed).stop_id(stop_name)
 
 @app.route('/api/trips_between_stops', methods=['GET'])
 def trips_between_stops():
@@ -520,15 +453,13 @@ def trips_between_stops():
     if not start_stop_id or not end_stop_id:
         return jsonify({"error": "Invalid stop names"}), 404
     
-    trips_start_id = feed.stop_times[feed.stop_times['stop_id'] == start_stop_id]['trip_id'].unique()
-    trips_end_id = feed.stop_times[feed.stop_times['stop_id'] == end_stop_id]['trip_id'].unique()
-
-    possible_trips = set(trips_start_id).intersection(set(trips_end_id))
+    # Trips calling at the start stop before the end stop, from the stop -> trips index
+    possible_trips = feed_index(feed).trips_between(start_stop_id, end_stop_id)
 
     if len(possible_trips) == 0:
         return jsonify({"message": "No routes found between the given stops"}), 404
     
-    trips_stats = feed.compute_trip_stats()
+    trips_stats = cached_trip_stats(feed)
     
     trip_ids = list(possible_trips)
     trip_route_infos = trips_stats[trips_stats['trip_id'].isin(trip_ids)].merge(feed.routes[['route_id', 'route_short_name', 'route_long_name', 'route_color']], on='route_id', how='left')
@@ -539,7 +470,7 @@ def trips_between_stops():
         'start_stop_id':  start_stop_id,
         'end_stop_id': end_stop_id,
         'total_results':  len(trip_ids),
-        'trips_between_stops': trip_route_infos.to_dict(orient='records')
+        'trips_between_stops': trip_route_infos
     }), 200
 
 @app.route('/api/routes_between_stops', methods=['GET'])
@@ -548,18 +479,23 @@ def routes_between_stops():
     start_stop_id = request.args.get('start_stop_id')
     end_stop_id = request.args.get('end_stop_id')
 
-    trips_stats = feed.compute_trip_stats()
+    trips_stats = cached_trip_stats(feed)
 
     trip_route_info = trips_stats[trips_stats['trip_id'] == trip_id].merge(feed.routes[['route_id', 'route_short_name', 'route_long_name', 'route_color']], on='route_id', how='left')
 
     shape_id = trip_route_info['shape_id'].values[0]
-    route_shape = feed.shapes[feed.shapes['shape_id'] == trip_route_info['shape_id'].values[0]].sort_values(
-        by=['shape_pt_sequence']
-    ).reset_index(drop=True)
-    route_shape = route_shape[['shape_pt_lat', 'shape_pt_lon']].values.tolist()
+    # Shape points are a slice of the shape store, already in sequence order
+    route_shape = shape_store(feed).coordinates(shape_id).tolist()
 
     in_between_stops = get_in_between_stops(trip_id, start_stop_id, end_stop_id)
 
+    # Part of the shape travelled between the two stops, by shape distance
+    segment_shape = shape_store(feed).between(shape_id, in_between_stops.iloc[0]['shape_dist_traveled'],
+                                              in_between_stops.iloc[-1]['shape_dist_traveled']).tolist()
+    if len(segment_shape) < 2:
+        # The trip gives no stop distances to cut the shape with
+        segment_shape = route_shape
+
     
     total_distance = in_between_stops.iloc[-1]['shape_dist_traveled']
     total_duration = in_between_stops.iloc[-1]['time_diff'].sum()
@@ -567,14 +503,86 @@ def routes_between_stops():
     expected_speed_kmph = total_distance / total_duration
 
     return jsonify({
-        'trip_route_info':  trip_route_info.to_dict(orient='records'),
+        'trip_route_info':  trip_route_info,
         'route_shape': route_shape,
-        'in_between_stops':  in_between_stops.to_dict(orient='records'),
+        'segment_shape': segment_shape,
+        'in_between_stops':  in_between_stops,
         'total_distance':  total_distance,
         'expected_duration': total_duration,
         'expected_speed_kmph': expected_speed_kmph
     }), 200
 
+@app.route('/api/plan', methods=['GET'])
+def plan_journey():
+    """
+    API to plan journeys with transfers between two stops, leaving after a given time.
+    Returns the earliest arriving journey for every number of transfers up to max_transfers.
+    """
+    date = request.args.get('date')
+    departure_time = request.args.get('time', '08:00:00')
+    max_transfers = request.args.get('max_transfers', 3)
+
+    start_stop_id = request.args.get('start_stop_id') or get_stop_id(request.args.get('start_stop_name'))
+    end_stop_id = request.args.get('end_stop_id') or get_stop_id(request.args.get('end_stop_name'))
+
+    if not start_stop_id or not end_stop_id:
+        return jsonify({"error": "start_stop_id/start_stop_name and end_stop_id/end_stop_name are required"}), 400
+
+    try:
+        journeys = plan_journeys(feed, [start_stop_id], [end_stop_id], date, departure_time, max_transfers)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid date, time or max_transfers. Use YYYYMMDD and HH:MM:SS., {e}'}), 400
+
+    if not journeys:
+        return jsonify({"message": "No journeys found between the given stops"}), 404
+
+    return jsonify({
+        'start_stop_id': start_stop_id,
+        'end_stop_id': end_stop_id,
+        'date': date,
+        'time': departure_time,
+        'journeys': journeys
+    }), 200
+
+@app.route('/api/isochrone', methods=['GET'])
+def isochrone():
+    """
+    API for the stops reachable from an origin stop or coordinate, grouped into
+    travel-time bands in minutes, for departures within a time window.
+    Set polygons=true to also get one GeoJSON area per band.
+    """
+    date = request.args.get('date')
+    departure_time = request.args.get('time', '08:00:00')
+    stop_id = request.args.get('stop_id') or get_stop_id(request.args.get('stop_name'))
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+
+    if not stop_id and (lat is None or lon is None):
+        return jsonify({"error": "stop_id/stop_name or lat and lon are required"}), 400
+
+    try:
+        bands = [int(band) for band in request.args.get('bands', '').split(',') if band] or DEFAULT_BANDS
+        result = compute_isochrone(feed, date, departure_time,
+                                   window_minutes=int(request.args.get('window', 0)),
+                                   stop_id=stop_id, lat=lat, lon=lon,
+                                   max_transfers=request.args.get('max_transfers', 3),
+                                   bands=bands,
+                                   polygons=request.args.get('polygons', 'false').lower() == 'true')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid date, time, window, bands or max_transfers. Use YYYYMMDD and HH:MM:SS., {e}'}), 400
+
+    if result is None:
+        return jsonify({"message": "No stops found near the given origin"}), 404
+
+    return jsonify({
+        'stop_id': stop_id,
+        'lat': lat,
+        'lon': lon,
+        'date': date,
+        'time': departure_time,
+        **result
+    }), 200
+
 
 if  __name__ == '__main__':
   app.run(debug=True)
@@ -1,16 +1,21 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import pandas as pd
 import folium
 from folium.plugins import HeatMap, MarkerCluster
 from shapely.geometry import Point
 from flask_cors import CORS
-import matplotlib.pyplot as plt
-import seaborn as sns
 import plotly.express as px
 import numpy as np
 from shapely.geometry import Point, Polygon, MultiPolygon
 import os
 
+import tempfile
+
+from delay_cube import HIST_LABELS
+from delay_distribution import render_distribution
+from delay_snapshot import DelayStore
+from mta_ingest import STORE_DIR, build_store, store_complete
+
 from sklearn.linear_model import LinearRegression, LogisticRegression
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
@@ -21,124 +26,180 @@ matplotlib.use('Agg')  # Use non-GUI backend to avoid MacOS threading error
 app = Flask(__name__)
 CORS(app)
 
-def modify_time(row):
-    if type(row) is not float: 
-        time_parts = row.split(":")
-        time_parts[0] = str(int(time_parts[0]) % 24)
-        return ":".join(time_parts)
-    return np.nan
-
-
-def classify_time_of_day(hour):
-    if 8 <= hour < 10:
-        return 'Rush Hour (Morning)'
-    elif 6 <= hour < 11:
-        return 'Morning'
-    elif 12 <= hour < 16:
-        return 'Afternoon'
-    elif 17 <= hour < 20:
-        return 'Rush Hour (Evening)'
-    elif 20 <= hour <= 23:
-        return 'Night'
-    else:
-        return 'Other'
-
-
 def load_and_clean_data():
     filename = "/Users/suyash/frontend/app/mta_1712.csv"
-    raw_df = pd.read_csv(filename, on_bad_lines="skip")
-    data_df_0 = raw_df.dropna(subset=['OriginName', 'NextStopPointName']).reset_index(drop=True)
+    # The CSV is cleaned chunk by chunk into a Parquet store partitioned by date
+    # the first time; later starts only read the store. A store without its
+    # completion marker is left from an interrupted ingest and is built again
+    if not store_complete(STORE_DIR):
+        build_store(filename, STORE_DIR)
+    return store.load()
 
-    data_df_0['RecordedDate'] = data_df_0.apply(lambda x: x['RecordedAtTime'].split()[0], axis=1)
-    data_df_0['ModifiedScheduledTime'] = (data_df_0['RecordedDate'] + " " + data_df_0['ScheduledArrivalTime'].apply(modify_time))
-    
-    # Modify and clean timestamps
-    data_df_0['RecordedAtTime'] = pd.to_datetime(data_df_0.RecordedAtTime)
-    data_df_0['RecordedDate'] = pd.to_datetime(data_df_0.RecordedDate)
-    data_df_0['ExpectedArrivalTime'] = pd.to_datetime(data_df_0.ExpectedArrivalTime, errors='coerce')
-    data_df_0['ModifiedScheduledTime'] = pd.to_datetime(data_df_0.ModifiedScheduledTime, errors='coerce')
 
-    data_df_0['ExpectedArrivalTime'] = data_df_0['ExpectedArrivalTime'].fillna(data_df_0['ModifiedScheduledTime'])
-    data_df_0.dropna(subset=['ModifiedScheduledTime'], inplace=True)
+# Snapshot of the data served, swapped as a whole when /ingest appends a batch
+store = DelayStore(STORE_DIR)
+load_and_clean_data()
 
-    data0 = data_df_0.copy()
 
-    data0['Delay'] = (data0['ExpectedArrivalTime'] - data0['ModifiedScheduledTime']).dt.total_seconds() / 60.0
-    data0['Day'] = data0['RecordedAtTime'].dt.day
-    data0['DayOfWeek'] = data0['RecordedAtTime'].dt.dayofweek
-    data0['Hour'] = data0['RecordedAtTime'].dt.hour
+def _int_list(name):
+    value = request.args.get(name)
+    return [int(part) for part in value.split(',')] if value else None
 
-    data0['TimeOfDay'] = data0['Hour'].apply(classify_time_of_day)
 
-    Q1 = data0['Delay'].quantile(0.25)
-    Q3 = data0['Delay'].quantile(0.75)
-    
-    IQR = Q3 - Q1
-    
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-
-    data_df = data0[(data0['Delay'] >= lower_bound) & (data0['Delay'] <= upper_bound)]
-    
-    return data_df
-
-
-# Initialize data globally for reuse
-data = load_and_clean_data()
+def cube_mask(cube):
+    """
+    Cells of the delay cube selected by the start_date, end_date, hour,
+    day_of_week, route and origin request arguments (comma lists where plural).
+    """
+    routes = request.args.get('route')
+    origins = request.args.get('origin')
+    return cube.mask(
+        start_date=request.args.get('start_date'),
+        end_date=request.args.get('end_date'),
+        hours=_int_list('hour'),
+        days_of_week=_int_list('day_of_week'),
+        routes=routes.split(',') if routes else None,
+        origins=origins.split(',') if origins else None,
+    )
 
 
 @app.route('/route-analysis', methods=['GET'])
 def route_analysis():
-    route_analysis = data.groupby('PublishedLineName').agg(
-        AvgDelays=('Delay', 'mean'),
-        TotalTrips=('VehicleRef', 'count')
-    ).reset_index()
+    # Rolled up from the delay cube, optionally filtered (see cube_mask)
+    cube = store.current.cube
+    try:
+        keep = cube_mask(cube)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    routes = cube.rollup(['PublishedLineName'], keep)
+    route_analysis = routes.rename(columns={'mean': 'AvgDelays', 'vehicles': 'TotalTrips'})
     
-    return jsonify(route_analysis.to_dict(orient='records'))
+    return jsonify(route_analysis[['PublishedLineName', 'AvgDelays', 'TotalTrips']].to_dict(orient='records'))
 
 @app.route('/delay-distribution', methods=['GET'])
 def delay_distribution():
-    plt.figure(figsize=(10, 6))
-    sns.histplot(data=data, x='Delay', bins=100, kde=True)
-    plt.title('Distribution of Delays')
-    plt.xlabel('Delay (minutes)')
-    plt.ylabel('Frequency')
-    plt.savefig('static/delay_distribution.png')
-    
-    return jsonify({'message': 'Delay distribution graph saved as PNG', 'path': '/static/delay_distribution.png'})
+    # Histogram and KDE of Delay from the snapshot's binned counts, for the comma separated
+    # routes and hours given (all by default); image=1 also renders it, cached by content
+    distribution = store.current.distribution
+    routes = request.args.get('route')
+    try:
+        hours = _int_list('hour')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    summary = distribution.summary(distribution.select(routes.split(',') if routes else None, hours))
+
+    if request.args.get('image', '0') in ('1', 'true'):
+        path = render_distribution(summary, os.path.join(app.static_folder, 'delay_distribution'))
+        summary['path'] = f'/static/delay_distribution/{path.name}'
+    return jsonify(summary)
 
 
 @app.route('/delayed-origins-heatmap', methods=['GET'])
 def delayed_origins_heatmap():
-    most_imp_origins = data.groupby('OriginName').agg(
-        AvgDelay=('Delay', 'mean'),
-        TotalTrips=('VehicleRef', 'count')
-    ).reset_index().sort_values(by='AvgDelay', ascending=False).head(10)
+    cube = store.current.cube
+    try:
+        keep = cube_mask(cube)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    most_imp_origins = cube.rollup(['OriginName'], keep).rename(
+        columns={'mean': 'AvgDelay', 'vehicles': 'TotalTrips'}
+    ).sort_values(by='AvgDelay', ascending=False).head(10)
+    # Coordinates of the origins, kept by the cube
+    most_imp_origins = most_imp_origins.join(cube.origins, on='OriginName')
 
     # Check if the required columns exist
-    if 'OriginLat' in most_imp_origins.columns and 'OriginLong' in most_imp_origins.columns:
+    if most_imp_origins[['OriginLat', 'OriginLong']].notna().all(axis=None):
         m = folium.Map(location=[40.7128, -74.0060], zoom_start=12)
-        HeatMap(most_imp_origins[['OriginLat', 'OriginLong', 'AvgDelay']].values, radius=10).add_to(m)
+        HeatMap(most_imp_origins[['OriginLat', 'OriginLong', 'AvgDelay']].values.tolist(), radius=10).add_to(m)
         m.save('static/heatmap.html')
 
-        return jsonify({'message': 'Heatmap created', 'path': '/static/heatmap.html'})
+        origins = most_imp_origins[['OriginName', 'OriginLat', 'OriginLong', 'AvgDelay', 'TotalTrips']]
+        return jsonify({'message': 'Heatmap created', 'path': '/static/heatmap.html',
+                        'origins': origins.astype({'OriginName': str}).to_dict(orient='records')})
     else:
         # Handle the case where the columns are missing
         return jsonify({"error": "Columns 'OriginLat' and 'OriginLong' are missing from the data."}), 400
 
 
+@app.route('/delay-cube', methods=['GET'])
+def delay_cube():
+    # Roll-up of the delay cube by the comma separated columns of `by`, filtered like /route-analysis
+    cube = store.current.cube
+    by = [column for column in request.args.get('by', '').split(',') if column]
+    allowed = ['PublishedLineName', 'OriginName', 'RecordedDate', 'Hour', 'DayOfWeek', 'TimeOfDay']
+    if any(column not in allowed for column in by):
+        return jsonify({'error': f'by must be a comma separated list of {allowed}'}), 400
+    try:
+        keep = cube_mask(cube)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rollup = cube.rollup(by, keep, histogram=True)
+    if 'RecordedDate' in rollup:
+        rollup['RecordedDate'] = rollup['RecordedDate'].dt.strftime('%Y-%m-%d')
+    rollup = rollup.astype({column: str for column in ('PublishedLineName', 'OriginName', 'TimeOfDay') if column in by})
+    rollup = rollup.astype(object).where(rollup.notna(), None)
+    return jsonify({'histogram_bins': HIST_LABELS, 'groups': rollup.to_dict(orient='records')})
+
+
 @app.route('/trips', methods=['GET'])
 def get_trips():
-    date = request.args.get('date', None)
-    min_delay = float(request.args.get('min_delay', 0))
-    
-    filtered_data = data[data['Delay'] >= min_delay]
-    if date:
-        filtered_data = filtered_data[filtered_data['RecordedAtTime'].dt.date == pd.to_datetime(date).date()]
-    
-    trips = filtered_data[['VehicleRef', 'OriginName', 'DestinationName', 'Delay']].to_dict(orient='records')
-    
-    return jsonify(trips)
+    # Trips of a date (all dates when missing) with Delay >= min_delay, ordered by
+    # date then Delay, paged with offset and limit and streamed as a JSON array
+    try:
+        date = request.args.get('date', None)
+        if date:
+            pd.Timestamp(date)
+        min_delay = float(request.args.get('min_delay', 0))
+        offset = int(request.args.get('offset', 0))
+        limit = request.args.get('limit', None)
+        limit = int(limit) if limit is not None else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({'error': 'offset and limit must not be negative'}), 400
+
+    trips = store.current.trips
+    total, page = trips.query(date or None, min_delay, offset, limit)
+
+    response = Response(stream_with_context(trips.iter_json(page)), mimetype='application/json')
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    # A CSV batch in the MTA layout, as a multipart 'file' upload or as the request body
+    upload = request.files.get('file')
+    with tempfile.NamedTemporaryFile(suffix='.csv') as batch:
+        if upload is not None:
+            upload.save(batch)
+        else:
+            batch.write(request.get_data())
+        batch.flush()
+        try:
+            rows = store.append(batch.name)
+        except (ValueError, pd.errors.ParserError) as e:
+            return jsonify({'error': f'Could not ingest the batch: {e}'}), 400
+
+    snapshot = store.current
+    return jsonify({'message': 'Batch ingested', 'rows_added': rows, 'version': snapshot.version,
+                    'total_rows': len(snapshot.raw)})
+
+
+@app.route('/delay-aggregates', methods=['GET'])
+def delay_aggregates():
+    # Over every cleaned row (outliers included), from the incrementally updated aggregates
+    aggregates = store.current.aggregates
+    route = request.args.get('route')
+    hour = request.args.get('hour', type=int)
+    summary = aggregates.summary(route, request.args.get('origin'), hour)
+
+    sketch = aggregates.route_sketches.get(route) if route else aggregates.sketch
+    quantiles = [0.5, 0.9, 0.95, 0.99]
+    values = sketch.quantile(quantiles) if sketch is not None else [np.nan] * len(quantiles)
+    summary['quantiles'] = {str(q): None if np.isnan(v) else round(float(v), 2) for q, v in zip(quantiles, values)}
+    return jsonify(summary)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+"""
+Materialized delay cube of the served MTA rows.
+
+One cell per (PublishedLineName, OriginName, date, hour) that has rows, with
+its DayOfWeek and TimeOfDay, the number of rows and of vehicle records, the
+sum and sum of squares of Delay and a histogram of Delay over HIST_EDGES. The
+cube is built with the snapshot it summarizes, and the analysis endpoints
+answer by filtering cells and rolling them up instead of scanning the rows.
+"""
+import numpy as np
+import pandas as pd
+
+CELL_KEYS = ['PublishedLineName', 'OriginName', 'RecordedDate', 'Hour']
+# Delay histogram bin edges in minutes, open ended at both sides
+HIST_EDGES = np.array([-10, -5, -2, 0, 1, 2, 3, 5, 7, 10, 15, 20, 30], dtype=np.float64)
+HIST_LABELS = ([f'< {HIST_EDGES[0]:g}'] +
+               [f'{lo:g} to {hi:g}' for lo, hi in zip(HIST_EDGES[:-1], HIST_EDGES[1:])] +
+               [f'>= {HIST_EDGES[-1]:g}'])
+
+
+class DelayCube:
+    """
+    Delay counts, sums, sums of squares and histograms per cell, with filters and roll-ups.
+    """
+
+    def __init__(self, cells, hist, origins):
+        self.cells = cells
+        self.hist = hist
+        # Mean coordinates of every origin, for the maps
+        self.origins = origins
+
+    @classmethod
+    def build(cls, data):
+        data = data.dropna(subset=['Delay'])
+        codes = []
+        uniques = []
+        for key in CELL_KEYS:
+            key_codes, key_uniques = pd.factorize(data[key], sort=True)
+            codes.append(key_codes.astype(np.int64))
+            uniques.append(key_uniques)
+        cell_of_row = np.zeros(len(data), dtype=np.int64)
+        for key_codes, key_uniques in zip(codes, uniques):
+            cell_of_row = cell_of_row * (len(key_uniques) + 1) + key_codes + 1
+        cell_ids, first_row, cell_of_row = np.unique(cell_of_row, return_index=True, return_inverse=True)
+
+        delay = data['Delay'].to_numpy(dtype=np.float64)
+        num_cells = len(cell_ids)
+        cells = pd.DataFrame({key: data[key].to_numpy()[first_row] for key in CELL_KEYS})
+        for key in CELL_KEYS:
+            if isinstance(data[key].dtype, pd.CategoricalDtype):
+                cells[key] = pd.Categorical(cells[key], categories=data[key].cat.categories)
+        cells = cells.assign(
+            DayOfWeek=data['DayOfWeek'].to_numpy()[first_row],
+            TimeOfDay=data['TimeOfDay'].array.take(first_row),
+            count=np.bincount(cell_of_row, minlength=num_cells),
+            vehicles=np.bincount(cell_of_row, weights=data['VehicleRef'].notna().to_numpy(), minlength=num_cells)
+            .astype(np.int64),
+            sum=np.bincount(cell_of_row, weights=delay, minlength=num_cells),
+            sumsq=np.bincount(cell_of_row, weights=delay * delay, minlength=num_cells),
+        )
+        num_bins = len(HIST_EDGES) + 1
+        bins = np.searchsorted(HIST_EDGES, delay, side='right')
+        hist = np.bincount(cell_of_row * num_bins + bins, minlength=num_cells * num_bins) \
+            .reshape(num_cells, num_bins).astype(np.int32)
+
+        origins = data.groupby('OriginName', observed=True)[['OriginLat', 'OriginLong']].mean()
+        return cls(cells, hist, origins)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def mask(self, start_date=None, end_date=None, hours=None, days_of_week=None, routes=None, origins=None):
+        """
+        Cells within the (inclusive) date range, hours, days of week, routes and origins given.
+        """
+        cells = self.cells
+        keep = np.ones(len(cells), dtype=bool)
+        if start_date is not None:
+            keep &= (cells['RecordedDate'] >= pd.Timestamp(start_date)).to_numpy()
+        if end_date is not None:
+            keep &= (cells['RecordedDate'] <= pd.Timestamp(end_date)).to_numpy()
+        for column, values in (('Hour', hours), ('DayOfWeek', days_of_week), ('PublishedLineName', routes),
+                               ('OriginName', origins)):
+            if values is not None:
+                keep &= cells[column].isin(values).to_numpy()
+        return keep
+
+    def rollup(self, by, keep=None, histogram=False):
+        """
+        Count, vehicles, mean and standard deviation of Delay per group of the by
+        columns over the kept cells, and the summed histograms when asked.
+        """
+        cells = self.cells if keep is None else self.cells[keep]
+        columns = ['count', 'vehicles', 'sum', 'sumsq']
+        if by:
+            grouped = cells.groupby(by, observed=True, sort=True)
+            totals = grouped[columns].sum()
+            group_of_cell = grouped.ngroup().to_numpy()
+        else:
+            totals = cells[columns].sum().to_frame().T
+            group_of_cell = np.zeros(len(cells), dtype=np.int64)
+
+        count = totals['count'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = totals['sum'].to_numpy() / count
+            std = np.sqrt(np.maximum(totals['sumsq'].to_numpy() / count - mean * mean, 0))
+        result = totals[['count', 'vehicles']].assign(mean=mean, std=std).reset_index(drop=not by)
+        if histogram:
+            hist = self.hist if keep is None else self.hist[keep]
+            sums = np.zeros((len(result), hist.shape[1]), dtype=np.int64)
+            grouped_cells = group_of_cell >= 0
+            np.add.at(sums, group_of_cell[grouped_cells], hist[grouped_cells])
+            result['histogram'] = sums.tolist()
+        return result
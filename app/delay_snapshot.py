@@ -0,0 +1,201 @@
+"""
+Serving snapshot of the MTA delay data, with incremental appends.
+
+A DelaySnapshot is immutable: the cleaned rows, the outlier-filtered rows the
+endpoints read with their delay cube, trip index and delay distribution, and
+the per (route, origin, hour) delay aggregates with streaming quantile
+sketches. DelayStore.append ingests a new CSV batch into a staging directory
+and folds only the new rows into copies of the aggregates. The outlier filter
+and the views built on it are recomputed over the whole dataset, as the new
+rows move the outlier bounds. Once the next snapshot is built the batch is
+moved into the Parquet store and the reference swapped, so requests in flight
+keep the snapshot they started with.
+"""
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from delay_cube import DelayCube
+from delay_distribution import DelayDistribution
+from mta_ingest import STORE_DIR, ingest_chunks, load_store, publish_parts, remove_delay_outliers
+from trip_index import TripIndex
+
+AGGREGATE_KEYS = ['PublishedLineName', 'OriginName', 'Hour']
+# Delay sketch bins: 0.1 minute wide from 6 hours early to 12 hours late
+SKETCH_MIN, SKETCH_MAX, SKETCH_WIDTH = -360.0, 720.0, 0.1
+
+
+class DelaySketch:
+    """
+    Mergeable fixed-bin histogram of delays answering quantiles to within one
+    bin width; delays outside the range are counted in the first or last bin.
+    """
+
+    num_bins = int(round((SKETCH_MAX - SKETCH_MIN) / SKETCH_WIDTH))
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(self.num_bins, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def bin_of(cls, delays):
+        bins = np.floor((np.asarray(delays, dtype=np.float64) - SKETCH_MIN) / SKETCH_WIDTH)
+        return np.clip(bins, 0, cls.num_bins - 1).astype(np.int64)
+
+    def add(self, delays):
+        """
+        Copy of the sketch with the (non-NaN) delays added.
+        """
+        delays = np.asarray(delays, dtype=np.float64)
+        delays = delays[~np.isnan(delays)]
+        return DelaySketch(self.counts + np.bincount(self.bin_of(delays), minlength=self.num_bins))
+
+    def merge(self, other):
+        return DelaySketch(self.counts + other.counts)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, qs):
+        """
+        Approximate delay quantiles, interpolated within the bin, NaN when empty.
+        """
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        cumulative = np.cumsum(self.counts)
+        ranks = qs * total
+        bins = np.minimum(np.searchsorted(cumulative, ranks, side='left'), self.num_bins - 1)
+        before = np.where(bins > 0, cumulative[bins - 1], 0)
+        within = np.where(self.counts[bins] > 0, (ranks - before) / np.maximum(self.counts[bins], 1), 0)
+        return SKETCH_MIN + (bins + np.clip(within, 0, 1)) * SKETCH_WIDTH
+
+
+def concat_rows(frames):
+    """
+    Concatenate cleaned frames keeping their categorical columns categorical
+    (pd.concat falls back to object when the categories differ).
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame()
+    categorical = [column for column in frames[0].columns if isinstance(frames[0][column].dtype, pd.CategoricalDtype)]
+    if len(frames) > 1:
+        for column in categorical:
+            categories = pd.api.types.union_categoricals([frame[column] for frame in frames]).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+class DelayAggregates:
+    """
+    Count, sum and sum of squares of Delay per (route, origin, hour), and a
+    delay sketch overall and per route, over every cleaned row.
+    """
+
+    def __init__(self, totals=None, sketch=None, route_sketches=None):
+        self.totals = totals if totals is not None else pd.DataFrame(
+            columns=['count', 'sum', 'sumsq'], index=pd.MultiIndex.from_tuples([], names=AGGREGATE_KEYS), dtype='float64')
+        self.sketch = sketch or DelaySketch()
+        self.route_sketches = route_sketches or {}
+
+    def update(self, rows):
+        """
+        Copy of the aggregates with the rows folded in; the current ones are left as they are.
+        """
+        rows = rows.dropna(subset=['Delay'])
+        delay = rows['Delay'].astype(np.float64)
+        keys = [rows[key].astype(object) if isinstance(rows[key].dtype, pd.CategoricalDtype) else rows[key]
+                for key in AGGREGATE_KEYS]
+        batch = pd.DataFrame({'count': 1.0, 'sum': delay, 'sumsq': delay * delay}).groupby(keys).sum()
+        totals = batch if self.totals.empty else self.totals.add(batch, fill_value=0)
+
+        route_sketches = dict(self.route_sketches)
+        codes, routes = pd.factorize(rows['PublishedLineName'])
+        bins = DelaySketch.bin_of(delay.to_numpy())
+        # Rows without a route count in the overall sketch only
+        codes, bins = codes[codes >= 0], bins[codes >= 0]
+        counts = np.bincount(codes * DelaySketch.num_bins + bins, minlength=len(routes) * DelaySketch.num_bins)
+        for i, route in enumerate(routes):
+            added = DelaySketch(counts[i * DelaySketch.num_bins:(i + 1) * DelaySketch.num_bins])
+            route_sketches[route] = route_sketches[route].merge(added) if route in route_sketches else added
+        return DelayAggregates(totals.sort_index(), self.sketch.add(delay.to_numpy()), route_sketches)
+
+    def summary(self, route=None, origin=None, hour=None):
+        """
+        Count, mean and standard deviation of Delay over the matching (route, origin, hour) cells.
+        """
+        totals = self.totals
+        for key, value in zip(AGGREGATE_KEYS, (route, origin, hour)):
+            if value is not None:
+                totals = totals[totals.index.get_level_values(key) == value]
+        count, total, sumsq = totals[['count', 'sum', 'sumsq']].sum()
+        if not count:
+            return {'count': 0, 'mean': None, 'std': None}
+        mean = total / count
+        return {'count': int(count), 'mean': float(mean), 'std': float(np.sqrt(max(sumsq / count - mean * mean, 0.0)))}
+
+
+class DelaySnapshot:
+    """
+    Cleaned rows, outlier-filtered rows, their delay cube, trip index and delay
+    distribution and the aggregates of one version of the dataset.
+    """
+
+    def __init__(self, raw, aggregates, version):
+        self.raw = raw
+        self.data = remove_delay_outliers(raw) if len(raw) else raw
+        # Rebuilt in full with every snapshot, as appends move the outlier bounds
+        self.cube = DelayCube.build(self.data)
+        self.trips = TripIndex.build(self.data)
+        self.distribution = DelayDistribution.build(self.data)
+        self.aggregates = aggregates
+        self.version = version
+
+
+class DelayStore:
+    """
+    The Parquet store and the snapshot served from it, appended to in place.
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.current = None
+        self._write_lock = threading.Lock()
+
+    def load(self):
+        raw = load_store(self.store_dir)
+        self.current = DelaySnapshot(raw, DelayAggregates().update(raw), version=0)
+        return self.current
+
+    def append(self, path):
+        """
+        Ingest a CSV batch into the store and swap in a snapshot with its rows,
+        returning the number of rows added. Appends are serialized; readers are not blocked.
+        """
+        with self._write_lock:
+            prefix = f'append-{time.strftime("%Y%m%dT%H%M%S")}-{time.time_ns() % 1_000_000:06d}-'
+            # The batch is written beside the store and only moved in once its
+            # snapshot has built, so a batch that fails never reaches the store
+            Path(self.store_dir).parent.mkdir(parents=True, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix=f'.{prefix}', dir=Path(self.store_dir).parent)
+            try:
+                new_rows = concat_rows(list(ingest_chunks(path, staging_dir, part_prefix=prefix)))
+                if not len(new_rows):
+                    return 0
+                current = self.current
+                raw = concat_rows([current.raw, new_rows]) if current is not None else new_rows
+                aggregates = (current.aggregates if current is not None else DelayAggregates()).update(new_rows)
+                snapshot = DelaySnapshot(raw, aggregates, version=(current.version + 1 if current else 1))
+                publish_parts(staging_dir, self.store_dir)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            # A plain reference swap; requests holding the previous snapshot finish on it
+            self.current = snapshot
+            return len(new_rows)
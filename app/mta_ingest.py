@@ -0,0 +1,197 @@
+"""
+Chunked ingest of the MTA bus position CSV into a Parquet store partitioned by date.
+
+The CSV is read chunk by chunk with only the columns the app uses and explicit
+dtypes (names as categoricals, coordinates as float32). Each chunk is cleaned
+with vectorized parsing and its Delay computed, then appended to the store as
+one file per recorded date, so a month of logs never has to fit in memory as
+raw strings.
+
+Run python mta_ingest.py mta_1712.csv data/mta_store to build the store.
+"""
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / 'data' / 'mta_store'
+CHUNK_SIZE = 1_000_000
+# Written into the store once a full ingest has finished; pyarrow skips '_' files when reading
+COMPLETE_MARKER = '_COMPLETE'
+
+COLUMN_DTYPES = {
+    'RecordedAtTime': 'string',
+    'PublishedLineName': 'category',
+    'OriginName': 'category',
+    'OriginLat': 'float32',
+    'OriginLong': 'float32',
+    'DestinationName': 'category',
+    'VehicleRef': 'category',
+    'NextStopPointName': 'category',
+    'ExpectedArrivalTime': 'string',
+    'ScheduledArrivalTime': 'category',
+}
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+TIME_OF_DAY_LABELS = ['Rush Hour (Morning)', 'Morning', 'Afternoon', 'Rush Hour (Evening)', 'Night', 'Other']
+# Label index of every hour 0-23: 8-9 morning rush, 6-10 morning, 12-15 afternoon,
+# 17-19 evening rush, 20-23 night, everything else other
+HOUR_TIME_OF_DAY = np.array([5, 5, 5, 5, 5, 5, 1, 1, 0, 0, 1, 5, 2, 2, 2, 2, 5, 3, 3, 3, 4, 4, 4, 4], dtype=np.int8)
+
+
+def clock_seconds(times):
+    """
+    Seconds after midnight of 'HH:MM:SS' strings with the hour taken modulo 24
+    (scheduled times run past 24:00:00), NaN when missing or malformed. Each
+    distinct string is parsed once.
+    """
+    codes, uniques = pd.factorize(pd.Series(times, dtype=object))
+    parts = pd.Series(uniques, dtype=object).astype(str).str.strip().str.extract(r'^(\d{1,2}):(\d\d):(\d\d)$')
+    parts = parts.astype(np.float64).to_numpy()
+    seconds = parts[:, 0] % 24 * 3600 + parts[:, 1] * 60 + parts[:, 2]
+
+    out = np.full(len(codes), np.nan)
+    found = codes != -1
+    out[found] = seconds[codes[found]]
+    return out
+
+
+def time_of_day(hours):
+    """
+    Time of day label of every hour, as a Categorical.
+    """
+    return pd.Categorical.from_codes(HOUR_TIME_OF_DAY[np.asarray(hours)], categories=TIME_OF_DAY_LABELS)
+
+
+def clean_chunk(chunk):
+    """
+    Parse the times of a raw chunk and add Delay (minutes) and the calendar
+    columns, dropping the rows without an origin, next stop or scheduled time.
+    """
+    chunk = chunk.dropna(subset=['OriginName', 'NextStopPointName'])
+    recorded = pd.to_datetime(chunk['RecordedAtTime'], format=TIMESTAMP_FORMAT, errors='coerce')
+    recorded_date = recorded.dt.normalize()
+    # The scheduled clock time, placed on the day the position was recorded
+    scheduled = recorded_date + pd.to_timedelta(clock_seconds(chunk['ScheduledArrivalTime']), unit='s')
+    expected = pd.to_datetime(chunk['ExpectedArrivalTime'], format=TIMESTAMP_FORMAT, errors='coerce')
+    expected = expected.fillna(scheduled)
+
+    chunk = chunk.drop(columns=['RecordedAtTime', 'ExpectedArrivalTime']).assign(
+        RecordedAtTime=recorded,
+        RecordedDate=recorded_date,
+        ExpectedArrivalTime=expected,
+        ModifiedScheduledTime=scheduled,
+    )
+    chunk = chunk[scheduled.notna()]
+    recorded = chunk['RecordedAtTime']
+    hours = recorded.dt.hour.to_numpy(dtype=np.int8)
+    return chunk.assign(
+        Delay=((chunk['ExpectedArrivalTime'] - chunk['ModifiedScheduledTime']).dt.total_seconds() / 60.0)
+        .astype(np.float32),
+        Day=recorded.dt.day.astype(np.int8),
+        DayOfWeek=recorded.dt.dayofweek.astype(np.int8),
+        Hour=hours,
+        TimeOfDay=time_of_day(hours),
+    ).reset_index(drop=True)
+
+
+def read_chunks(path, chunksize=CHUNK_SIZE):
+    """
+    Raw chunks of the CSV with only the used columns, typed.
+    """
+    return pd.read_csv(path, usecols=list(COLUMN_DTYPES), dtype=COLUMN_DTYPES, chunksize=chunksize,
+                       on_bad_lines='skip')
+
+
+def write_partitions(chunk, store_dir, part):
+    """
+    Append a cleaned chunk to the store, one file per recorded date in
+    RecordedDate=<YYYY-MM-DD>/ directories.
+    """
+    for date, rows in chunk.groupby(chunk['RecordedDate'].dt.strftime('%Y-%m-%d'), sort=False):
+        out_dir = Path(store_dir) / f'RecordedDate={date}'
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / f'part-{part}.parquet'
+        tmp = path.with_name(path.name + '.tmp')
+        rows.drop(columns='RecordedDate').to_parquet(tmp, index=False)
+        tmp.replace(path)
+
+
+def ingest_chunks(path, store_dir=STORE_DIR, chunksize=CHUNK_SIZE, part_prefix=None):
+    """
+    Clean the CSV chunk by chunk into the Parquet store, yielding every cleaned
+    chunk once it is stored. The files are named after the CSV unless part_prefix is given.
+    """
+    if part_prefix is None:
+        part_prefix = f'{Path(path).stem}-'
+    for i, chunk in enumerate(read_chunks(path, chunksize)):
+        chunk = clean_chunk(chunk)
+        write_partitions(chunk, store_dir, f'{part_prefix}{i:05d}')
+        yield chunk
+
+
+def ingest_csv(path, store_dir=STORE_DIR, chunksize=CHUNK_SIZE, part_prefix=None):
+    """
+    Clean the CSV into the Parquet store, returning the number of rows stored,
+    and mark the store complete.
+    """
+    rows = sum(len(chunk) for chunk in ingest_chunks(path, store_dir, chunksize, part_prefix))
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    (Path(store_dir) / COMPLETE_MARKER).touch()
+    return rows
+
+
+def store_complete(store_dir=STORE_DIR):
+    return (Path(store_dir) / COMPLETE_MARKER).exists()
+
+
+def build_store(path, store_dir=STORE_DIR, chunksize=CHUNK_SIZE):
+    """
+    Ingest the CSV into a fresh store, dropping what an interrupted ingest left there.
+    """
+    shutil.rmtree(store_dir, ignore_errors=True)
+    return ingest_csv(path, store_dir, chunksize)
+
+
+def publish_parts(staging_dir, store_dir=STORE_DIR):
+    """
+    Move the part files written to a staging directory into the store, keeping
+    their date directories. Each file appears in the store whole.
+    """
+    for path in sorted(Path(staging_dir).glob('RecordedDate=*/part-*.parquet')):
+        out_dir = Path(store_dir) / path.parent.name
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path.replace(out_dir / path.name)
+
+
+def load_store(store_dir=STORE_DIR, columns=None, filters=None):
+    """
+    The cleaned rows of the store (optionally only some columns or dates, as
+    pyarrow filters), with RecordedDate restored as a datetime column.
+    """
+    data = pd.read_parquet(store_dir, columns=columns, filters=filters)
+    if 'RecordedDate' in data.columns:
+        data['RecordedDate'] = pd.to_datetime(data['RecordedDate'].astype(str), format='%Y-%m-%d')
+    return data
+
+
+def remove_delay_outliers(data):
+    """
+    Rows whose Delay lies within 1.5 IQR of the quartiles.
+    """
+    q1, q3 = data['Delay'].quantile([0.25, 0.75])
+    iqr = q3 - q1
+    return data[data['Delay'].between(q1 - 1.5 * iqr, q3 + 1.5 * iqr)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest an MTA bus position CSV into the Parquet store.')
+    parser.add_argument('csv')
+    parser.add_argument('store', nargs='?', default=str(STORE_DIR))
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    print(f'{ingest_csv(args.csv, args.store, args.chunksize)} rows stored in {args.store}')
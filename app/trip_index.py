@@ -0,0 +1,90 @@
+"""
+Date-partitioned, delay-sorted index of the served MTA rows for /trips.
+
+The rows /trips returns are kept sorted by recorded date and, within a date,
+by Delay, with the bounds of every date's partition. A date and minimum delay
+query is then a dictionary lookup for the partition and a binary search for the
+first row at or above the delay; the result is a contiguous run of rows, paged
+with offset and limit without copying the rest.
+"""
+import numpy as np
+import pandas as pd
+
+TRIP_COLUMNS = ['VehicleRef', 'OriginName', 'DestinationName', 'Delay']
+
+
+class TripIndex:
+    """
+    Trip rows sorted by (RecordedDate, Delay) and the row range of each date.
+    """
+
+    def __init__(self, rows, delays, partitions):
+        self.rows = rows
+        self.delays = delays
+        # Date (datetime64[D]) -> (start, stop) rows of its partition
+        self.partitions = partitions
+
+    @classmethod
+    def build(cls, data):
+        data = data.dropna(subset=['Delay'])
+        dates = data['RecordedDate'].to_numpy().astype('datetime64[D]')
+        delays = data['Delay'].to_numpy(dtype=np.float64)
+        order = np.lexsort((delays, dates))
+        dates = dates[order]
+        starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]]) if len(dates) else np.array([], dtype=np.int64)
+        stops = np.r_[starts[1:], len(dates)]
+        partitions = {date: (int(start), int(stop)) for date, start, stop in zip(dates[starts], starts, stops)}
+        rows = data[TRIP_COLUMNS].iloc[order].reset_index(drop=True)
+        return cls(rows, delays[order], partitions)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def ranges(self, date=None, min_delay=None):
+        """
+        (start, stop) row ranges with Delay >= min_delay, of the date's partition
+        or of every partition in date order.
+        """
+        if date is not None:
+            partition = self.partitions.get(np.datetime64(pd.Timestamp(date).date(), 'D'))
+            partitions = [partition] if partition is not None else []
+        else:
+            partitions = self.partitions.values()
+        if min_delay is None:
+            return list(partitions)
+        return [(start + int(np.searchsorted(self.delays[start:stop], min_delay, side='left')), stop)
+                for start, stop in partitions]
+
+    def query(self, date=None, min_delay=None, offset=0, limit=None):
+        """
+        Total number of matching rows and the (start, stop) row ranges of the
+        requested page of them.
+        """
+        ranges = self.ranges(date, min_delay)
+        total = sum(stop - start for start, stop in ranges)
+        end = total if limit is None else min(offset + limit, total)
+        page = []
+        seen = 0
+        for start, stop in ranges:
+            # Overlap of this range's matches [seen, seen + stop - start) with [offset, end)
+            lo, hi = max(offset - seen, 0), min(end - seen, stop - start)
+            if lo < hi:
+                page.append((start + lo, start + hi))
+            seen += stop - start
+            if seen >= end:
+                break
+        return total, page
+
+    def iter_json(self, page, chunk_size=10_000):
+        """
+        The rows of the page as a JSON array, in pieces of at most chunk_size rows.
+        """
+        yield '['
+        first = True
+        for start, stop in page:
+            for chunk_start in range(start, stop, chunk_size):
+                chunk = self.rows.iloc[chunk_start:min(chunk_start + chunk_size, stop)]
+                records = chunk.to_json(orient='records', double_precision=6)[1:-1]
+                yield records if first else ',' + records
+                first = False
+        yield ']'
@@ -0,0 +1,246 @@
+"""
+Background rendering of the dashboard charts with a content-addressed image cache.
+
+An endpoint computes the (small) data of its chart and submits it. The chart
+is rendered to PNG or SVG in a worker process, out of the request thread, and
+stored under data/charts/ by the SHA-256 of its kind, format and data, so the
+same chart over the same data is rendered once and then served from disk by
+every worker. Until it is ready the endpoint answers with a job id to poll.
+While a chart renders its worker keeps a .pending marker beside the image, and
+a failed render leaves an .error file, so every server process can report the
+state of a chart any of them submitted.
+"""
+import base64
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from frame_json import dumps
+
+CHART_DIR = Path('data/charts')
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# A .pending marker older than this is left from a worker that died
+PENDING_TIMEOUT_SECONDS = 600
+# Failed jobs kept in memory to report their error; finished ones are on disk
+MAX_FAILED_JOBS = 100
+
+
+def render_pareto(data, fmt):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=data['route_id'], y=data['TotalTrips'], name='Total Trips', marker_color='blue'))
+    fig.add_trace(go.Scatter(x=data['route_id'], y=data['cum_perc'], name='Cumulative Percentage',
+                             marker_color='red', yaxis='y2', mode='lines+markers'))
+    fig.add_trace(go.Scatter(x=data['route_id'], y=[80] * len(data['route_id']), yaxis='y2', mode='lines',
+                             line=dict(color='black', dash='dash'), name='80% Mark'))
+    fig.update_layout(
+        title='Pareto Chart of Total Trips by Route',
+        xaxis_title='Route ID',
+        yaxis_title='Total Trips',
+        yaxis2=dict(title='Cumulative Percentage', overlaying='y', side='right', range=[0, 100]),
+        barmode='overlay',
+        legend=dict(x=0, y=1),
+        showlegend=True
+    )
+    return fig.to_image(format=fmt)
+
+
+def render_route_scatter(data, fmt):
+    import pandas as pd
+    import plotly.express as px
+
+    # data holds the columns and the x, y, title and labels of the chart
+    frame = pd.DataFrame(data['columns'])
+    fig = px.scatter(frame, x=data['x'], y=data['y'], text='route_id', title=data['title'], labels=data['labels'],
+                     trendline='ols', template='plotly_dark')
+    fig.update_traces(textposition='top center')
+    return fig.to_image(format=fmt)
+
+
+def _matplotlib_image(fig, fmt):
+    import io
+    import matplotlib.pyplot as plt
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def render_actual_vs_predicted(data, fmt):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(10, 6))
+    plt.scatter(data['actual'], data['predicted'], alpha=0.3)
+    plt.xlabel('Actual Travel Time (seconds)')
+    plt.ylabel('Predicted Travel Time (seconds)')
+    plt.title('Actual vs Predicted Travel Time')
+    return _matplotlib_image(fig, fmt)
+
+
+def render_clusters(data, fmt):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(10, 6))
+    scatter = plt.scatter(data['stop_lon'], data['stop_lat'], c=data['cluster'], cmap='Set1', alpha=0.7)
+    plt.title('Stop Clustering')
+    plt.xlabel('Longitude')
+    plt.ylabel('Latitude')
+    plt.colorbar(scatter, label='Cluster')
+    return _matplotlib_image(fig, fmt)
+
+
+RENDERERS = {
+    'pareto': render_pareto,
+    'route_scatter': render_route_scatter,
+    'actual_vs_predicted': render_actual_vs_predicted,
+    'clusters': render_clusters,
+}
+
+
+def _render_to_file(kind, data, fmt, path):
+    # Runs in a worker process; the image is published with a rename so readers
+    # never see a partial file
+    path = Path(path)
+    try:
+        image = RENDERERS[kind](data, fmt)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp.write_bytes(image)
+        tmp.replace(path)
+    except Exception as e:
+        path.with_name(f'{path.name}.error').write_text(str(e))
+        raise
+    finally:
+        path.with_name(f'{path.name}.pending').unlink(missing_ok=True)
+    return str(path)
+
+
+def chart_key(kind, data, fmt):
+    """
+    Content address of a chart: hash of its kind, format and JSON-encoded data,
+    with frames always encoded column oriented whatever the request asks for.
+    """
+    return hashlib.sha256(f'{kind}\0{fmt}\0'.encode() + dumps(data, orient='columns').encode()).hexdigest()[:32]
+
+
+class ChartRenderer:
+    """
+    Renders charts in a process pool into a directory of content-addressed images.
+    """
+
+    def __init__(self, chart_dir=CHART_DIR, processes=None):
+        self.chart_dir = Path(chart_dir)
+        self.processes = processes
+        self.jobs = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            # spawn, since the Flask process may be running threads when it forks
+            self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def path(self, key, fmt):
+        return self.chart_dir / f'{key}.{fmt}'
+
+    def _marker(self, key, fmt, state):
+        return self.chart_dir / f'{key}.{fmt}.{state}'
+
+    def _pending_elsewhere(self, key, fmt):
+        # Marker of a render submitted by this or another server process and still running
+        try:
+            return time.time() - self._marker(key, fmt, 'pending').stat().st_mtime < PENDING_TIMEOUT_SECONDS
+        except FileNotFoundError:
+            return False
+
+    def _evict(self):
+        # Rendered charts are on disk, so only the failures are kept, the newest MAX_FAILED_JOBS
+        failed = []
+        for key, job in list(self.jobs.items()):
+            if job.done():
+                if job.exception() is None:
+                    del self.jobs[key]
+                else:
+                    failed.append(key)
+        for key in failed[:max(len(failed) - MAX_FAILED_JOBS, 0)]:
+            del self.jobs[key]
+
+    def find(self, key):
+        """
+        Path and format of a rendered chart, (None, None) when it is not on disk.
+        """
+        for fmt in FORMATS:
+            path = self.path(key, fmt)
+            if path.exists():
+                return path, fmt
+        return None, None
+
+    def submit(self, kind, data, fmt='png'):
+        """
+        Queue a chart unless it is cached or already queued, and return its key.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Unsupported chart format {fmt!r}, use one of {sorted(FORMATS)}')
+        key = chart_key(kind, data, fmt)
+        path = self.path(key, fmt)
+        with self._lock:
+            if path.exists():
+                return key
+            job = self.jobs.get(key)
+            if job is None and self._pending_elsewhere(key, fmt):
+                return key
+            if job is None or (job.done() and job.exception() is not None):
+                self.chart_dir.mkdir(parents=True, exist_ok=True)
+                self._marker(key, fmt, 'error').unlink(missing_ok=True)
+                self._marker(key, fmt, 'pending').touch()
+                self.jobs[key] = self._executor().submit(_render_to_file, kind, data, fmt, str(path))
+            self._evict()
+        return key
+
+    def status(self, key):
+        """
+        'done', 'pending', 'error' or 'unknown', with the error message of a failed job.
+        """
+        if self.find(key)[0] is not None:
+            return 'done', None
+        job = self.jobs.get(key)
+        if job is None:
+            # Submitted by another server process, or by this one before it was evicted
+            for fmt in FORMATS:
+                if self._pending_elsewhere(key, fmt):
+                    return 'pending', None
+                error = self._marker(key, fmt, 'error')
+                if error.exists():
+                    return 'error', error.read_text()
+            return 'unknown', None
+        if not job.done():
+            return 'pending', None
+        error = job.exception()
+        return ('error', str(error)) if error is not None else ('done', None)
+
+    def data_uri(self, key):
+        """
+        The cached image as a data: URI, or None when it is not rendered yet.
+        """
+        path, fmt = self.find(key)
+        if path is None:
+            return None
+        return f'data:{FORMATS[fmt]};base64,{base64.b64encode(path.read_bytes()).decode()}'
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+renderer = ChartRenderer(processes=int(os.environ.get('CHART_WORKERS', 2)))
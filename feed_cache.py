@@ -0,0 +1,231 @@
+"""
+Feed-scoped caches for the derived GTFS tables served by the analytics APIs.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from gtfs_time import DEFAULT_BUCKETS, add_time_buckets
+
+# Feed tables that feed.compute_trip_stats() reads from
+TRIP_STATS_TABLES = ('trips', 'routes', 'stop_times', 'shapes')
+
+
+def feed_fingerprint(feed, tables=TRIP_STATS_TABLES):
+    """
+    Hash the contents of the given feed tables into a hex digest.
+    """
+    digest = hashlib.sha1()
+    for name in tables:
+        table = getattr(feed, name, None)
+        digest.update(name.encode())
+        if table is None:
+            digest.update(b'<none>')
+            continue
+        digest.update(','.join(map(str, table.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(table, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class TripStatsCache:
+    """
+    Memoizes feed.compute_trip_stats() until the feed changes.
+
+    Every lookup first compares the feed tables by identity, which is free. Only
+    when a table has been reassigned is the content fingerprint recomputed, and
+    trip_stats is rebuilt only if that fingerprint differs. The time of day
+    buckets are added as categorical columns when trip_stats is built. The
+    returned frame is shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, tables=TRIP_STATS_TABLES, buckets=DEFAULT_BUCKETS):
+        self.tables = tables
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._seen = None
+        self._fingerprint = None
+        self._trip_stats = None
+
+    def _tables_of(self, feed):
+        return tuple(getattr(feed, name, None) for name in self.tables)
+
+    def _unchanged(self, seen):
+        return self._seen is not None and all(a is b for a, b in zip(seen, self._seen))
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint
+
+    def get(self, feed):
+        seen = self._tables_of(feed)
+        with self._lock:
+            if self._trip_stats is not None and self._unchanged(seen):
+                return self._trip_stats
+
+            fingerprint = feed_fingerprint(feed, self.tables)
+            if self._trip_stats is None or fingerprint != self._fingerprint:
+                self._trip_stats = add_time_buckets(feed.compute_trip_stats(), self.buckets)
+                self._fingerprint = fingerprint
+            self._seen = seen
+            return self._trip_stats
+
+    def seed(self, feed, trip_stats, fingerprint=None):
+        """
+        Install a precomputed trip_stats frame for the given feed.
+        """
+        if not set(self.buckets).issubset(trip_stats.columns):
+            trip_stats = add_time_buckets(trip_stats, self.buckets)
+        with self._lock:
+            self._fingerprint = fingerprint or feed_fingerprint(feed, self.tables)
+            self._trip_stats = trip_stats
+            self._seen = self._tables_of(feed)
+
+    def invalidate(self):
+        with self._lock:
+            self._seen = None
+            self._fingerprint = None
+            self._trip_stats = None
+
+
+trip_stats_cache = TripStatsCache()
+
+
+def cached_trip_stats(feed):
+    """
+    Return trip_stats for the feed, computing it only when the feed has changed.
+    """
+    return trip_stats_cache.get(feed)
+
+
+def service_days(feed):
+    """
+    Set of (service_id, YYYYMMDD date) pairs on which each service runs, combining
+    feed.calendar with the exceptions in feed.calendar_dates.
+    """
+    weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    active = set()
+
+    calendar = getattr(feed, 'calendar', None)
+    if calendar is not None and not calendar.empty:
+        for row in calendar.itertuples(index=False):
+            days = pd.date_range(pd.to_datetime(row.start_date, format='%Y%m%d'),
+                                 pd.to_datetime(row.end_date, format='%Y%m%d'))
+            running = [getattr(row, day) == 1 for day in weekdays]
+            active.update((row.service_id, day.strftime('%Y%m%d')) for day in days if running[day.dayofweek])
+
+    calendar_dates = getattr(feed, 'calendar_dates', None)
+    if calendar_dates is not None and not calendar_dates.empty:
+        exceptions = calendar_dates[['service_id', 'date', 'exception_type']].astype({'exception_type': int})
+        added = exceptions[exceptions['exception_type'] == 1]
+        removed = exceptions[exceptions['exception_type'] == 2]
+        active.update(zip(added['service_id'], added['date']))
+        active.difference_update(zip(removed['service_id'], removed['date']))
+
+    return active
+
+
+def active_dates(feed):
+    """
+    List the YYYYMMDD dates on which at least one service of the feed runs.
+    """
+    return sorted({date for _, date in service_days(feed)})
+
+
+def services_on(feed, date):
+    """
+    Set of the service_ids running on a YYYYMMDD date.
+    """
+    return {service_id for service_id, day in service_days(feed) if day == date}
+
+
+class RouteStatsCache:
+    """
+    Bounded, thread-safe LRU cache of feed.compute_route_stats() results by date.
+
+    Entries are tied to the trip_stats fingerprint and the cache empties itself
+    when the feed changes. Callers receive a copy, so they are free to round,
+    fill or merge the frame in place.
+    """
+
+    def __init__(self, maxsize=256, trip_stats=trip_stats_cache):
+        self.maxsize = maxsize
+        self.trip_stats = trip_stats
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._fingerprint = None
+
+    def _lookup(self, date):
+        with self._lock:
+            if date in self._entries:
+                self._entries.move_to_end(date)
+                self.hits += 1
+                return self._entries[date]
+        return None
+
+    def get(self, feed, date):
+        trip_stats = self.trip_stats.get(feed)
+        with self._lock:
+            if self._fingerprint != self.trip_stats.fingerprint:
+                self._entries.clear()
+                self._fingerprint = self.trip_stats.fingerprint
+
+        route_stats = self._lookup(date)
+        if route_stats is not None:
+            return route_stats.copy()
+
+        # One computation per date, concurrent requests for it wait on the result
+        with self._lock:
+            pending = self._pending.setdefault(date, threading.Lock())
+        with pending:
+            try:
+                route_stats = self._lookup(date)
+                if route_stats is None:
+                    route_stats = feed.compute_route_stats([date], trip_stats=trip_stats)
+                    with self._lock:
+                        self.misses += 1
+                        self._entries[date] = route_stats
+                        while len(self._entries) > self.maxsize:
+                            self._entries.popitem(last=False)
+            finally:
+                # Also after a failed computation, so the lock of the date is not left behind
+                with self._lock:
+                    self._pending.pop(date, None)
+        return route_stats.copy()
+
+    def prewarm(self, feed, dates=None):
+        """
+        Compute route_stats for the given dates, by default all active service
+        dates, up to the last maxsize of them (the earlier ones would be evicted).
+        Returns the number of dates warmed.
+        """
+        dates = active_dates(feed) if dates is None else dates
+        warmed = dates[-self.maxsize:]
+        for date in warmed:
+            self.get(feed, date)
+        return len(warmed)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+route_stats_cache = RouteStatsCache()
+
+
+def cached_route_stats(feed, date):
+    """
+    Return a copy of route_stats for a single YYYYMMDD date, served from the LRU cache.
+    """
+    return route_stats_cache.get(feed, date)
@@ -0,0 +1,190 @@
+"""
+Lookup structures over the feed tables, built once so that per-id requests avoid
+full boolean-mask scans.
+
+Each table is held sorted by its key with a key -> (start, stop) row range map,
+so a lookup is a dict hit followed by a positional slice that returns a view.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def key_ranges(keys):
+    """
+    Map every key of an already sorted key column to its (start, stop) row range.
+    """
+    keys = keys.fillna('').to_numpy(dtype=object)
+    if not len(keys):
+        return {}
+    breaks = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.r_[0, breaks]
+    stops = np.r_[breaks, len(keys)]
+    return dict(zip(keys[starts], zip(starts.tolist(), stops.tolist())))
+
+
+def is_sorted_by(df, columns):
+    """
+    True when the frame is already ordered by the given columns, checked by
+    comparing each row with the next one.
+    """
+    if len(df) < 2:
+        return True
+    ordered = np.zeros(len(df) - 1, dtype=bool)
+    tied = np.ones(len(df) - 1, dtype=bool)
+    for column in columns:
+        if df[column].hasnans:
+            return False
+        values = df[column].to_numpy(dtype=object)
+        ordered |= tied & (values[:-1] < values[1:])
+        tied &= values[:-1] == values[1:]
+    return bool((ordered | tied).all())
+
+
+class SortedTable:
+    """
+    A frame sorted by one key column, with the row range of each key.
+    """
+
+    def __init__(self, df, key, order=None):
+        columns = [key] + list(order or [])
+        if not is_sorted_by(df, columns):
+            df = df.sort_values(columns, kind='stable')
+        self.key = key
+        # Lookups slice by position, so an already sorted frame is used as is
+        self.frame = df
+        self.ranges = key_ranges(self.frame[key])
+
+    def __contains__(self, value):
+        return value in self.ranges
+
+    def rows(self, value):
+        """
+        Rows with the given key as a positional slice of the sorted frame (empty if unknown).
+        """
+        start, stop = self.ranges.get(value, (0, 0))
+        return self.frame.iloc[start:stop]
+
+
+class StopTrips:
+    """
+    Inverted index from stop_id to the trips calling at it: per stop, a sorted
+    int32 array of trip codes with the matching stop_sequence values.
+    """
+
+    def __init__(self, stop_times, trip_ranges):
+        # Trip codes follow the order of the trip-sorted stop_times
+        self.trip_ids = np.array(list(trip_ranges), dtype=object)
+        lengths = np.array([stop - start for start, stop in trip_ranges.values()], dtype=np.int64)
+        trip_codes = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+
+        stop_ids = stop_times['stop_id'].fillna('').to_numpy(dtype=object)
+        sequences = stop_times['stop_sequence'].fillna(-1).to_numpy(dtype=np.int32)
+        stop_codes, stops = pd.factorize(stop_ids)
+        order = np.lexsort((sequences, trip_codes, stop_codes))
+
+        self.trip_codes = trip_codes[order]
+        self.sequences = sequences[order]
+        counts = np.bincount(stop_codes, minlength=len(stops))
+        offsets = np.r_[0, np.cumsum(counts)]
+        self.ranges = {stop_id: (offsets[i], offsets[i + 1]) for i, stop_id in enumerate(stops)}
+
+    def trips_at(self, stop_id):
+        """
+        Sorted trip codes and stop sequences of the trips calling at the stop.
+        """
+        start, stop = self.ranges.get(stop_id, (0, 0))
+        return self.trip_codes[start:stop], self.sequences[start:stop]
+
+    def trips_between(self, start_stop_id, end_stop_id):
+        """
+        Ids of the trips that call at start_stop_id and later at end_stop_id.
+        """
+        start_codes, start_seqs = self.trips_at(start_stop_id)
+        end_codes, end_seqs = self.trips_at(end_stop_id)
+
+        # A trip may call at a stop more than once: board at its first call at
+        # the start stop and alight at its last call at the end stop. The masks
+        # are filled in place so they stay empty for a stop without calls
+        first = np.ones(len(start_codes), dtype=bool)
+        first[1:] = start_codes[1:] != start_codes[:-1]
+        last = np.ones(len(end_codes), dtype=bool)
+        last[:-1] = end_codes[1:] != end_codes[:-1]
+        start_codes, start_seqs = start_codes[first], start_seqs[first]
+        end_codes, end_seqs = end_codes[last], end_seqs[last]
+
+        common, start_at, end_at = np.intersect1d(start_codes, end_codes, assume_unique=True,
+                                                  return_indices=True)
+        forward = start_seqs[start_at] < end_seqs[end_at]
+        return self.trip_ids[common[forward]]
+
+
+# Tables the index is built from, used to detect that the feed has changed
+INDEXED_TABLES = ('routes', 'stops', 'trips', 'stop_times')
+
+
+class FeedIndex:
+    """
+    Id lookups for routes, stops, trips, the trips of a route and the stop times of a trip.
+    """
+
+    def __init__(self, feed):
+        self.tables = tuple(getattr(feed, name) for name in INDEXED_TABLES)
+        self.routes = SortedTable(feed.routes, 'route_id')
+        self.stops = SortedTable(feed.stops, 'stop_id')
+        self.trips = SortedTable(feed.trips, 'trip_id')
+        self.route_trips = SortedTable(feed.trips, 'route_id', order=['trip_id'])
+        self.stop_times = SortedTable(feed.stop_times, 'trip_id', order=['stop_sequence'])
+        self.stop_trips = StopTrips(self.stop_times.frame, self.stop_times.ranges)
+        # First stop_id of every stop name, in feed order
+        named = feed.stops.dropna(subset=['stop_name']).drop_duplicates('stop_name')
+        self.stop_names = dict(zip(named['stop_name'], named['stop_id']))
+
+    def is_current(self, feed):
+        return all(a is b for a, b in zip(self.tables, (getattr(feed, name) for name in INDEXED_TABLES)))
+
+    def route(self, route_id):
+        return self.routes.rows(route_id)
+
+    def stop(self, stop_id):
+        return self.stops.rows(stop_id)
+
+    def trip(self, trip_id):
+        return self.trips.rows(trip_id)
+
+    def trips_for_route(self, route_id):
+        return self.route_trips.rows(route_id)
+
+    def stop_id(self, stop_name):
+        return self.stop_names.get(stop_name)
+
+    def trips_between(self, start_stop_id, end_stop_id):
+        """
+        Ids of the trips serving start_stop_id and then end_stop_id.
+        """
+        return self.stop_trips.trips_between(start_stop_id, end_stop_id)
+
+    def stop_times_for_trip(self, trip_id):
+        """
+        Stop times of a trip, ordered by stop_sequence.
+        """
+        return self.stop_times.rows(trip_id)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def feed_index(feed):
+    """
+    Return the FeedIndex of the feed, rebuilding it when one of its tables was reassigned.
+    """
+    global _index
+    index = _index
+    if index is not None and index.is_current(feed):
+        return index
+    with _index_lock:
+        if _index is None or not _index.is_current(feed):
+            _index = FeedIndex(feed)
+        return _index
@@ -0,0 +1,204 @@
+"""
+Loading of the GTFS feed, with a columnar snapshot of the cleaned feed for fast cold starts.
+
+Build a snapshot once after every feed update:
+
+    python feed_loader.py data/gtfs-nyc-2023.zip
+
+Workers then memory-map data/snapshots/<zip hash>/ instead of parsing the zip.
+That path is a symlink to the current version of the snapshot,
+<zip hash>.v<id>/, which a rebuild switches in a single rename.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import gtfs_kit as gk
+
+from feed_cache import feed_fingerprint, trip_stats_cache
+from gtfs_time import add_time_columns
+
+SNAPSHOT_ROOT = Path('data/snapshots')
+SNAPSHOT_VERSION = 3
+
+# Tables of a gtfs_kit Feed, in the order of its constructor
+FEED_TABLES = ('agency', 'stops', 'routes', 'trips', 'stop_times', 'calendar', 'calendar_dates',
+               'fare_attributes', 'fare_rules', 'shapes', 'frequencies', 'transfers', 'feed_info',
+               'attributions')
+
+
+def strip_time_whitespace(feed):
+    # Removing the space from the Arrival and Departure Time
+    for column in ('arrival_time', 'departure_time'):
+        feed.stop_times[column] = feed.stop_times[column].str.replace(' ', '', regex=False)
+    return feed
+
+
+def sort_stop_times(feed):
+    # Ordering stop_times by trip and stop_sequence once lets the id index slice it without copying
+    feed.stop_times = feed.stop_times.sort_values(['trip_id', 'stop_sequence'], kind='stable').reset_index(drop=True)
+    return feed
+
+
+def prune_routes_without_trips(feed):
+    # Removing all the routes with no trips, by set membership on trips.route_id
+    routes_with_trips = feed.trips['route_id'].dropna().unique()
+    feed.routes = feed.routes[feed.routes['route_id'].isin(routes_with_trips)]
+    return feed
+
+
+# Cleaning stages applied to a freshly parsed feed, in order
+CLEANING_STAGES = [
+    ('strip_time_whitespace', strip_time_whitespace),
+    ('prune_routes_without_trips', prune_routes_without_trips),
+    ('parse_stop_times', add_time_columns),
+    ('sort_stop_times', sort_stop_times),
+]
+
+
+def clean_feed_data(feed, timings=None):
+    """
+    Run the cleaning stages over the feed. When a dict is given as timings, the
+    seconds spent in each stage are recorded in it.
+    """
+    for name, stage in CLEANING_STAGES:
+        start = time.perf_counter()
+        feed = stage(feed)
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
+    return feed
+
+
+def format_timings(timings):
+    lines = [f'  {name:<32}{seconds * 1000:10.1f} ms' for name, seconds in timings.items()]
+    lines.append(f'  {"total":<32}{sum(timings.values()) * 1000:10.1f} ms')
+    return '\n'.join(lines)
+
+
+# Derived tables stored next to the feed, computed from the cleaned feed
+DERIVED_TABLES = {
+    'trip_stats': lambda feed: trip_stats_cache.get(feed),
+}
+
+
+def zip_hash(path):
+    """
+    SHA-256 of the feed zip, used as the snapshot key.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def snapshot_dir(path, root=SNAPSHOT_ROOT):
+    """
+    Link to the current snapshot directory of the feed zip.
+    """
+    return Path(root) / zip_hash(path)
+
+
+def _publish(link, version_dir):
+    """
+    Point link at version_dir with an atomic rename, then remove the versions
+    before the one it replaced (kept for readers that are still loading it).
+    """
+    previous = link.resolve() if link.is_symlink() else None
+    tmp_link = link.with_name(f'.{version_dir.name}.link')
+    os.symlink(version_dir.name, tmp_link)
+    if link.is_dir() and not link.is_symlink():
+        # Snapshot written in place by an older version of this module
+        shutil.rmtree(link)
+    os.replace(tmp_link, link)
+    for old in link.parent.glob(f'{link.name}.v*'):
+        if old.resolve() not in (version_dir.resolve(), previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def build_snapshot(path, root=SNAPSHOT_ROOT, dist_units='km', timings=None):
+    """
+    Parse and clean the feed zip, then write every table and the derived tables
+    as uncompressed Arrow IPC files that can be memory-mapped.
+    """
+    out_dir = snapshot_dir(path, root)
+    version_dir = out_dir.with_name(f'{out_dir.name}.v{uuid.uuid4().hex[:12]}')
+    version_dir.mkdir(parents=True)
+
+    feed = clean_feed_data(gk.read_feed(Path(path), dist_units=dist_units), timings=timings)
+    tables = {name: getattr(feed, name) for name in FEED_TABLES if getattr(feed, name, None) is not None}
+    derived = {name: build(feed) for name, build in DERIVED_TABLES.items()}
+
+    for name, df in {**tables, **derived}.items():
+        table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+        feather.write_feather(table, version_dir / f'{name}.arrow', compression='uncompressed')
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'source': str(path),
+        'zip_hash': out_dir.name,
+        'dist_units': dist_units,
+        'tables': sorted(tables),
+        'derived': sorted(derived),
+        'trip_stats_fingerprint': feed_fingerprint(feed),
+    }
+    (version_dir / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+
+    # Readers see the previous snapshot or this one, never a partial or mixed one
+    _publish(out_dir, version_dir)
+    return out_dir
+
+
+def _read_table(path):
+    with pa.memory_map(str(path), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    # split_blocks lets null-free numeric columns stay views on the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+def load_snapshot(out_dir):
+    """
+    Rebuild the cleaned Feed and its derived tables from a snapshot directory.
+    """
+    out_dir = Path(out_dir)
+    manifest = json.loads((out_dir / 'manifest.json').read_text())
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported snapshot version {manifest.get("version")} in {out_dir}')
+
+    tables = {name: _read_table(out_dir / f'{name}.arrow') for name in manifest['tables']}
+    derived = {name: _read_table(out_dir / f'{name}.arrow') for name in manifest['derived']}
+    feed = gk.Feed(dist_units=manifest['dist_units'], **tables)
+
+    if 'trip_stats' in derived:
+        trip_stats_cache.seed(feed, derived['trip_stats'], fingerprint=manifest['trip_stats_fingerprint'])
+    return feed, derived
+
+
+def load_feed(path, root=SNAPSHOT_ROOT, dist_units='km'):
+    """
+    Return the cleaned feed, from its snapshot when one exists for this zip.
+    """
+    # Resolved once, so every file is read from the same version when a rebuild switches the link
+    out_dir = snapshot_dir(path, root).resolve()
+    manifest = out_dir / 'manifest.json'
+    if manifest.exists() and json.loads(manifest.read_text()).get('version') == SNAPSHOT_VERSION:
+        feed, _ = load_snapshot(out_dir)
+        return feed
+    return clean_feed_data(gk.read_feed(Path(path), dist_units=dist_units))
+
+
+if __name__ == '__main__':
+    zip_path = sys.argv[1] if len(sys.argv) > 1 else 'data/gtfs-nyc-2023.zip'
+    timings = {}
+    out_dir = build_snapshot(zip_path, timings=timings)
+    print('Cleaning stages:')
+    print(format_timings(timings))
+    print(f'Snapshot written to {out_dir}')
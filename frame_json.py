@@ -0,0 +1,133 @@
+"""
+JSON encoding of API responses that contain DataFrames, straight from their columns.
+
+Endpoints return DataFrames inside their payload as they are, without
+fillna('NA') or to_dict(): every column is turned into a list of plain values
+in one vectorized pass (missing values, NaN and NaT become null, numpy scalars
+native numbers) and the payload is encoded with orjson when it is installed.
+
+Frames are sent as a list of records, or column oriented as {column: [values]}
+when the request has orient=columns.
+"""
+import datetime
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+ORIENTS = ('records', 'columns')
+
+
+def column_values(series):
+    """
+    Values of a column as a list of JSON-ready Python values, with None for missing ones.
+    """
+    kind = series.dtype.kind
+    if kind in 'iubf' and isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        # Nullable (masked or Arrow backed) numbers and booleans: NA becomes None
+        # rather than turning the whole column into float NaN
+        return series.to_numpy(dtype=object, na_value=None).tolist()
+    if kind in 'iub':
+        return series.to_numpy().tolist()
+    if kind == 'f':
+        values = series.to_numpy()
+        missing = np.isnan(values)
+        if not missing.any():
+            return values.tolist()
+        values = values.astype(object)
+        values[missing] = None
+        return values.tolist()
+    if kind == 'M':
+        text = series.dt.strftime('%Y-%m-%dT%H:%M:%S')
+        return text.astype(object).where(series.notna(), None).tolist()
+    if kind == 'm':
+        return column_values(series.dt.total_seconds())
+    # object, string and categorical columns
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def frame_columns(df):
+    """
+    Column oriented payload of a frame: {column: [values]}.
+    """
+    return {str(column): column_values(df[column]) for column in df.columns}
+
+
+def frame_records(df):
+    """
+    Record oriented payload of a frame: one dict per row, zipped from the column lists.
+    """
+    columns = [str(column) for column in df.columns]
+    values = [column_values(df[column]) for column in df.columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def requested_orient():
+    orient = request.args.get('orient', 'records') if has_request_context() else 'records'
+    return orient if orient in ORIENTS else 'records'
+
+
+def _default(obj, orient=None):
+    if hasattr(obj, '_to_pandas'):  # modin frames and series
+        obj = obj._to_pandas()
+    if isinstance(obj, pd.DataFrame):
+        return frame_columns(obj) if (orient or requested_orient()) == 'columns' else frame_records(obj)
+    if isinstance(obj, pd.Series):
+        return column_values(obj)
+    if isinstance(obj, np.ndarray):
+        return column_values(pd.Series(obj))
+    if isinstance(obj, np.generic):
+        value = obj.item()
+        return None if isinstance(value, float) and np.isnan(value) else value
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Timedelta):
+        return obj.total_seconds()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _without_nan(obj):
+    # The stdlib encoder writes NaN, which is not JSON
+    if isinstance(obj, float) and obj != obj:
+        return None
+    if isinstance(obj, dict):
+        return {key: _without_nan(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_without_nan(value) for value in obj]
+    return obj
+
+
+def dumps(obj, orient=None):
+    """
+    Encode a payload that may contain DataFrames, Series and numpy values to a
+    JSON string, with frames in the given orient (the request's by default).
+    """
+    default = functools.partial(_default, orient=orient) if orient is not None else _default
+    if orjson is not None:
+        return orjson.dumps(obj, default=default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(_without_nan(obj), default=default, allow_nan=False)
+
+
+class FrameJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding jsonify() payloads with dumps().
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+
+def init_app(app):
+    app.json = FrameJSONProvider(app)
+    return app
@@ -1,8 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import io
 import os
 import base64
+import threading
+import uuid
 from os import path
 from pathlib import Path
 import numpy as np
@@ -23,90 +25,85 @@ from geopy.distance import geodesic
 
 import gtfs_kit as gk
 
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
+from chart_render import FORMATS, renderer
+from feed_loader import load_feed
+from route_maps import RouteMaps, batch_route_maps
+from frame_json import init_app
+from stop_times_fact import StopTimesFact
+from shape_store import shape_store
+from trip_segments import build_segments, route_travel_metrics
+from travel_time_service import MicroBatcher, predict_batches
+from travel_time_model import DEFAULT_MAX_ROWS, latest_version, list_versions, train_travel_time_model
+
 from sklearn.cluster import KMeans
 
 app = Flask(__name__)
 CORS(app)
+# jsonify() encodes DataFrames in the payload straight from their columns
+init_app(app)
+
+
+def chart_response(kind, data, body):
+    """
+    Submit a chart to the background renderer and answer with its job: 200 with
+    the image URL (and a data: URI of it) when the chart is already rendered,
+    202 with the job id to poll at /charts/<job_id> while it renders.
+    """
+    fmt = request.args.get('format', 'png')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'format must be one of {sorted(FORMATS)}'}), 400
+    job_id = renderer.submit(kind, data, fmt)
+    status, error = renderer.status(job_id)
+    body = dict(body, job_id=job_id, chart_status=status, status_url=f'/charts/{job_id}', chart_url=f'/charts/{job_id}/image')
+    if status == 'done':
+        body['plot'] = renderer.data_uri(job_id)
+        return jsonify(body), 200
+    if status == 'error':
+        return jsonify(dict(body, error=error)), 500
+    return jsonify(body), 202
+
+
+@app.route('/charts/<job_id>', methods=['GET'])
+def chart_status(job_id):
+    status, error = renderer.status(job_id)
+    body = {'job_id': job_id, 'status': status, 'chart_url': f'/charts/{job_id}/image'}
+    if error:
+        body['error'] = error
+    return jsonify(body), 404 if status == 'unknown' else 200
+
+
+@app.route('/charts/<job_id>/image', methods=['GET'])
+def chart_image(job_id):
+    path, fmt = renderer.find(job_id)
+    if path is None:
+        status, _ = renderer.status(job_id)
+        return jsonify({'job_id': job_id, 'status': status}), 404 if status == 'unknown' else 202
+    # Content addressed, so the image at a job id never changes
+    response = send_file(path.resolve(), mimetype=FORMATS[fmt], max_age=31536000, etag=True)
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
 
 @app.route('/clean_data', methods=['GET'])
 def clean_data():
     try:
         # Load the GTFS data
         path = Path('/content/gtfs-nyc-2023.zip')
-        feed = gk.read_feed(path, dist_units='km')
-
-        # Clean the stop_times data
-        stop_times = feed.stop_times.copy()
-        stop_times['arrival_time'] = stop_times['arrival_time'].str.replace(' ', '')
-        stop_times['departure_time'] = stop_times['departure_time'].str.replace(' ', '')
-        feed.stop_times = stop_times
-
-        # Remove routes with no trips
-        routes_with_no_trips = feed.trips['route_id'].unique()
-        feed.routes = feed.routes[~feed.routes['route_id'].isin(routes_with_no_trips)]
-
-        routes = feed.routes.copy()
-        shapes = feed.shapes.copy()
-        stop_times = feed.stop_times.copy()
-        stops = feed.stops.copy()
-        trips = feed.trips.copy()
-
-        # Clean the arrival and departure times
-        def clean_time(x):
-            date = datetime.datetime.today()
-            hr, min, sec = x.split(':')
-            if x.startswith('24'):
-                date = date + datetime.timedelta(days=1)
-                hr = '00'
-            x = f"{date.strftime('%Y-%m-%d')} {hr}:{min}:{sec}"
-            return x
-
-        stop_times['arrival_time'] = stop_times['arrival_time'].apply(clean_time)
-        stop_times['departure_time'] = stop_times['departure_time'].apply(clean_time)
-
-        # Convert to datetime
-        stop_times['arrival_time'] = pd.to_datetime(stop_times['arrival_time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-        stop_times['departure_time'] = pd.to_datetime(stop_times['departure_time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-
-        # Fill missing shape distances
-        stop_times['shape_dist_traveled'] = stop_times['shape_dist_traveled'].fillna(0)
-
-        # Clean routes and stops data
-        routes = feed.routes[['route_id', 'route_long_name', 'route_type', 'route_color', 'route_text_color']]
-        stops = feed.stops[['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon']]
-
-        # Merge trips with routes
-        trips = feed.trips.copy()
-        trips_routes = trips.merge(routes, on='route_id', how='inner')
-
-        # Merge stop times with trips
-        stop_times_trips = stop_times.merge(trips_routes, on='trip_id', how='inner')
-
-        # Group shapes and compute total distance
-        shapes = feed.shapes.copy()
-        shapes_grouped_lat_long = shapes.groupby('shape_id').apply(lambda x: list(zip(x['shape_pt_lat'], x['shape_pt_lon']))).reset_index().rename(columns={0: 'shape_points'})
-        grouped_shapes = shapes_grouped_lat_long.merge(shapes.groupby('shape_id').agg(dist_traveled=('shape_dist_traveled', list)), on='shape_id', how='inner')
-        grouped_shapes['total_dist_traveled'] = grouped_shapes['dist_traveled'].apply(lambda x: x[-1])
-
-        # Merge trips with shapes
-        trips_shapes = trips.merge(grouped_shapes, on='shape_id', how='inner')
-        trips_shapes_routes = trips_shapes.merge(routes, on='route_id', how='inner')
-        stop_times_trips_shapes = stop_times.merge(trips_shapes_routes, on='trip_id', how='inner')
-        stop_times_trips_shapes_stops = stop_times_trips_shapes.merge(stops, on='stop_id', how='inner')
-
-        app.config['STOP_TIMES'] = stop_times
-        app.config['ROUTES'] = routes
-        app.config['STOPS'] = stops
-        app.config['TRIPS'] = trips
-        app.config['TRIPS_ROUTES'] = trips_routes
-        app.config['STOP_TIMES_TRIPS'] = stop_times_trips
-        app.config['STOP_TIMES_TRIPS_SHAPES_STOPS'] = stop_times_trips_shapes_stops
-        app.config['GROUPED_SHAPES'] = grouped_shapes
-        app.config['TRIPS_SHAPES'] = trips_shapes
-        app.config['TRIPS_SHAPES_ROUTES'] = trips_shapes_routes
+
+        # Cleaned feed (stop time whitespace removed, routes with no trips dropped),
+        # read from its snapshot when one has been built for this zip
+        feed = load_feed(path)
+
+        # One row of integer codes per stop time, joined with trips, routes, shapes
+        # and stops by positional take instead of a chain of merges
+        app.config['FEED'] = feed
+        app.config['STOP_TIMES_FACT'] = StopTimesFact(feed)
+        # Shape points as contiguous arrays sliced by shape_id
+        app.config['SHAPES'] = shape_store(feed)
+        # Seconds and shape distance between consecutive stops of every trip
+        app.config['SEGMENTS'] = build_segments(app.config['STOP_TIMES_FACT'], app.config['SHAPES'])
+        # GeoJSON map of every route, read from data/route_maps/ when this feed was seen before
+        app.config['ROUTE_MAPS'] = RouteMaps.for_feed(feed, app.config['STOP_TIMES_FACT'], app.config['SHAPES'])
 
         # Return success message
         return jsonify({'message': 'GTFS data cleaned successfully!'}), 200
@@ -119,56 +116,17 @@ def clean_data():
 def pareto_chart():
     try:
         # Assuming routes_with_trips is already computed in your data loading process
-        routes_with_trips = app.config['TRIPS'].groupby(by=['route_id']).agg(TotalTrips=('trip_id', 'count')).sort_values(by='TotalTrips', ascending=False).reset_index()
+        routes_with_trips = app.config['STOP_TIMES_FACT'].trips.groupby(by=['route_id'], observed=True).agg(TotalTrips=('trip_id', 'count')).sort_values(by='TotalTrips', ascending=False).reset_index()
         routes_with_trips['cum_perc'] = (routes_with_trips['TotalTrips'].cumsum() / routes_with_trips['TotalTrips'].sum() * 100).round(2)
 
 
         # Create the Pareto chart
-        fig = go.Figure()
-
-        fig.add_trace(go.Bar(
-            x=routes_with_trips['route_id'],
-            y=routes_with_trips['TotalTrips'],
-            name='Total Trips',
-            marker_color='blue'
-        ))
-
-        fig.add_trace(go.Scatter(
-            x=routes_with_trips['route_id'],
-            y=routes_with_trips['cum_perc'],
-            name='Cumulative Percentage',
-            marker_color='red',
-            yaxis='y2',
-            mode='lines+markers'
-        ))
-
-        fig.add_trace(go.Scatter(
-            x=routes_with_trips['route_id'],
-            y=[80] * routes_with_trips.shape[0],
-            yaxis='y2',
-            mode='lines',
-            line=dict(color='black', dash='dash'),
-            name='80% Mark'
-        ))
-
-        fig.update_layout(
-            title='Pareto Chart of Total Trips by Route',
-            xaxis_title='Route ID',
-            yaxis_title='Total Trips',
-            yaxis2=dict(
-                title='Cumulative Percentage',
-                overlaying='y',
-                side='right',
-                range=[0, 100]
-            ),
-            barmode='overlay',
-            legend=dict(x=0, y=1),
-            showlegend=True
-        )
-
-        # Save the figure as an image (optional)
-        fig.write_image("pareto_chart.png")  # Save to file
-        return jsonify({'message': 'Pareto chart created successfully'}), 200
+        # Rendered by a worker process and cached by the hash of the chart data
+        return chart_response('pareto', {
+            'route_id': routes_with_trips['route_id'],
+            'TotalTrips': routes_with_trips['TotalTrips'],
+            'cum_perc': routes_with_trips['cum_perc'],
+        }, {'message': 'Pareto chart created successfully'})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -177,28 +135,16 @@ def pareto_chart():
 @app.route('/total_stops_vs_total_trips', methods=['GET'])
 def total_stops_vs_total_trips():
     try:
-        # Assuming routes_metrics is already computed in your data loading process
-        routes_metrics = app.config['STOP_TIMES_TRIPS_SHAPES_STOPS'].groupby(by=['route_id']).agg(
-            TotalStops=('stop_id', 'nunique'),
-            TotalTrips=('trip_id', 'nunique'),
-            TotalShapes=('shape_id', 'nunique')
-        ).sort_values(by='TotalStops', ascending=False).reset_index()
-
-        # Create scatter plot
-        fig = px.scatter(routes_metrics,
-                         x='TotalStops',
-                         y='TotalTrips',
-                         text='route_id',
-                         title='Total Stops vs. Total Trips for Each Route',
-                         labels={'TotalStops': 'Total Stops', 'TotalTrips': 'Total Trips'},
-                         trendline='ols',  # Optional: Add a trendline
-                         template='plotly_dark')
-
-        fig.update_traces(textposition='top center')
-
-        # Save the figure as an image (optional)
-        fig.write_image("total_stops_vs_total_trips.png")  # Save to file
-        return jsonify({'message': 'Total Stops vs. Total Trips scatter plot created successfully'}), 200
+        # Distinct stops, trips and shapes of every route, counted on the integer codes
+        routes_metrics = app.config['STOP_TIMES_FACT'].route_counts()
+
+        return chart_response('route_scatter', {
+            'columns': routes_metrics[['route_id', 'TotalStops', 'TotalTrips']],
+            'x': 'TotalStops',
+            'y': 'TotalTrips',
+            'title': 'Total Stops vs. Total Trips for Each Route',
+            'labels': {'TotalStops': 'Total Stops', 'TotalTrips': 'Total Trips'},
+        }, {'message': 'Total Stops vs. Total Trips scatter plot created successfully'})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -207,15 +153,17 @@ def total_stops_vs_total_trips():
 @app.route('/frequent_stops', methods=['GET'])
 def frequent_stops():
     try:
-        # Retrieve the merged stop_times_trips_shapes_stops DataFrame
-        stop_times_trips_shapes_stops = app.config.get('STOP_TIMES_TRIPS_SHAPES_STOPS')
-        if stop_times_trips_shapes_stops is None:
+        # Retrieve the stop_times fact table
+        fact = app.config.get('STOP_TIMES_FACT')
+        if fact is None:
             return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
 
         # Calculate frequent stops
-        frequent_stops = stop_times_trips_shapes_stops.groupby(by=['stop_id']).agg(
-            TotalTrips=('trip_id', 'nunique'),
-        ).sort_values(by='TotalTrips', ascending=False).reset_index()
+        frequent_stops = fact.facts.groupby(by=['stop_idx']).agg(
+            TotalTrips=('trip_idx', 'nunique'),
+        ).sort_values(by='TotalTrips', ascending=False)
+        frequent_stops.insert(0, 'stop_id', fact.dimension_column('stops', 'stop_id', frequent_stops.index))
+        frequent_stops = frequent_stops.reset_index(drop=True)
 
         # Calculate cumulative percentage
         frequent_stops['cum_perc'] = (frequent_stops['TotalTrips'].cumsum() / frequent_stops['TotalTrips'].sum() * 100).round(2)
@@ -225,12 +173,12 @@ def frequent_stops():
 
         # Count and percentage of stops contributing to 80% of trips
         number_of_stops = most_frequent_stops.shape[0]
-        percent_of_stops = (number_of_stops / frequent_stops.shape[0] * 100).round(2)
+        percent_of_stops = round(number_of_stops / frequent_stops.shape[0] * 100, 2)
 
         result = {
             'number_of_stops': number_of_stops,
             'percent_of_stops': percent_of_stops,
-            'most_frequent_stops': most_frequent_stops.to_dict(orient='records')  # Convert to list of dictionaries
+            'most_frequent_stops': most_frequent_stops  # Encoded as a list of records by jsonify
         }
 
         return jsonify(result), 200
@@ -241,74 +189,26 @@ def frequent_stops():
 @app.route('/route_metrics', methods=['GET'])
 def route_metrics():
     try:
-        # Retrieve the merged stop_times_trips_shapes_stops DataFrame
-        stop_times_trips_shapes_stops = app.config.get('STOP_TIMES_TRIPS_SHAPES_STOPS')
-        if stop_times_trips_shapes_stops is None:
+        # Retrieve the stop_times fact table
+        fact = app.config.get('STOP_TIMES_FACT')
+        if fact is None:
             return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
 
         # Calculate route metrics
-        routes_metrics = stop_times_trips_shapes_stops.groupby(by=['route_id']).agg(
-            TotalStops=('stop_id', 'nunique'),
-            TotalTrips=('trip_id', 'nunique'),
-            TotalShapes=('shape_id', 'nunique')
-        ).sort_values(by='TotalStops', ascending=False).reset_index()
-
-        # Prepare stop_times for further calculations
-        stop_times = app.config['STOP_TIMES'].sort_values(by=['trip_id', 'stop_sequence'])
-        stop_times['time_diff'] = stop_times.groupby(by="trip_id")['arrival_time'].diff().dt.total_seconds() / 60
-        stop_times['time_diff'] = stop_times['time_diff'].fillna(0)
-
-        merged_data = pd.merge(stop_times, app.config['TRIPS'][['trip_id', 'shape_id']], on='trip_id')
-
-        merged_data = pd.merge(merged_data, app.config['ROUTES'][['shape_id', 'shape_pt_sequence', 'shape_dist_traveled']],
-                               left_on=['shape_id', 'stop_sequence'],
-                               right_on=['shape_id', 'shape_pt_sequence'])
-
-        merged_data = merged_data.sort_values(by=['trip_id', 'stop_sequence'])
-
-        merged_data['distance_covered'] = merged_data.groupby('trip_id')['shape_dist_traveled'].diff().fillna(0)
-
-        # Average travel time and Total distance for each trip
-        trips_metrics = merged_data.groupby(by=['trip_id']).agg(
-            AvgTravelTime=('time_diff', 'mean'),
-            TotalDistance=('distance_covered', 'sum')
-        ).reset_index()
-
-        # Merging with routes
-        trips_metrics = trips_metrics.merge(app.config['TRIPS'][['trip_id', 'route_id']], on='trip_id', how='inner')
-
-        routes_metrics1 = trips_metrics.groupby(by=['route_id']).agg(
-            AvgTravelTime=('AvgTravelTime', 'mean'),
-            TotalDistance=('TotalDistance', 'sum')
-        ).reset_index()
-
-        routes_metrics = routes_metrics.merge(routes_metrics1, on="route_id", how="inner")
-
-        # Create scatter plot
-        fig = px.scatter(routes_metrics,
-                         x='TotalDistance',
-                         y='AvgTravelTime',
-                         text='route_id',
-                         title='Average Travel Time vs. Total Distance for Each Route',
-                         labels={'TotalDistance': 'Total Distance (km)', 'AvgTravelTime': 'Average Travel Time (minutes)'},
-                         trendline='ols',  # Optional: Add a trendline
-                         template='plotly_dark')
-
-        # Display route ID on hover
-        fig.update_traces(textposition='top center')
-
-        # Save plot to a BytesIO object
-        img_bytes = io.BytesIO()
-        fig.write_image(img_bytes, format='png')
-        img_bytes.seek(0)
+        routes_metrics = fact.route_counts()
 
-        # Encode to base64 for JSON response
-        plot_url = base64.b64encode(img_bytes.getvalue()).decode('utf8')
+        # Average travel time between stops and total trip distance, aggregated
+        # from the segment table built by /clean_data
+        routes_metrics = routes_metrics.merge(route_travel_metrics(app.config['SEGMENTS'], fact), on="route_id", how="inner")
 
-        return jsonify({
-            'routes_metrics': routes_metrics.to_dict(orient='records'),  # Return metrics as a list of dictionaries
-            'plot_url': f"data:image/png;base64,{plot_url}"
-        }), 200
+        # The plot is rendered in the background, routes_metrics is answered right away
+        return chart_response('route_scatter', {
+            'columns': routes_metrics[['route_id', 'TotalDistance', 'AvgTravelTime']],
+            'x': 'TotalDistance',
+            'y': 'AvgTravelTime',
+            'title': 'Average Travel Time vs. Total Distance for Each Route',
+            'labels': {'TotalDistance': 'Total Distance (km)', 'AvgTravelTime': 'Average Travel Time (minutes)'},
+        }, {'routes_metrics': routes_metrics})  # Encoded as a list of records by jsonify
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -321,101 +221,184 @@ def plot_route_on_map_api():
     if not route_id:
         return jsonify({"status": "error", "message": "route_id parameter is required."}), 400
     
-    trips = app.config['TRIPS']
-    stops = app.config['STOPS']
-    stop_times = app.config['STOP_TIMES']
-    shapes = app.config['SHAPES']
+    route_maps = app.config.get('ROUTE_MAPS')
+    if route_maps is None:
+        return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
 
-    trips_filtered = trips[trips['route_id'] == route_id]
-    trip_ids = trips_filtered['trip_id'].unique()
-    stop_times_filtered = stop_times[stop_times['trip_id'].isin(trip_ids)]
-    stop_data = pd.merge(stop_times_filtered, stops, on='stop_id')
+    # Distinct stops (source and destination marked) and shape polylines of the
+    # route as GeoJSON, precomputed at load, for the client to draw the map
+    document = route_maps.get(route_id)
+    if document is None:
+        return jsonify({"status": "error", "message": f"Route {route_id} not found."}), 404
+    body, etag = document
 
-    stop_data = stop_data.sort_values(by=['trip_id', 'stop_sequence'])
-    first_stop = stop_data.groupby('trip_id').first().reset_index()
-    last_stop = stop_data.groupby('trip_id').last().reset_index()
-    shape_id = trips_filtered.iloc[0]['shape_id']
-    shape_data = shapes[shapes['shape_id'] == shape_id].sort_values(by='shape_pt_sequence')
+    response = Response(body, mimetype='application/geo+json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    # 304 without a body when the client's If-None-Match still matches
+    return response.make_conditional(request)
 
-    map_center = [first_stop.iloc[0]['stop_lat'], first_stop.iloc[0]['stop_lon']]
-    route_map = folium.Map(location=map_center, zoom_start=12)
 
-    marker_cluster = MarkerCluster().add_to(route_map)
+# Finished background jobs kept for polling, per kind of job; older ones are forgotten
+MAX_FINISHED_JOBS = 100
 
-    for _, row in stop_data.iterrows():
-        Marker(
-            location=[row['stop_lat'], row['stop_lon']],
-            popup=f"Stop: {row['stop_name']} (Sequence: {row['stop_sequence']})",
-            icon=folium.Icon(color='blue', icon='info-sign')
-        ).add_to(marker_cluster)
 
-    Marker(
-        location=[first_stop.iloc[0]['stop_lat'], first_stop.iloc[0]['stop_lon']],
-        popup=f"Source: {first_stop.iloc[0]['stop_name']}",
-        icon=folium.Icon(color='green', icon='play')
-    ).add_to(route_map)
+def add_job(jobs, job_id, job):
+    """
+    Register a background job, dropping the oldest finished jobs past MAX_FINISHED_JOBS.
+    """
+    finished = [key for key, value in list(jobs.items()) if value['status'] != 'running']
+    for key in finished[:max(len(finished) - MAX_FINISHED_JOBS + 1, 0)]:
+        jobs.pop(key, None)
+    jobs[job_id] = job
+    return job
 
-    Marker(
-        location=[last_stop.iloc[0]['stop_lat'], last_stop.iloc[0]['stop_lon']],
-        popup=f"Destination: {last_stop.iloc[0]['stop_name']}",
-        icon=folium.Icon(color='red', icon='stop')
-    ).add_to(route_map)
 
-    shape_coords = shape_data[['shape_pt_lat', 'shape_pt_lon']].values.tolist()
-    folium.PolyLine(locations=shape_coords, color='purple', weight=5, opacity=0.7).add_to(route_map)
+# Progress of the /plot_route/batch jobs, by job id
+map_batches = {}
+MAP_BATCH_DIR = Path('data/route_maps/batches')
 
-    route_map.save(f"{route_id}_route_map.html")  # Save the map as an HTML file
-    return jsonify({"status": "success", "message": "Map created.", "map_file": f"{route_id}_route_map.html"})
 
+def _run_map_batch(job_id, fact, shapes, route_ids, processes):
+    job = map_batches[job_id]
 
-@app.route('/train_model', methods=['POST'])
-def train_model():
-
-    stop_times_trips_shapes_stops = app.config['STOP_TIMES_TRIPS_SHAPES_STOPS']
-
-    # Calculate travel time and distance traveled
-    stop_times_trips_shapes_stops['travel_time'] = stop_times_trips_shapes_stops.groupby(by="trip_id")['arrival_time'].diff().dt.total_seconds().fillna(0)
-    stop_times_trips_shapes_stops['distance_traveled'] = stop_times_trips_shapes_stops.groupby('trip_id')['shape_dist_traveled'].diff().fillna(0)
-
-    # Convert IDs to integers
-    stop_times_trips_shapes_stops['route_id_int'] = stop_times_trips_shapes_stops['route_id'].astype(int)
-    stop_times_trips_shapes_stops['trip_id_int'] = stop_times_trips_shapes_stops['trip_id'].astype(int)
-    stop_times_trips_shapes_stops['stop_id_int'] = stop_times_trips_shapes_stops['stop_id'].astype(int)
-
-    # Select features and target variable for the model
-    X = stop_times_trips_shapes_stops[['stop_sequence', 'distance_traveled', 'route_id_int', 'trip_id_int']]
-    y = stop_times_trips_shapes_stops['travel_time']
-
-    # Split the data into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    # Train the Random Forest model
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
+    def report(done, total):
+        job.update(done=done, total=total)
 
-    # Make predictions
-    y_pred = model.predict(X_test)
-
-    # Create a scatter plot for actual vs predicted travel time
-    plt.figure(figsize=(10, 6))
-    plt.scatter(y_test, y_pred, alpha=0.3)
-    plt.xlabel('Actual Travel Time (seconds)')
-    plt.ylabel('Predicted Travel Time (seconds)')
-    plt.title('Actual vs Predicted Travel Time')
+    try:
+        index = batch_route_maps(fact, shapes, job['output_dir'], route_ids, processes, report)
+        job.update(status='done', num_routes=len(index))
+    except Exception as e:
+        job.update(status='error', error=str(e))
+
+
+@app.route('/plot_route/batch', methods=['POST'])
+def plot_route_batch():
+    fact = app.config.get('STOP_TIMES_FACT')
+    if fact is None:
+        return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
+
+    params = request.get_json(silent=True) or {}
+    route_ids = params.get('route_ids')
+    if route_ids is not None and not isinstance(route_ids, list):
+        return jsonify({"status": "error", "message": "route_ids must be a list."}), 400
+    processes = params.get('processes')
+    if processes is not None and (not isinstance(processes, int) or isinstance(processes, bool) or processes < 1):
+        return jsonify({"status": "error", "message": "processes must be a positive integer."}), 400
+
+    # Maps of all (or the given) routes written to data/route_maps/batches/<job_id>/
+    # by a spawned process pool, in a background thread; poll /plot_route/batch/<job_id>
+    job_id = uuid.uuid4().hex
+    output_dir = MAP_BATCH_DIR / job_id
+    add_job(map_batches, job_id, {'job_id': job_id, 'status': 'running', 'done': 0, 'total': None,
+                                  'output_dir': str(output_dir)})
+    threading.Thread(target=_run_map_batch, args=(job_id, fact, app.config['SHAPES'], route_ids, processes),
+                     daemon=True).start()
+    return jsonify(map_batches[job_id]), 202
+
+
+@app.route('/plot_route/batch/<job_id>', methods=['GET'])
+def plot_route_batch_status(job_id):
+    job = map_batches.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Batch {job_id} not found."}), 404
+    return jsonify(job), 200
+
+
+# Background travel-time training jobs, by job id
+training_jobs = {}
+# Held-out points drawn in the actual vs predicted chart
+CHART_POINTS = 5000
+
+
+def _run_training(job_id, segments, fact, kind, max_rows):
+    job = training_jobs[job_id]
+    try:
+        meta, actual, predicted = train_travel_time_model(segments, fact, kind, max_rows,
+                                                          progress=lambda step: job.update(step=step))
+        sample = np.random.default_rng(0).permutation(len(actual))[:CHART_POINTS]
+        chart_id = renderer.submit('actual_vs_predicted', {'actual': actual[sample], 'predicted': predicted[sample]})
+        job.update(status='done', step=None, version=meta['version'], metrics=meta['metrics'], chart_id=chart_id,
+                   chart_url=f'/charts/{chart_id}/image')
+    except Exception as e:
+        job.update(status='error', error=str(e))
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.write_image('actual_pred.png')
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
 
-    return jsonify({"status": "success", "message": "Model trained successfully.", "plot": f"data:image/png;base64,{img_str}"})
+@app.route('/train_model', methods=['POST'])
+def train_model():
+    fact = app.config.get('STOP_TIMES_FACT')
+    if fact is None:
+        return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
+
+    params = request.get_json(silent=True) or {}
+    kind = params.get('kind', 'hist_gradient_boosting')
+    max_rows = params.get('max_rows', DEFAULT_MAX_ROWS)
+    if kind not in ('hist_gradient_boosting', 'random_forest'):
+        return jsonify({"status": "error", "message": "kind must be hist_gradient_boosting or random_forest."}), 400
+    # null fits on every segment
+    if max_rows is not None and (not isinstance(max_rows, int) or isinstance(max_rows, bool) or max_rows < 1):
+        return jsonify({"status": "error", "message": "max_rows must be a positive integer or null."}), 400
+
+    # Fitted on float32 segment features in a background thread and saved as a
+    # new model version; poll /train_model/<job_id>
+    job_id = uuid.uuid4().hex
+    add_job(training_jobs, job_id, {'job_id': job_id, 'status': 'running', 'step': 'queued', 'kind': kind})
+    threading.Thread(target=_run_training, args=(job_id, app.config['SEGMENTS'], fact, kind, max_rows),
+                     daemon=True).start()
+    return jsonify(dict(training_jobs[job_id], status_url=f'/train_model/{job_id}')), 202
+
+
+@app.route('/train_model/<job_id>', methods=['GET'])
+def train_model_status(job_id):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Training job {job_id} not found."}), 404
+    return jsonify(job), 200
+
+
+@app.route('/models', methods=['GET'])
+def model_versions():
+    versions = [{key: value for key, value in meta.items() if key != 'route_ids'} for meta in list_versions()]
+    return jsonify({'latest': latest_version(), 'versions': versions}), 200
+
+
+QUERY_FIELDS = ['trip_id', 'from_stop_id', 'to_stop_id']
+MAX_QUERIES = 10000
+# Concurrent /predict_travel_time requests are predicted together, in one model call
+travel_time_batcher = MicroBatcher(
+    lambda frames: predict_batches(app.config['STOP_TIMES_FACT'], app.config['SEGMENTS'], frames))
+
+
+@app.route('/predict_travel_time', methods=['GET', 'POST'])
+def predict_travel_time():
+    if app.config.get('STOP_TIMES_FACT') is None:
+        return jsonify({'error': 'GTFS data has not been cleaned yet. Please call the /clean_data endpoint first.'}), 400
+
+    # One query as request arguments, or a batch as {"queries": [{...}, ...]}
+    if request.method == 'POST':
+        queries = (request.get_json(silent=True) or {}).get('queries')
+    else:
+        queries = [request.args.to_dict()]
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, dict) for query in queries):
+        return jsonify({'error': 'Expected a non-empty list of queries.'}), 400
+    if len(queries) > MAX_QUERIES:
+        return jsonify({'error': f'At most {MAX_QUERIES} queries per request.'}), 400
+    missing = sorted({field for query in queries for field in QUERY_FIELDS if not query.get(field)})
+    if missing:
+        return jsonify({'error': f'Every query needs {QUERY_FIELDS}, missing {missing}.'}), 400
+
+    frame = pd.DataFrame(queries, columns=QUERY_FIELDS + ['departure_time'])
+    try:
+        predictions, version = travel_time_batcher.submit(frame)
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'model_version': version, 'predictions': pd.concat([frame, predictions], axis=1)}), 200
 
 
 @app.route('/cluster_stops', methods=['POST'])
 def cluster_stops():
-    stops_df = app.config['STOPS']
+    # Copied since the cluster labels are added to it
+    stops_df = app.config['STOP_TIMES_FACT'].stops.copy()
 
     if 'stop_lat' not in stops_df.columns or 'stop_lon' not in stops_df.columns:
         return jsonify({"status": "error", "message": "Missing latitude or longitude columns."}), 400
@@ -427,26 +410,12 @@ def cluster_stops():
     kmeans = KMeans(n_clusters=10, random_state=42)
     stops_df['cluster'] = kmeans.fit_predict(stop_coords)
 
-    # Create a scatter plot of the clusters
-    plt.figure(figsize=(10, 6))
-    scatter = plt.scatter(stops_df['stop_lon'], stops_df['stop_lat'], c=stops_df['cluster'], cmap='Set1', alpha=0.7)
-
-    # Adding labels and title
-    plt.title('Stop Clustering')
-    plt.xlabel('Longitude')
-    plt.ylabel('Latitude')
-    plt.colorbar(scatter, label='Cluster')
-
-    # Save the plot to a bytes buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    plt.write_image('cluster.png')
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-
-    # Return the plot as a base64 encoded string
-    return jsonify({"status": "success", "message": "Clustering completed successfully.", "plot": f"data:image/png;base64,{img_str}"})
+    # Scatter plot of the clusters, rendered in the background
+    return chart_response('clusters', {
+        'stop_lon': stops_df['stop_lon'],
+        'stop_lat': stops_df['stop_lat'],
+        'cluster': stops_df['cluster'],
+    }, {'status': 'success', 'message': 'Clustering completed successfully.'})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+"""
+GTFS time values as integer seconds after service-day midnight.
+
+GTFS times may run past 24:00:00 for trips that continue after midnight, so
+they are kept as int32 offsets from the service day rather than clock times.
+"""
+import numpy as np
+import pandas as pd
+
+# Sentinel for a missing or unparseable time
+NO_TIME = -1
+
+
+def time_to_seconds(times):
+    """
+    Vectorized 'H:MM:SS' / 'HH:MM:SS' parser returning an int32 array of seconds
+    after midnight, with NO_TIME for missing or malformed values. Each distinct
+    string is parsed once, as fixed-width characters.
+    """
+    codes, uniques = pd.factorize(pd.Series(times, dtype=object))
+
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip().str.zfill(8)
+    chars = np.array(text.tolist(), dtype='U8').view(np.uint32).reshape(-1, 8).astype(np.int32)
+    digits = chars - ord('0')
+
+    colons = (chars[:, 2] == ord(':')) & (chars[:, 5] == ord(':'))
+    numeric = ((digits[:, [0, 1, 3, 4, 6, 7]] >= 0) & (digits[:, [0, 1, 3, 4, 6, 7]] <= 9)).all(axis=1)
+    valid = colons & numeric & (text.str.len().to_numpy() == 8)
+
+    seconds = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+               (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+               digits[:, 6] * 10 + digits[:, 7])
+    seconds = np.where(valid, seconds, NO_TIME).astype(np.int32)
+
+    out = np.full(len(codes), NO_TIME, dtype=np.int32)
+    found = codes != -1
+    out[found] = seconds[codes[found]]
+    return out
+
+
+def seconds_to_time(seconds):
+    """
+    Format seconds after midnight back to GTFS 'HH:MM:SS' strings (hours may exceed 23).
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    hours, rest = np.divmod(seconds, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    out = pd.Series(hours).map('{:02d}'.format) + ':' + \
+        pd.Series(minutes).map('{:02d}'.format) + ':' + pd.Series(secs).map('{:02d}'.format)
+    out[seconds == NO_TIME] = None
+    return out.to_numpy(dtype=object)
+
+
+def seconds_to_datetime(seconds, service_date=None):
+    """
+    Turn seconds after midnight into datetimes on the given service date (today by
+    default). Times past 24:00:00 roll over to the following days; NO_TIME gives NaT.
+    """
+    base = pd.Timestamp.today().normalize() if service_date is None else pd.Timestamp(service_date).normalize()
+    seconds = pd.Series(np.asarray(seconds), index=getattr(seconds, 'index', None))
+    return base + pd.to_timedelta(seconds.where(seconds != NO_TIME), unit='s')
+
+
+def add_time_columns(feed):
+    # Integer copies of the arrival and departure times, parsed once at load
+    feed.stop_times['arrival_secs'] = time_to_seconds(feed.stop_times['arrival_time'])
+    feed.stop_times['departure_secs'] = time_to_seconds(feed.stop_times['departure_time'])
+    return feed
+
+
+def hour_buckets(edges, labels):
+    """
+    Define a bucketing of hours: labels[0] applies before edges[0], labels[i]
+    to [edges[i-1], edges[i]) and labels[-1] from edges[-1] on. A label of None
+    leaves those hours unclassified.
+    """
+    if len(labels) != len(edges) + 1:
+        raise ValueError('hour_buckets needs exactly one more label than edges')
+    return np.asarray(edges, dtype=np.int32), list(labels)
+
+
+# Time of day of a trip by the hour it starts
+TIME_OF_DAY = hour_buckets(
+    [4, 8, 12, 16, 20, 24],
+    ['Mid Night', 'Morning', 'Peak Morning', 'Afternoon', 'Peak Evening', 'Night', 'Mid Night'],
+)
+
+# Two hour periods of the service day, hours past 23 are left out
+TIME_PERIOD = hour_buckets(
+    list(range(0, 25, 2)),
+    [None] + [f'{i}:00-{i + 1}:59' for i in range(0, 23, 2)] + [None],
+)
+
+DEFAULT_BUCKETS = {'time_of_day': TIME_OF_DAY, 'time_period': TIME_PERIOD}
+
+
+def classify_hours(hours, buckets):
+    """
+    Label an array of hours with a bucketing from hour_buckets(), as a Categorical.
+    """
+    edges, labels = buckets
+    categories = list(dict.fromkeys(label for label in labels if label is not None))
+    label_codes = np.array([categories.index(label) if label is not None else -1 for label in labels])
+
+    hours = np.asarray(hours)
+    codes = label_codes[np.searchsorted(edges, hours, side='right')]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def add_time_buckets(trip_stats, buckets=DEFAULT_BUCKETS):
+    """
+    Add the start time in seconds and one categorical column per bucketing to
+    trip_stats, in a single vectorized pass over the start hours.
+    """
+    start_secs = time_to_seconds(trip_stats['start_time'])
+    missing = start_secs == NO_TIME
+    hours = np.where(missing, 0, start_secs // 3600)
+
+    columns = {'start_secs': start_secs}
+    for name, definition in buckets.items():
+        labels = classify_hours(hours, definition)
+        # Trips without a start time are left unclassified
+        codes = np.where(missing, -1, labels.codes)
+        columns[name] = pd.Categorical.from_codes(codes, categories=labels.categories)
+    return trip_stats.assign(**columns)
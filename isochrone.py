@@ -0,0 +1,196 @@
+"""
+One-to-all travel times and isochrones over the RAPTOR timetable.
+
+A query departs from a stop, or from a coordinate by walking to the stops
+around it, anywhere within a departure window. The window is swept latest
+departure first with the labels of each run reused by the next (rRAPTOR),
+so the whole window costs little more than a single earliest-arrival run.
+
+Many origins can be batched across a process pool from the command line:
+
+    python isochrone.py --date 20231011 --time 07:00:00 --window 60 origins.txt out.csv
+"""
+import argparse
+import datetime
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+from gtfs_time import NO_TIME, time_to_seconds
+from journey_planner import INF, MAX_TRANSFERS, timetable_for
+
+WALK_SPEED = 1.3          # metres per second
+WALK_RADIUS = 800         # metres walked from a coordinate origin to its stops
+EARTH_RADIUS = 6371000.0  # metres
+DEFAULT_BANDS = (15, 30, 45, 60)
+
+
+def walk_seconds(lat, lon, stop_lats, stop_lons):
+    """
+    Walking seconds from a coordinate to every stop, along great circles.
+    """
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(stop_lats), np.radians(stop_lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a)) / WALK_SPEED
+
+
+def travel_times(timetable, sources, start, end, max_transfers=3):
+    """
+    Shortest travel time in seconds to every stop code for departures between
+    start and end seconds, given sources as a dict of stop code -> walking
+    seconds from the origin. Unreached stops are INF.
+    """
+    max_rounds = max_transfers + 1
+
+    # Every departure inside the window from a stop reachable on foot, latest first
+    leave = dict(sources)
+    for stop, walk in sources.items():
+        for to_stop, seconds in timetable.footpaths.get(stop, ()):
+            leave[to_stop] = min(leave.get(to_stop, INF), walk + seconds)
+    departures = {start, end}
+    for stop, walk in leave.items():
+        for p, position in timetable.stop_patterns.get(stop, ()):
+            column = np.asarray(timetable.patterns[p].departure_columns[position])
+            inside = column[(column >= start + walk) & (column <= end + walk)] - walk
+            departures.update(inside.tolist())
+    departures = sorted((d for d in departures if start <= d <= end), reverse=True)
+
+    best_by_round = [[INF] * len(timetable.stop_ids) for _ in range(max_rounds + 1)]
+    shortest = np.full(len(timetable.stop_ids), INF, dtype=np.int64)
+    for departure in departures:
+        ready = {stop: departure + walk for stop, walk in sources.items()}
+        arrivals, _ = timetable.raptor(ready, max_rounds=max_rounds, best_by_round=best_by_round)
+        improved = np.fromiter(set().union(*arrivals), dtype=np.int64)
+        if len(improved):
+            final = np.asarray(best_by_round[-1], dtype=np.int64)[improved]
+            shortest[improved] = np.minimum(shortest[improved], final - departure)
+    return shortest
+
+
+def origin_sources(timetable, stops, stop_id=None, lat=None, lon=None, radius=WALK_RADIUS):
+    """
+    Source stops of an origin given by stop_id or by coordinate, with walking seconds.
+    """
+    if stop_id is not None:
+        code = timetable.stop_codes.get(stop_id)
+        return {} if code is None else {code: 0}
+    seconds = walk_seconds(lat, lon, stops['stop_lat'].to_numpy(dtype=float), stops['stop_lon'].to_numpy(dtype=float))
+    near = np.flatnonzero(seconds <= radius / WALK_SPEED)
+    return {timetable.stop_codes[stop_id]: int(seconds[i])
+            for i, stop_id in zip(near, stops['stop_id'].to_numpy(dtype=object)[near])
+            if stop_id in timetable.stop_codes}
+
+
+def band_polygons(stops, minutes, bands):
+    """
+    GeoJSON FeatureCollection with one polygon per band: the union of circles
+    around every stop reached within the band, sized by the walking time left.
+    """
+    lat0 = float(np.nanmean(stops['stop_lat'])) if len(stops) else 0.0
+    metres_per_degree = np.pi * EARTH_RADIUS / 180
+    features = []
+    for band in bands:
+        inside = minutes <= band
+        if not inside.any():
+            continue
+        radius = np.minimum((band - minutes[inside]) * 60 * WALK_SPEED, WALK_RADIUS)
+        # Buffer in a local equirectangular plane so circles stay round on the map
+        x = stops['stop_lon'].to_numpy(dtype=float)[inside] * np.cos(np.radians(lat0)) * metres_per_degree
+        y = stops['stop_lat'].to_numpy(dtype=float)[inside] * metres_per_degree
+        area = shapely.union_all(shapely.buffer(shapely.points(x, y), radius, quad_segs=4))
+        area = shapely.transform(area, lambda xy: xy / [np.cos(np.radians(lat0)) * metres_per_degree, metres_per_degree])
+        features.append({'type': 'Feature', 'geometry': mapping(area), 'properties': {'minutes': band}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def compute_isochrone(feed, date, departure_time, window_minutes=0, stop_id=None, lat=None, lon=None,
+                      max_transfers=3, bands=DEFAULT_BANDS, polygons=False):
+    """
+    Shortest travel time from an origin stop or coordinate to every reachable
+    stop, for departures in [departure_time, departure_time + window_minutes],
+    grouped into time bands in minutes.
+    """
+    start = int(time_to_seconds([departure_time])[0])
+    if start == NO_TIME:
+        raise ValueError(f'Invalid departure time {departure_time!r}, use HH:MM:SS')
+    datetime.datetime.strptime(date, '%Y%m%d')
+    max_transfers = min(max(int(max_transfers), 0), MAX_TRANSFERS)
+    bands = sorted(bands)
+
+    timetable = timetable_for(feed, date)
+    # Stop codes of the timetable are positions in feed.stops
+    stops = feed.stops.reset_index(drop=True)
+    sources = origin_sources(timetable, stops, stop_id, lat, lon)
+    if not sources:
+        return None
+
+    seconds = travel_times(timetable, sources, start, start + int(window_minutes) * 60, max_transfers)
+    reached = seconds <= bands[-1] * 60
+    minutes = np.round(seconds[reached] / 60, 1)
+    result = stops.loc[reached, ['stop_id', 'stop_name', 'stop_lat', 'stop_lon']].assign(travel_time=minutes)
+    result['band'] = np.asarray(bands)[np.searchsorted(bands, minutes, side='left')]
+    result = result.sort_values('travel_time')
+
+    # Frames of the reached stops of every band, encoded by frame_json like the other endpoints
+    isochrone = {
+        'num_stops': int(reached.sum()),
+        'bands': {int(band): group.drop(columns='band').reset_index(drop=True)
+                  for band, group in result.groupby('band')},
+    }
+    if polygons:
+        isochrone['polygons'] = band_polygons(result, result['travel_time'].to_numpy(), bands)
+    return isochrone
+
+
+# Timetable inherited by the forked pool workers, so it is never pickled
+_worker_timetable = None
+
+
+def _origin_travel_times(job):
+    stop_id, start, end, max_transfers = job
+    sources = origin_sources(_worker_timetable, None, stop_id=stop_id)
+    return stop_id, travel_times(_worker_timetable, sources, start, end, max_transfers)
+
+
+def batch_travel_times(feed, origins, date, departure_time, window_minutes=0, max_transfers=3, processes=None):
+    """
+    Travel-time matrix in minutes (origin stop x stop) for many origin stop ids,
+    spread over a forked process pool that shares the compiled timetable.
+    """
+    global _worker_timetable
+    _worker_timetable = timetable_for(feed, date)
+    start = int(time_to_seconds([departure_time])[0])
+    jobs = [(stop_id, start, start + int(window_minutes) * 60, max_transfers) for stop_id in origins]
+
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        rows = dict(pool.imap_unordered(_origin_travel_times, jobs, chunksize=4))
+
+    matrix = pd.DataFrame({stop_id: rows[stop_id] for stop_id in origins if stop_id in rows},
+                          index=_worker_timetable.stop_ids).T
+    return (matrix.where(matrix < INF) / 60).round(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Travel times from many origin stops.')
+    parser.add_argument('origins', help='text file with one origin stop_id per line')
+    parser.add_argument('output', help='CSV file for the origin x stop travel-time matrix (minutes)')
+    parser.add_argument('--feed', default='data/gtfs-nyc-2023.zip')
+    parser.add_argument('--date', required=True, help='service date, YYYYMMDD')
+    parser.add_argument('--time', default='08:00:00', help='earliest departure, HH:MM:SS')
+    parser.add_argument('--window', type=int, default=0, help='departure window in minutes')
+    parser.add_argument('--max-transfers', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    from feed_loader import load_feed
+
+    origins = [line.strip() for line in Path(args.origins).read_text().splitlines() if line.strip()]
+    matrix = batch_travel_times(load_feed(args.feed), origins, args.date, args.time, args.window,
+                                args.max_transfers, args.processes)
+    matrix.to_csv(args.output, index_label='origin_stop_id')
+    print(f'Travel times from {len(matrix)} origins written to {args.output}')
@@ -0,0 +1,363 @@
+"""
+Transfer-aware journey planning over the GTFS timetable with RAPTOR
+(Delling, Pajor and Werneck, "Round-Based Public Transit Routing").
+
+The timetable of a service date is compiled once into array-based patterns:
+trips serving the same stop sequence are stacked into arrival/departure
+matrices sorted by departure, so boarding is a binary search on a column.
+"""
+import datetime
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from feed_cache import services_on
+from feed_index import feed_index
+from gtfs_time import NO_TIME, seconds_to_time, time_to_seconds
+
+# Walking time between the stops of a transfers.txt entry without min_transfer_time
+DEFAULT_TRANSFER_SECONDS = 120
+# Cap on the number of transfers a query may ask for
+MAX_TRANSFERS = 8
+
+DAY = 24 * 3600
+INF = 1 << 40
+
+
+class Pattern:
+    """
+    Trips sharing one stop sequence, with one row per trip ordered by departure
+    time and no overtaking between rows. The times are kept as plain lists,
+    which the scan loop indexes much faster than numpy scalars.
+    """
+    __slots__ = ('stops', 'trip_ids', 'route_ids', 'arrivals', 'departures', 'departure_columns')
+
+    def __init__(self, stops, trip_ids, route_ids, arrivals, departures):
+        self.stops = stops
+        self.trip_ids = trip_ids
+        self.route_ids = route_ids
+        self.arrivals = arrivals.tolist()
+        self.departures = departures.tolist()
+        # Departures at each stop of the pattern, sorted since trips do not overtake
+        self.departure_columns = departures.T.tolist()
+
+
+def _interpolate(times):
+    """
+    Fill NO_TIME entries of one trip linearly between the known times around them.
+    """
+    known = times != NO_TIME
+    if known.all() or known.sum() < 2:
+        return times
+    positions = np.arange(len(times))
+    return np.interp(positions, positions[known], times[known]).astype(np.int32)
+
+
+def _fifo_groups(arrivals, departures):
+    """
+    Split trips already sorted by first departure into groups where no trip
+    overtakes an earlier one, so every column of a group stays sorted.
+    """
+    groups = []
+    for row in range(len(arrivals)):
+        for group in groups:
+            last = group[-1]
+            if (arrivals[last] <= arrivals[row]).all() and (departures[last] <= departures[row]).all():
+                group.append(row)
+                break
+        else:
+            groups.append([row])
+    return groups
+
+
+class Timetable:
+    """
+    RAPTOR timetable of a single service date. Trips of the previous service
+    day that run past midnight are included with their times shifted by a day.
+    """
+
+    def __init__(self, feed, date, transfer_seconds=DEFAULT_TRANSFER_SECONDS):
+        self.index = feed_index(feed)
+        self.date = date
+        stop_times = self.index.stop_times.frame
+        trip_ranges = self.index.stop_times.ranges
+
+        self.stop_ids = feed.stops['stop_id'].to_numpy(dtype=object)
+        self.stop_codes = {stop_id: code for code, stop_id in enumerate(self.stop_ids)}
+        stop_codes = pd.Index(self.stop_ids).get_indexer(stop_times['stop_id'])
+
+        if 'arrival_secs' in stop_times:
+            arrivals = stop_times['arrival_secs'].to_numpy(dtype=np.int32)
+            departures = stop_times['departure_secs'].to_numpy(dtype=np.int32)
+        else:
+            arrivals = time_to_seconds(stop_times['arrival_time'])
+            departures = time_to_seconds(stop_times['departure_time'])
+
+        previous = (pd.Timestamp(date) - pd.Timedelta(days=1)).strftime('%Y%m%d')
+        trips = feed.trips[['trip_id', 'route_id', 'service_id']]
+        running = [(trips[trips['service_id'].isin(services_on(feed, date))], 0),
+                   (trips[trips['service_id'].isin(services_on(feed, previous))], -DAY)]
+
+        grouped = {}
+        for active, shift in running:
+            for trip_id, route_id in zip(active['trip_id'], active['route_id']):
+                if trip_id not in trip_ranges:
+                    continue
+                start, stop = trip_ranges[trip_id]
+                stops = stop_codes[start:stop]
+                if stop - start < 2 or (stops < 0).any():
+                    continue
+                trip_arrivals = _interpolate(arrivals[start:stop])
+                trip_departures = _interpolate(departures[start:stop])
+                if (trip_arrivals == NO_TIME).any() or (trip_departures == NO_TIME).any():
+                    continue
+                if shift and trip_arrivals[-1] < DAY:
+                    continue
+                grouped.setdefault(stops.tobytes(), []).append(
+                    (trip_departures[0] + shift, trip_id, route_id, trip_arrivals + shift, trip_departures + shift))
+
+        self.patterns = []
+        for key, members in grouped.items():
+            members.sort(key=lambda member: member[0])
+            stops = np.frombuffer(key, dtype=stop_codes.dtype).tolist()
+            arrival_rows = np.vstack([member[3] for member in members])
+            departure_rows = np.vstack([member[4] for member in members])
+            for rows in _fifo_groups(arrival_rows, departure_rows):
+                self.patterns.append(Pattern(stops,
+                                             [members[row][1] for row in rows],
+                                             [members[row][2] for row in rows],
+                                             arrival_rows[rows],
+                                             departure_rows[rows]))
+
+        # Patterns through each stop, with the position of the stop in the pattern
+        self.stop_patterns = {}
+        for p, pattern in enumerate(self.patterns):
+            for position, stop in enumerate(pattern.stops):
+                self.stop_patterns.setdefault(stop, []).append((p, position))
+
+        self.footpaths = {}
+        transfers = getattr(feed, 'transfers', None)
+        if transfers is not None and not transfers.empty:
+            transfers = transfers[transfers['from_stop_id'] != transfers['to_stop_id']]
+            if 'transfer_type' in transfers:
+                transfers = transfers[transfers['transfer_type'].fillna(0) != 3]
+            if 'min_transfer_time' in transfers:
+                durations = transfers['min_transfer_time'].fillna(transfer_seconds)
+            else:
+                durations = pd.Series(transfer_seconds, index=transfers.index)
+            for from_id, to_id, seconds in zip(transfers['from_stop_id'], transfers['to_stop_id'], durations):
+                if from_id in self.stop_codes and to_id in self.stop_codes:
+                    self.footpaths.setdefault(self.stop_codes[from_id], []).append(
+                        (self.stop_codes[to_id], int(seconds)))
+
+    def _walk(self, stops, arrival, label, best, marked, target_best):
+        # Relax footpaths until nothing improves, so chained transfers do not
+        # depend on the order the stops are visited in
+        while stops:
+            stop = stops.pop()
+            for to_stop, seconds in self.footpaths.get(stop, ()):
+                time = arrival[stop] + seconds
+                if time < best[to_stop] and time < target_best:
+                    arrival[to_stop] = best[to_stop] = time
+                    label[to_stop] = ('walk', stop, seconds)
+                    marked.add(to_stop)
+                    stops.append(to_stop)
+
+    def raptor(self, sources, targets=(), max_rounds=4, best_by_round=None):
+        """
+        Earliest arrival rounds from sources, a dict of stop code -> time the stop
+        can be left. Round k holds the stops improved using k trips, with the
+        label each was reached by.
+
+        best_by_round[k] is the best arrival at every stop using at most k trips.
+        Passing the one of a previous call with a later departure reuses its
+        labels, which turns repeated calls into a range query (rRAPTOR).
+        """
+        if best_by_round is None:
+            best_by_round = [[INF] * len(self.stop_ids) for _ in range(max_rounds + 1)]
+
+        best = best_by_round[0]
+        arrival, label = {}, {}
+        for stop, time in sources.items():
+            if time < best[stop]:
+                arrival[stop] = best[stop] = time
+                label[stop] = None
+        marked = set(arrival)
+        self._walk(list(marked), arrival, label, best, marked, INF)
+        arrivals, labels = [arrival], [label]
+        improved = set(arrival)
+
+        for k in range(1, max_rounds + 1):
+            target_best = min((best[stop] for stop in targets), default=INF)
+            reachable, best = best, best_by_round[k]
+            # At most k trips is never worse than at most k - 1
+            for stop in improved:
+                if reachable[stop] < best[stop]:
+                    best[stop] = reachable[stop]
+            arrival, label = {}, {}
+
+            queue = {}
+            for stop in marked:
+                for p, position in self.stop_patterns.get(stop, ()):
+                    if position < queue.get(p, INF):
+                        queue[p] = position
+
+            marked = set()
+            for p, first in queue.items():
+                pattern = self.patterns[p]
+                stops, columns = pattern.stops, pattern.departure_columns
+                trips = len(pattern.trip_ids)
+                trip = board = -1
+                times = None
+                for position in range(first, len(stops)):
+                    stop = stops[position]
+                    if trip >= 0:
+                        time = times[position]
+                        if time < best[stop] and time < target_best:
+                            arrival[stop] = best[stop] = time
+                            label[stop] = ('ride', p, trip, board, position)
+                            marked.add(stop)
+                            if stop in targets:
+                                target_best = time
+
+                    ready = reachable[stop]
+                    if ready < INF and (trip < 0 or ready <= columns[position][trip]):
+                        catch = bisect_left(columns[position], ready, 0, trips if trip < 0 else trip)
+                        if catch < (trips if trip < 0 else trip):
+                            trip, board = catch, position
+                            times = pattern.arrivals[trip]
+
+            self._walk(list(marked), arrival, label, best, marked, target_best)
+            arrivals.append(arrival)
+            labels.append(label)
+            improved.update(arrival)
+            if not marked:
+                break
+
+        # Carry this call's arrivals up to the rounds it did not reach
+        for higher in best_by_round[len(arrivals):]:
+            for stop in improved:
+                if best[stop] < higher[stop]:
+                    higher[stop] = best[stop]
+        return arrivals, labels
+
+    def _legs(self, labels, rounds, stop):
+        legs = []
+        while True:
+            label = labels[rounds][stop]
+            if label is None:
+                return legs[::-1]
+            if label[0] == 'walk':
+                _, from_stop, seconds = label
+                legs.append({'type': 'transfer',
+                             'from_stop_id': self.stop_ids[from_stop],
+                             'to_stop_id': self.stop_ids[stop],
+                             'duration': seconds})
+                stop = from_stop
+                continue
+
+            _, p, trip, board, alight = label
+            pattern = self.patterns[p]
+            legs.append({'type': 'ride',
+                         'trip_id': pattern.trip_ids[trip],
+                         'route_id': pattern.route_ids[trip],
+                         'from_stop_id': self.stop_ids[pattern.stops[board]],
+                         'to_stop_id': self.stop_ids[pattern.stops[alight]],
+                         'departure_time': seconds_to_time([pattern.departures[trip][board]])[0],
+                         'arrival_time': seconds_to_time([pattern.arrivals[trip][alight]])[0],
+                         'num_stops': alight - board})
+            # Boarded with the arrival known before this round, from the last round that improved it
+            stop = pattern.stops[board]
+            earlier = max((k for k in range(rounds) if stop in labels[k]), default=None)
+            if earlier is None:
+                # A boarding stop is always labelled in an earlier round, so the labels are inconsistent
+                raise LookupError(f'No label of stop {self.stop_ids[stop]} before round {rounds}')
+            rounds = earlier
+
+    def plan(self, from_stop_ids, to_stop_ids, departure, max_transfers=3):
+        """
+        Pareto-optimal journeys (earliest arrival vs. number of transfers) between
+        two sets of stop ids, leaving at or after `departure` seconds.
+        """
+        sources = [self.stop_codes[stop_id] for stop_id in from_stop_ids if stop_id in self.stop_codes]
+        targets = {self.stop_codes[stop_id] for stop_id in to_stop_ids if stop_id in self.stop_codes}
+        if not sources or not targets:
+            return []
+
+        arrivals, labels = self.raptor({stop: departure for stop in sources}, targets, max_transfers + 1)
+
+        journeys = []
+        earliest = INF
+        for rounds, arrival in enumerate(arrivals):
+            reached = [(arrival[stop], stop) for stop in targets if stop in arrival]
+            if not reached:
+                continue
+            time, stop = min(reached)
+            if time >= earliest:
+                continue
+            earliest = time
+            legs = self._legs(labels, rounds, stop)
+            journeys.append({'departure_time': next((leg['departure_time'] for leg in legs if leg['type'] == 'ride'),
+                                                    seconds_to_time([departure])[0]),
+                             'arrival_time': seconds_to_time([time])[0],
+                             'duration': time - departure,
+                             'num_transfers': max(rounds - 1, 0),
+                             'legs': legs})
+        return journeys
+
+
+_timetables = OrderedDict()
+_timetables_lock = threading.Lock()
+# Lock per date being compiled, so requests for other dates are not held up by it
+_timetables_pending = {}
+
+
+def timetable_for(feed, date, maxsize=4):
+    """
+    Return the compiled Timetable of a YYYYMMDD date, keeping the last few dates
+    and rebuilding them when the feed index changes.
+    """
+    index = feed_index(feed)
+
+    def lookup():
+        with _timetables_lock:
+            timetable = _timetables.get(date)
+            if timetable is not None and timetable.index is index:
+                _timetables.move_to_end(date)
+                return timetable
+        return None
+
+    timetable = lookup()
+    if timetable is not None:
+        return timetable
+    # One compilation per date, concurrent requests for it wait on the result
+    with _timetables_lock:
+        pending = _timetables_pending.setdefault(date, threading.Lock())
+    with pending:
+        try:
+            timetable = lookup()
+            if timetable is None:
+                timetable = Timetable(feed, date)
+                with _timetables_lock:
+                    _timetables[date] = timetable
+                    while len(_timetables) > maxsize:
+                        _timetables.popitem(last=False)
+        finally:
+            with _timetables_lock:
+                _timetables_pending.pop(date, None)
+    return timetable
+
+
+def plan_journeys(feed, from_stop_ids, to_stop_ids, date, departure_time, max_transfers=3):
+    """
+    Journeys between two stop sets on a YYYYMMDD date leaving after an 'HH:MM:SS' time.
+    """
+    departure = int(time_to_seconds([departure_time])[0])
+    if departure == NO_TIME:
+        raise ValueError(f'Invalid departure time {departure_time!r}, use HH:MM:SS')
+    datetime.datetime.strptime(date, '%Y%m%d')
+    max_transfers = min(max(int(max_transfers), 0), MAX_TRANSFERS)
+    return timetable_for(feed, date).plan(from_stop_ids, to_stop_ids, departure, max_transfers)
@@ -0,0 +1,139 @@
+"""
+Cursor pagination, field projection and streaming for the bulk list endpoints.
+
+Lists are served from the key-sorted frames of the feed index. A cursor is the
+key of the last row sent, so a page starts with a binary search on the key
+column, and rows are serialized chunk by chunk from column arrays instead of
+building one dict per row of the whole table.
+"""
+import base64
+import json
+
+import numpy as np
+from flask import Response, jsonify
+
+from frame_json import dumps, frame_records
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 10000
+# Rows serialized at a time when streaming
+CHUNK_SIZE = 2000
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor {cursor!r}') from e
+
+
+def select_fields(frame, fields=None):
+    """
+    Columns to send, from a comma separated list of names (all columns when empty).
+    """
+    if not fields:
+        return list(frame.columns)
+    columns = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [column for column in columns if column not in frame.columns]
+    if unknown:
+        raise ValueError(f'Unknown fields {unknown}, available: {list(frame.columns)}')
+    return columns
+
+
+def page(frame, key, cursor=None, limit=None):
+    """
+    Rows of a frame sorted by key that come after the cursor, at most limit of
+    them, with the cursor of the next page (None on the last page).
+    """
+    keys = frame[key].to_numpy()
+    start = 0
+    if cursor is not None:
+        value = decode_cursor(cursor)
+        # The cursor is the key of a row, so a number for numeric keys and a string otherwise
+        expected = (int, float) if keys.dtype.kind in 'iuf' else str
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise ValueError(f'Invalid cursor {cursor!r} for {key}')
+        try:
+            start = int(np.searchsorted(keys, value, side='right'))
+        except TypeError as e:
+            raise ValueError(f'Invalid cursor {cursor!r} for {key}') from e
+    stop = len(frame) if limit is None else min(start + limit, len(frame))
+    next_cursor = None
+    if stop < len(frame):
+        last = keys[stop - 1]
+        # numpy scalars of numeric keys to plain Python for JSON
+        next_cursor = encode_cursor(last.item() if isinstance(last, np.generic) else last)
+    return frame.iloc[start:stop], next_cursor
+
+
+def iter_records(frame, columns, chunk_size=CHUNK_SIZE):
+    """
+    Yield the rows of the frame as lists of dicts, chunk_size rows at a time,
+    with missing values as None.
+    """
+    for start in range(0, len(frame), chunk_size):
+        yield frame_records(frame.iloc[start:start + chunk_size][columns])
+
+
+def _json_array(frame, columns):
+    yield '['
+    first = True
+    for records in iter_records(frame, columns):
+        if not records:
+            continue
+        yield ('' if first else ',') + dumps(records)[1:-1]
+        first = False
+    yield ']'
+
+
+def _ndjson(frame, columns):
+    for records in iter_records(frame, columns):
+        yield ''.join(dumps(record) + '\n' for record in records)
+
+
+def parse_limit(args):
+    """
+    The limit argument as an int, None when it is not given.
+    """
+    limit = args.get('limit')
+    if limit is None:
+        return None
+    try:
+        return int(limit)
+    except ValueError:
+        raise ValueError(f'limit must be an integer, got {limit!r}') from None
+
+
+def list_response(frame, key, args):
+    """
+    Serve a key-sorted frame according to the request arguments:
+
+    - fields: comma separated columns to return
+    - limit, cursor: return one page as {"data", "next_cursor"}
+    - format=ndjson: stream one JSON object per line (the next cursor is in the
+      X-Next-Cursor header)
+
+    Without limit or format the whole list is streamed as a JSON array.
+    """
+    try:
+        columns = select_fields(frame, args.get('fields'))
+        limit = parse_limit(args)
+        if limit is None and args.get('cursor'):
+            limit = DEFAULT_PAGE_SIZE
+        if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        rows, next_cursor = page(frame, key, args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    if args.get('format') == 'ndjson':
+        return Response(_ndjson(rows, columns), mimetype='application/x-ndjson', headers=headers), 200
+    if limit is None:
+        return Response(_json_array(rows, columns), mimetype='application/json'), 200
+
+    return jsonify({'data': rows[columns], 'next_cursor': next_cursor, 'limit': limit}), 200
@@ -0,0 +1,392 @@
+"""
+Precomputed GeoJSON map data of every route, for maps drawn by the client.
+
+A route's map is one FeatureCollection: a Point per distinct stop of the route
+(not per stop time), marked as the route's usual source or destination where
+it is one, and a LineString per distinct shape of its trips. The documents are
+built for all routes at once from the stop_times fact table and the shape
+store, kept in memory with their ETag, and written to data/route_maps/<feed
+fingerprint>/ so the next start with the same feed reads them from disk.
+
+batch_route_maps writes the maps of many routes to a directory from a pool of
+spawned processes, also from the command line, python route_maps.py OUT_DIR.
+The map tables and shape points are written once as uncompressed Arrow files
+that every worker memory-maps, so the workers share the same pages instead of
+each unpickling a copy.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import re
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from feed_cache import feed_fingerprint
+from frame_json import dumps
+
+MAP_DIR = Path('data/route_maps')
+# Feed tables the maps are made of, fingerprinted to version the disk cache
+MAP_TABLES = ('routes', 'trips', 'stops', 'stop_times', 'shapes')
+# About 10 cm, enough for a map and a third shorter than full float precision
+COORD_DECIMALS = 6
+
+
+def _most_common(keys, values):
+    """
+    Most frequent value for every key, as a Series indexed by key.
+    """
+    counts = pd.DataFrame({'key': keys, 'value': values}).value_counts(sort=True)
+    return counts.reset_index().drop_duplicates('key').set_index('key')['value']
+
+
+def _lon_lat(coords):
+    # GeoJSON positions are [lon, lat]
+    return np.round(coords[:, ::-1], COORD_DECIMALS).tolist()
+
+
+def route_stop_table(fact):
+    """
+    Distinct (route, stop) pairs with the smallest stop_sequence of the stop on
+    the route and the number of stop times there, ordered by route and sequence.
+    """
+    stops = fact.facts.groupby(['route_idx', 'stop_idx'], sort=False).agg(
+        stop_sequence=('stop_sequence', 'min'),
+        num_stop_times=('trip_idx', 'size'),
+    ).reset_index()
+    return stops.sort_values(['route_idx', 'stop_sequence', 'stop_idx'], kind='stable').reset_index(drop=True)
+
+
+def route_endpoints(fact):
+    """
+    Most common first and last stop_idx of the trips of every route.
+    """
+    trip = fact.facts['trip_idx'].to_numpy()
+    first = np.flatnonzero(np.r_[True, trip[1:] != trip[:-1]])
+    last = np.r_[first[1:] - 1, len(trip) - 1]
+    route_codes = fact.facts['route_idx'].to_numpy()[first]
+    stop_codes = fact.facts['stop_idx'].to_numpy()
+    return pd.DataFrame({
+        'source': _most_common(route_codes, stop_codes[first]),
+        'destination': _most_common(route_codes, stop_codes[last]),
+    })
+
+
+def map_frames(fact):
+    """
+    Tables the route maps are built from, as plain frames that can be written to Arrow.
+    """
+    return {
+        'route_stops': route_stop_table(fact),
+        'route_shapes': fact.trips.groupby(['route_idx', 'shape_idx'], sort=True).size().rename(
+            'num_trips').reset_index(),
+        'endpoints': route_endpoints(fact).rename_axis('route_idx').reset_index(),
+        'stops': fact.stops[['stop_id', 'stop_name', 'stop_lat', 'stop_lon']],
+        'shapes': fact.shapes[['shape_id']],
+        'routes': fact.routes,
+    }
+
+
+def _route_rows(route_codes):
+    # (start, stop) rows of every route in a frame ordered by route_idx
+    bounds = np.flatnonzero(np.r_[True, np.diff(route_codes) != 0, True])
+    return {int(route_codes[start]): (start, stop) for start, stop in zip(bounds[:-1], bounds[1:])}
+
+
+def map_tables(frames):
+    """
+    Per-route tables and dimension arrays of the map frames, as route_map uses them.
+    """
+    stops, route_shapes = frames['route_stops'], frames['route_shapes']
+    routes = frames['routes']
+    return {
+        'stops': stops,
+        # Rows of the route in stops and in route_shapes, by route_idx
+        'stop_rows': _route_rows(stops['route_idx'].to_numpy()),
+        'shape_rows': _route_rows(route_shapes['route_idx'].to_numpy()),
+        'route_shapes': route_shapes,
+        'endpoints': frames['endpoints'].set_index('route_idx'),
+        'stop_ids': frames['stops']['stop_id'].astype(object).to_numpy(),
+        'stop_names': frames['stops']['stop_name'].astype(object).to_numpy(),
+        'stop_coords': frames['stops'][['stop_lat', 'stop_lon']].to_numpy(dtype=np.float64),
+        'shape_ids': frames['shapes']['shape_id'].astype(object).to_numpy(),
+        'routes': routes.astype(object).where(routes.notna(), None),
+    }
+
+
+def route_map(tables, shapes, route_idx):
+    """
+    GeoJSON FeatureCollection (as a dict) of one route, None when it has no stop times.
+    """
+    if route_idx not in tables['stop_rows']:
+        return None
+    start, stop = tables['stop_rows'][route_idx]
+    rows = tables['stops'].iloc[start:stop]
+    codes = rows['stop_idx'].to_numpy()
+    roles = np.full(len(codes), 'stop', dtype=object)
+    endpoints = tables['endpoints']
+    if route_idx in endpoints.index:
+        roles[codes == endpoints.at[route_idx, 'destination']] = 'destination'
+        roles[codes == endpoints.at[route_idx, 'source']] = 'source'
+
+    stop_coords = tables['stop_coords'][codes]
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': position},
+        'properties': {'stop_id': stop_id, 'stop_name': name, 'stop_sequence': int(sequence), 'role': role,
+                       'num_stop_times': int(count)},
+    } for position, stop_id, name, sequence, role, count in zip(
+        _lon_lat(stop_coords), tables['stop_ids'][codes], tables['stop_names'][codes], rows['stop_sequence'], roles,
+        rows['num_stop_times'])]
+
+    points = [stop_coords]
+    if route_idx in tables['shape_rows']:
+        start, stop = tables['shape_rows'][route_idx]
+        route_shapes = tables['route_shapes'].iloc[start:stop]
+        for shape_idx, num_trips in zip(route_shapes['shape_idx'], route_shapes['num_trips']):
+            shape_id = tables['shape_ids'][shape_idx]
+            coords = shapes.coordinates(shape_id)
+            if len(coords) < 2:
+                continue
+            points.append(coords)
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': _lon_lat(coords)},
+                'properties': {'shape_id': shape_id, 'num_trips': int(num_trips)},
+            })
+
+    points = np.concatenate(points)
+    route = tables['routes'].iloc[route_idx]
+    return {
+        'type': 'FeatureCollection',
+        'bbox': np.round(np.r_[points.min(axis=0)[::-1], points.max(axis=0)[::-1]], COORD_DECIMALS).tolist(),
+        'properties': route.to_dict(),
+        'features': features,
+    }
+
+
+def build_route_maps(fact, shapes):
+    """
+    GeoJSON FeatureCollection (as a dict) of every route, keyed by route_id.
+    """
+    tables = map_tables(map_frames(fact))
+    route_ids = tables['routes']['route_id']
+    return {route_ids.iat[code]: route_map(tables, shapes, code) for code in tables['stop_rows']}
+
+
+def map_file_name(route_id):
+    """
+    File name of a route's map in a batch output directory.
+    """
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(route_id)) + '.geojson'
+
+
+def _write_arrow(df, path):
+    # One record batch, so numeric columns read back as single views on the mapped file
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    feather.write_feather(table, path, compression='uncompressed', chunksize=max(len(df), 1))
+
+
+def _read_arrow(path):
+    with pa.memory_map(str(path), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    # split_blocks lets null-free numeric columns stay views on the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+class MappedShapes:
+    """
+    Shape points of a map snapshot, read from its memory-mapped Arrow files.
+    """
+
+    def __init__(self, index, points):
+        self.positions = {shape_id: i for i, shape_id in enumerate(index['shape_id'].astype(object))}
+        self.starts = index['start'].to_numpy()
+        self.stops = index['stop'].to_numpy()
+        self.lat = points['lat'].to_numpy()
+        self.lon = points['lon'].to_numpy()
+
+    def coordinates(self, shape_id):
+        """
+        (lat, lon) points of a shape as an (n, 2) array, empty when unknown.
+        """
+        i = self.positions.get(shape_id)
+        if i is None:
+            return np.empty((0, 2))
+        start, stop = self.starts[i], self.stops[i]
+        return np.column_stack([self.lat[start:stop], self.lon[start:stop]])
+
+
+def write_map_snapshot(fact, shapes, directory):
+    """
+    Write the map frames of the fact and the points of the shape store as
+    uncompressed Arrow files in directory, for read_map_snapshot.
+    """
+    directory = Path(directory)
+    for name, frame in map_frames(fact).items():
+        _write_arrow(frame, directory / f'{name}.arrow')
+    _write_arrow(pd.DataFrame({'shape_id': shapes.shape_ids, 'start': shapes.offsets[:-1],
+                               'stop': shapes.offsets[1:]}), directory / 'shape_index.arrow')
+    _write_arrow(pd.DataFrame({'lat': shapes.coords[:, 0], 'lon': shapes.coords[:, 1]}),
+                 directory / 'shape_points.arrow')
+
+
+def read_map_snapshot(directory):
+    """
+    Map tables and shapes of a snapshot written by write_map_snapshot, memory-mapped.
+    """
+    directory = Path(directory)
+    frames = {name: _read_arrow(directory / f'{name}.arrow')
+              for name in ('route_stops', 'route_shapes', 'endpoints', 'stops', 'shapes', 'routes')}
+    shapes = MappedShapes(_read_arrow(directory / 'shape_index.arrow'), _read_arrow(directory / 'shape_points.arrow'))
+    return map_tables(frames), shapes
+
+
+# Map tables and shapes of the batch snapshot, opened once in every worker
+_worker_maps = None
+
+
+def _open_snapshot(directory):
+    global _worker_maps
+    _worker_maps = read_map_snapshot(directory)
+
+
+def _write_route_map(job):
+    route_idx, out_dir = job
+    tables, shapes = _worker_maps
+    route_id = tables['routes']['route_id'].iat[route_idx]
+    collection = route_map(tables, shapes, route_idx)
+    if collection is None:
+        return route_id, None
+    path = Path(out_dir) / map_file_name(route_id)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(dumps(collection))
+    tmp.replace(path)
+    return route_id, path.name
+
+
+def batch_route_maps(fact, shapes, out_dir, route_ids=None, processes=None, progress=None):
+    """
+    Write the GeoJSON map of every route (or of the given route_ids) to
+    out_dir/<route_id>.geojson, spread over a process pool, plus an index.json
+    of route_id to file. progress(done, total) is called after every route.
+    Returns the index.
+
+    The workers are spawned, not forked, since forking a process that runs
+    other threads (the web app) can leave their locks held in the children.
+    They memory-map a snapshot of the map tables written to a temporary
+    directory in out_dir, which is removed when the batch ends.
+    """
+    if processes is not None and processes < 1:
+        raise ValueError('processes must be at least 1')
+    codes = pd.Index(fact.routes['route_id'].astype(object))
+    if route_ids is None:
+        route_codes = [int(code) for code in fact.facts['route_idx'].unique()]
+    else:
+        unknown = [route_id for route_id in route_ids if route_id not in codes]
+        if unknown:
+            raise ValueError(f'Unknown route_ids {unknown}')
+        route_codes = [int(code) for code in codes.get_indexer(route_ids)]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(code, str(out_dir)) for code in route_codes]
+    index = {}
+    with tempfile.TemporaryDirectory(prefix='.tables-', dir=out_dir) as snapshot:
+        write_map_snapshot(fact, shapes, snapshot)
+        pool = multiprocessing.get_context('spawn').Pool(processes, initializer=_open_snapshot, initargs=(snapshot,))
+        with pool:
+            for done, (route_id, name) in enumerate(pool.imap_unordered(_write_route_map, jobs, chunksize=4), 1):
+                if name is not None:
+                    index[route_id] = name
+                if progress is not None:
+                    progress(done, len(jobs))
+    (out_dir / 'index.json').write_text(dumps(dict(sorted(index.items()))))
+    return index
+
+
+def etag_of(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+class RouteMaps:
+    """
+    Encoded GeoJSON route maps of one feed, in memory and on disk, with their ETags.
+    """
+
+    def __init__(self, version, cache_dir=MAP_DIR):
+        self.version = version
+        self.dir = Path(cache_dir) / version
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_feed(cls, feed, fact, shapes, cache_dir=MAP_DIR):
+        """
+        Route maps of a feed, read from the disk cache of its fingerprint or built and written there.
+        """
+        maps = cls(feed_fingerprint(feed, MAP_TABLES), cache_dir)
+        if not (maps.dir / 'index.json').exists():
+            maps.store(build_route_maps(fact, shapes))
+        return maps
+
+    def _path(self, route_id):
+        # route_ids are free text, the file name is their hash
+        return self.dir / f'{hashlib.sha1(str(route_id).encode()).hexdigest()}.geojson'
+
+    def store(self, maps):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for route_id, collection in maps.items():
+            body = dumps(collection).encode()
+            self._documents[route_id] = (body, etag_of(body))
+            path = self._path(route_id)
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(body)
+            tmp.replace(path)
+        # Written last, so it marks the directory as holding the maps of every route
+        (self.dir / 'index.json').write_text(dumps(sorted(maps)))
+
+    def get(self, route_id):
+        """
+        (GeoJSON bytes, ETag) of a route, None when the route has no map.
+        """
+        document = self._documents.get(route_id)
+        if document is not None:
+            return document
+        path = self._path(route_id)
+        if not path.exists():
+            return None
+        body = path.read_bytes()
+        with self._lock:
+            return self._documents.setdefault(route_id, (body, etag_of(body)))
+
+    def route_ids(self):
+        return json.loads((self.dir / 'index.json').read_text())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the GeoJSON map of every route to a directory.')
+    parser.add_argument('output', help='directory for the <route_id>.geojson files')
+    parser.add_argument('--feed', default='data/gtfs-nyc-2023.zip')
+    parser.add_argument('--routes', nargs='*', help='route_ids to build (all routes by default)')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    from feed_loader import load_feed
+    from shape_store import shape_store
+    from stop_times_fact import StopTimesFact
+
+    feed = load_feed(args.feed)
+
+    def report(done, total):
+        print(f'\r{done}/{total} routes', end='' if done < total else '\n', file=sys.stderr, flush=True)
+
+    index = batch_route_maps(StopTimesFact(feed), shape_store(feed), args.output, args.routes, args.processes, report)
+    print(f'Maps of {len(index)} routes written to {args.output}')
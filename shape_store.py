@@ -0,0 +1,119 @@
+"""
+Array-backed store of the shape geometries of a feed.
+
+All shape points sit in one contiguous float64 (lat, lon) array ordered by
+shape and sequence, with the offset of every shape into it and the cumulative
+distance of every point, so a shape or the part of it between two distances
+is a slice (a view) instead of a filter and sort of feed.shapes.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_steps(lat, lon):
+    """
+    Kilometres between consecutive points.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class ShapeStore:
+    """
+    Shape points of a feed as contiguous arrays, indexed by shape_id.
+    """
+
+    def __init__(self, shapes):
+        # The frame the store was built from, to notice when the feed's shapes change
+        self.source = shapes
+        shapes = shapes.dropna(subset=['shape_id']).sort_values(['shape_id', 'shape_pt_sequence'], kind='stable')
+        self.coords = np.ascontiguousarray(shapes[['shape_pt_lat', 'shape_pt_lon']].to_numpy(dtype=np.float64))
+
+        keys = shapes['shape_id'].to_numpy(dtype=object)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=np.int64)
+        self.shape_ids = keys[starts]
+        self.offsets = np.r_[starts, len(keys)].astype(np.int64)
+        self.positions = {shape_id: i for i, shape_id in enumerate(self.shape_ids)}
+
+        # Cumulative distance in the feed's units, measured along the points
+        # (in km) for the shapes that do not give shape_dist_traveled
+        distance = shapes['shape_dist_traveled'].to_numpy(dtype=np.float64, na_value=np.nan)
+        incomplete = np.unique(np.searchsorted(self.offsets, np.flatnonzero(np.isnan(distance)), side='right') - 1)
+        for i in incomplete:
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            steps = haversine_steps(self.coords[start:stop, 0], self.coords[start:stop, 1])
+            distance[start:stop] = np.r_[0.0, np.cumsum(steps)]
+        self.distance = distance
+
+    def __len__(self):
+        return len(self.shape_ids)
+
+    def __contains__(self, shape_id):
+        return shape_id in self.positions
+
+    def _range(self, shape_id):
+        i = self.positions.get(shape_id)
+        if i is None:
+            return 0, 0
+        return self.offsets[i], self.offsets[i + 1]
+
+    def coordinates(self, shape_id):
+        """
+        (lat, lon) points of a shape as an (n, 2) view, empty when unknown.
+        """
+        start, stop = self._range(shape_id)
+        return self.coords[start:stop]
+
+    def distances(self, shape_id):
+        """
+        Cumulative distance of every point of a shape, as a view.
+        """
+        start, stop = self._range(shape_id)
+        return self.distance[start:stop]
+
+    def total_distance(self, shape_id):
+        start, stop = self._range(shape_id)
+        return float(self.distance[stop - 1]) if stop > start else np.nan
+
+    def between(self, shape_id, start_distance, end_distance):
+        """
+        Points of a shape whose cumulative distance lies in [start_distance, end_distance], as a view.
+        """
+        start, stop = self._range(shape_id)
+        distance = self.distance[start:stop]
+        first = np.searchsorted(distance, start_distance, side='left')
+        last = np.searchsorted(distance, end_distance, side='right')
+        return self.coords[start + first:start + max(first, last)]
+
+    def summary(self):
+        """
+        One row per shape with its number of points and total distance.
+        """
+        return pd.DataFrame({
+            'shape_id': self.shape_ids,
+            'num_points': np.diff(self.offsets),
+            'total_dist_traveled': self.distance[self.offsets[1:] - 1] if len(self) else np.array([]),
+        })
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def shape_store(feed):
+    """
+    Return the ShapeStore of the feed, rebuilding it when feed.shapes was reassigned.
+    """
+    global _store
+    store = _store
+    if store is not None and store.source is feed.shapes:
+        return store
+    with _store_lock:
+        if _store is None or _store.source is not feed.shapes:
+            _store = ShapeStore(feed.shapes)
+        return _store
@@ -17,29 +17,36 @@ import { useConfig } from "../configContext";
 function StopsModal({ onClose }) {
     const { baseURL } = useConfig();
     const [stopsData, setStopsData] = useState([]); // Initialize as empty array
+    // cursors[i] is the cursor of page i + 1, the first page has none
+    const [cursors, setCursors] = useState([null]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [currentPage, setCurrentPage] = useState(1); // Track the current page
     const stopsPerPage = 10; // Number of stops per page
 
-    // Fetch the stops data from the API
+    // Fetch one page of stops at a time from the API
     useEffect(() => {
         const fetchStopsData = async () => {
             try {
-                const response = await axios.get(`${baseURL}/stops`);
-                setStopsData(response.data);
+                const params = {
+                    limit: stopsPerPage,
+                    fields: 'stop_id,stop_code,stop_name,stop_desc,stop_lat,stop_lon',
+                };
+                if (cursors[currentPage - 1]) {
+                    params.cursor = cursors[currentPage - 1];
+                }
+                const response = await axios.get(`${baseURL}/stops`, { params });
+                setStopsData(response.data.data);
+                setNextCursor(response.data.next_cursor);
             } catch (error) {
                 console.error("Error fetching stops data:", error);
             }
         };
 
         fetchStopsData();
-    }, []);
-
-    const indexOfLastStop = currentPage * stopsPerPage;
-    const indexOfFirstStop = indexOfLastStop - stopsPerPage;
-    const currentStops = stopsData.slice(indexOfFirstStop, indexOfLastStop);
+    }, [currentPage]);
 
     const renderRows = () => {
-        return currentStops.map((stop, index) => (
+        return stopsData.map((stop, index) => (
             <Tr key={index}>
                 <Td>{stop.stop_id || 'NA'}</Td>
                 <Td>{stop.stop_code || 'NA'}</Td>
@@ -52,7 +59,8 @@ function StopsModal({ onClose }) {
     };
 
     const handleNextPage = () => {
-        if (currentPage < Math.ceil(stopsData.length / stopsPerPage)) {
+        if (nextCursor) {
+            setCursors([...cursors.slice(0, currentPage), nextCursor]);
             setCurrentPage(currentPage + 1);
         }
     };
@@ -95,10 +103,10 @@ function StopsModal({ onClose }) {
                         >
                             Previous
                         </Button>
-                        <Text>Page {currentPage} of {Math.ceil(stopsData.length / stopsPerPage)}</Text>
+                        <Text>Page {currentPage}</Text>
                         <Button
                             onClick={handleNextPage}
-                            disabled={currentPage === Math.ceil(stopsData.length / stopsPerPage)}
+                            disabled={!nextCursor}
                             colorScheme="blue"
                         >
                             Next
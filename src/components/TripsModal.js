@@ -21,6 +21,9 @@ import { useConfig } from "../configContext";
 function TripsModal({ onClose }) { 
     const { baseURL } = useConfig();
     const [tripsData, setTripsData] = useState([]);
+    // cursors[i] is the cursor of page i + 1, the first page has none
+    const [cursors, setCursors] = useState([null]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [currentPage, setCurrentPage] = useState(1);
     const tripsPerPage = 10;
     const [loading, setLoading] = useState(true);
@@ -28,12 +31,22 @@ function TripsModal({ onClose }) {
     const [searchTripId, setSearchTripId] = useState('');
     const [searchResult, setSearchResult] = useState(null);
 
+    // Fetch one page of trips at a time
     useEffect(() => {
         const fetchTripsData = async () => {
+            setLoading(true);
             try {
-                const response = await axios.get(`${baseURL}/trips`);
+                const params = {
+                    limit: tripsPerPage,
+                    fields: 'trip_id,route_id,service_id,trip_headsign',
+                };
+                if (cursors[currentPage - 1]) {
+                    params.cursor = cursors[currentPage - 1];
+                }
+                const response = await axios.get(`${baseURL}/trips`, { params });
                 if (response.status === 200) {
-                    setTripsData(response.data);
+                    setTripsData(response.data.data);
+                    setNextCursor(response.data.next_cursor);
                 } else {
                     setError('Error fetching trips');
                 }
@@ -45,14 +58,10 @@ function TripsModal({ onClose }) {
         };
 
         fetchTripsData();
-    }, []);
-
-    const indexOfLastTrip = currentPage * tripsPerPage;
-    const indexOfFirstTrip = indexOfLastTrip - tripsPerPage;
-    const currentTrips = tripsData.slice(indexOfFirstTrip, indexOfLastTrip);
+    }, [currentPage]);
 
     const renderRows = () => {
-        return currentTrips.map((trip, index) => (
+        return tripsData.map((trip, index) => (
             <Tr key={index}>
                 <Td>{trip.trip_id || 'NA'}</Td>
                 <Td>{trip.route_id || 'NA'}</Td>
@@ -63,7 +72,8 @@ function TripsModal({ onClose }) {
     };
 
     const handleNextPage = () => {
-        if (currentPage < Math.ceil(tripsData.length / tripsPerPage)) {
+        if (nextCursor) {
+            setCursors([...cursors.slice(0, currentPage), nextCursor]);
             setCurrentPage(currentPage + 1);
         }
     };
@@ -163,10 +173,10 @@ function TripsModal({ onClose }) {
                         >
                             Previous
                         </Button>
-                        <Text>Page {currentPage} of {Math.ceil(tripsData.length / tripsPerPage)}</Text>
+                        <Text>Page {currentPage}</Text>
                         <Button
                             onClick={handleNextPage}
-                            disabled={currentPage === Math.ceil(tripsData.length / tripsPerPage)}
+                            disabled={!nextCursor}
                             colorScheme="blue"
                         >
                             Next
@@ -0,0 +1,103 @@
+"""
+Denormalized stop_times fact table for the /clean_data analyses.
+
+Every stop time is one row of dimension row indexes (trip_idx, route_idx,
+shape_idx and stop_idx) plus its own measures. Trips, routes, stops and
+shapes are kept once as dimension tables with their string columns
+dictionary encoded, and a dimension attribute is joined onto the facts by a
+positional take on its index instead of a hash merge that copies the wide
+rows.
+"""
+import numpy as np
+import pandas as pd
+
+from shape_store import shape_store
+
+ROUTE_COLUMNS = ['route_id', 'route_long_name', 'route_type', 'route_color', 'route_text_color']
+STOP_COLUMNS = ['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon']
+
+def dictionary_encode(df):
+    """
+    Copy of the frame with its string columns stored as categoricals.
+    """
+    strings = [column for column in df.columns
+               if df[column].dtype == object or isinstance(df[column].dtype, pd.StringDtype)]
+    return df.astype({column: 'category' for column in strings})
+
+
+def codes_of(keys, values):
+    """
+    Position of every value in keys, -1 when it is missing.
+    """
+    return pd.Index(keys).get_indexer(values).astype(np.int32)
+
+
+def take(column, codes):
+    """
+    Rows codes of a dimension column, keeping its dtype (categoricals take their
+    integer codes and stay dictionary encoded).
+    """
+    return column.array.take(codes)
+
+
+class StopTimesFact:
+    """
+    stop_times joined with trips, routes, shapes and stops (inner joins), as
+    row indexes into the dimension tables.
+    """
+
+    def __init__(self, feed):
+        self.routes = dictionary_encode(feed.routes[ROUTE_COLUMNS].reset_index(drop=True))
+        self.stops = dictionary_encode(feed.stops[STOP_COLUMNS].reset_index(drop=True))
+        # Number of points and total distance of every shape, from the shape store
+        self.shapes = dictionary_encode(shape_store(feed).summary())
+
+        trips = feed.trips.reset_index(drop=True)
+        route_codes = codes_of(self.routes['route_id'], trips['route_id'])
+        shape_codes = codes_of(self.shapes['shape_id'], trips['shape_id'])
+        self.trips = dictionary_encode(trips).assign(route_idx=route_codes, shape_idx=shape_codes)
+
+        stop_times = feed.stop_times
+        trip_codes = codes_of(self.trips['trip_id'], stop_times['trip_id'])
+        stop_codes = codes_of(self.stops['stop_id'], stop_times['stop_id'])
+        route_codes = np.where(trip_codes >= 0, route_codes[trip_codes], -1)
+        shape_codes = np.where(trip_codes >= 0, shape_codes[trip_codes], -1)
+        # Stop times of unknown trips, routes, shapes or stops drop out as with inner merges
+        keep = (trip_codes >= 0) & (stop_codes >= 0) & (route_codes >= 0) & (shape_codes >= 0)
+        sequences = stop_times['stop_sequence'].to_numpy()
+        # Ordered by trip and stop_sequence, so per-trip differences are plain shifts
+        keep = np.flatnonzero(keep)
+        keep = keep[np.lexsort((sequences[keep], trip_codes[keep]))]
+
+        self.facts = pd.DataFrame({
+            'trip_idx': trip_codes[keep],
+            'route_idx': route_codes[keep].astype(np.int32),
+            'shape_idx': shape_codes[keep].astype(np.int32),
+            'stop_idx': stop_codes[keep],
+            'stop_sequence': sequences[keep].astype(np.int32),
+            'arrival_secs': stop_times['arrival_secs'].to_numpy()[keep],
+            'departure_secs': stop_times['departure_secs'].to_numpy()[keep],
+            # Missing shape distances stay NaN, trip_segments projects them onto the shape
+            'shape_dist_traveled': stop_times['shape_dist_traveled'].to_numpy(dtype=np.float64, na_value=np.nan)[keep],
+        })
+
+    def __len__(self):
+        return len(self.facts)
+
+    def dimension_column(self, dimension, name, codes):
+        """
+        Attribute of a dimension for an array of its row indexes, e.g. the route_id of grouped route_idx values.
+        """
+        return take(getattr(self, dimension)[name], np.asarray(codes))
+
+    def route_counts(self):
+        """
+        Number of distinct stops, trips and shapes of every route, most stops first.
+        """
+        counts = self.facts.groupby('route_idx', sort=False).agg(
+            TotalStops=('stop_idx', 'nunique'),
+            TotalTrips=('trip_idx', 'nunique'),
+            TotalShapes=('shape_idx', 'nunique'),
+        ).sort_values(by='TotalStops', ascending=False, kind='stable')
+        counts.insert(0, 'route_id', self.dimension_column('routes', 'route_id', counts.index))
+        return counts.reset_index(drop=True)
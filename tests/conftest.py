@@ -0,0 +1,133 @@
+"""
+Shared fixtures: a small synthetic GTFS feed and MTA bus position CSVs.
+
+Routes R1 (S1-S2-S3), R2 (S3-S4, with a trip running past midnight), R3
+(S6-S5, S6 a transfer away from S4) and R5 (S1-S5 directly, slowly) run on
+weekdays of 2023-09-04..08 except the 7th; R4 has no trips.
+"""
+import sys
+import zipfile
+from pathlib import Path
+
+import gtfs_kit as gk
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The GTFS modules sit at the repository root, the MTA delay app in app/
+sys.path[:0] = [str(ROOT), str(ROOT / 'app')]
+
+STOPS = {
+    'S1': (40.700, -74.000), 'S2': (40.710, -74.000), 'S3': (40.720, -74.000),
+    'S4': (40.720, -74.010), 'S5': (40.730, -74.010), 'S6': (40.7205, -74.0105),
+}
+# Stop, seconds after the first departure and shape distance of every stop of a route's trips
+ROUTE_STOPS = {
+    'R1': [('S1', 0, 0.0), ('S2', 300, 1.11), ('S3', 660, 2.22)],
+    'R2': [('S3', 0, 0.0), ('S4', 420, 0.84)],
+    'R3': [('S6', 0, 0.0), ('S5', 300, 1.05)],
+    'R5': [('S1', 0, None), ('S5', 5400, None)],
+}
+# First departures of the trips of every route, seconds after midnight
+DEPARTURES = {
+    'R1': [7 * 3600 + i * 1800 for i in range(6)],
+    'R2': [7 * 3600 + 1200 + i * 1800 for i in range(4)] + [23 * 3600 + 3300],
+    'R3': [7 * 3600 + 1800 + i * 1200 for i in range(5)],
+    'R5': [7 * 3600],
+}
+SHAPES = {
+    'SH1': [('S1', 0.0), ('S2', 1.11), ('S3', 2.22)],
+    'SH2': [('S3', 0.0), ('S4', 0.84)],
+    'SH3': [('S6', 0.0), ('S5', 1.05)],
+    # Without shape_dist_traveled, measured along the points instead
+    'SH5': [('S1', None), ('S5', None)],
+}
+ROUTE_SHAPES = {'R1': 'SH1', 'R2': 'SH2', 'R3': 'SH3', 'R5': 'SH5'}
+SERVICE_DATES = ['20230904', '20230905', '20230906', '20230908']
+
+
+def clock(seconds):
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def _blank(value):
+    return '' if value is None else value
+
+
+def gtfs_files():
+    stops = ['stop_id,stop_code,stop_name,stop_lat,stop_lon'] + [
+        f'{stop_id},{100 + int(stop_id[1:])},Stop {stop_id[1:]},{lat},{lon}' for stop_id, (lat, lon) in STOPS.items()]
+    routes = ['route_id,agency_id,route_short_name,route_long_name,route_type,route_color,route_text_color'] + [
+        f'{route_id},A,{route_id[1:]},Route {route_id[1:]},3,00AA{route_id[1:]}0,FFFFFF'
+        for route_id in ['R1', 'R2', 'R3', 'R4', 'R5']]
+    shapes = ['shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,shape_dist_traveled'] + [
+        f'{shape_id},{STOPS[stop][0]},{STOPS[stop][1]},{i},{_blank(dist)}'
+        for shape_id, points in SHAPES.items() for i, (stop, dist) in enumerate(points, 1)]
+    trips = ['route_id,service_id,trip_id,direction_id,shape_id']
+    stop_times = ['trip_id,arrival_time,departure_time,stop_id,stop_sequence,shape_dist_traveled']
+    for route_id, departures in DEPARTURES.items():
+        for i, start in enumerate(departures):
+            trip_id = f'T{route_id[1:]}-{i}'
+            trips.append(f'{route_id},WK,{trip_id},0,{ROUTE_SHAPES[route_id]}')
+            for sequence, (stop, offset, dist) in enumerate(ROUTE_STOPS[route_id], 1):
+                # The first trip's departures have a leading space, as in the NYC feed
+                space = ' ' if i == 0 and route_id == 'R1' else ''
+                stop_times.append(f'{trip_id},{clock(start + offset)},{space}{clock(start + offset)},{stop},'
+                                  f'{sequence},{_blank(dist)}')
+    return {
+        'agency.txt': 'agency_id,agency_name,agency_url,agency_timezone\nA,Agency,http://example.com,America/New_York',
+        'calendar.txt': 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n'
+                        'WK,1,1,1,1,1,0,0,20230904,20230908',
+        'calendar_dates.txt': 'service_id,date,exception_type\nWK,20230907,2',
+        'transfers.txt': 'from_stop_id,to_stop_id,transfer_type,min_transfer_time\nS4,S6,2,120\nS6,S4,2,120',
+        'stops.txt': '\n'.join(stops),
+        'routes.txt': '\n'.join(routes),
+        'shapes.txt': '\n'.join(shapes),
+        'trips.txt': '\n'.join(trips),
+        'stop_times.txt': '\n'.join(stop_times),
+    }
+
+
+@pytest.fixture
+def gtfs_zip(tmp_path):
+    path = tmp_path / 'feed.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, text in gtfs_files().items():
+            archive.writestr(name, text + '\n')
+    return path
+
+
+@pytest.fixture
+def raw_feed(gtfs_zip):
+    return gk.read_feed(gtfs_zip, dist_units='km')
+
+
+def write_mta_csv(path, rows, seed=0, start='2017-12-01', days=3, routes=None):
+    """
+    Bus positions in the layout of the MTA CSV, with missing origins, next
+    stops, expected and scheduled times mixed in.
+    """
+    rng = np.random.default_rng(seed)
+    recorded = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 86400, rows), unit='s')
+    scheduled = np.clip((recorded - recorded.normalize()).total_seconds().astype(int) + rng.integers(-600, 600, rows),
+                        0, None)
+    hours = scheduled // 3600
+    hours = np.where((hours < 2) & (rng.random(rows) < 0.5), hours + 24, hours)
+    expected = recorded + pd.to_timedelta(rng.normal(120, 300, rows).astype(int), unit='s')
+    origins = [f'ORIGIN {i}' for i in range(8)]
+    pd.DataFrame({
+        'RecordedAtTime': recorded.strftime('%Y-%m-%d %H:%M:%S'),
+        'DirectionRef': rng.integers(0, 2, rows),
+        'PublishedLineName': rng.choice(routes or [f'M{i}' for i in range(5)], rows),
+        'OriginName': rng.choice(origins + [None], rows),
+        'OriginLat': 40.7 + rng.random(rows) / 10,
+        'OriginLong': -74 + rng.random(rows) / 10,
+        'DestinationName': rng.choice(origins, rows),
+        'VehicleRef': rng.choice([f'NYCT_{i}' for i in range(50)], rows),
+        'NextStopPointName': rng.choice(['A', 'B', None], rows, p=[0.45, 0.45, 0.1]),
+        'ExpectedArrivalTime': np.where(rng.random(rows) < 0.1, None, expected.strftime('%Y-%m-%d %H:%M:%S')),
+        'ScheduledArrivalTime': np.where(rng.random(rows) < 0.02, None,
+                                         [f'{h:02d}:{s % 3600 // 60:02d}:{s % 60:02d}' for h, s in zip(hours, scheduled)]),
+    }).to_csv(path, index=False)
+    return path
@@ -0,0 +1,94 @@
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from flask import Flask
+
+import chart_render
+from chart_render import ChartRenderer, chart_key
+
+
+@pytest.fixture
+def renderer(tmp_path, monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def render_fake(data, fmt):
+        calls.append(data)
+        release.wait(5)
+        if data.get('fail'):
+            raise RuntimeError('cannot draw')
+        return f'{fmt}:{len(data["x"])}'.encode()
+
+    monkeypatch.setitem(chart_render.RENDERERS, 'fake', render_fake)
+    renderer = ChartRenderer(tmp_path / 'charts')
+    # Threads instead of the spawn pool, so the fake renderer is visible to the workers
+    pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(renderer, '_executor', lambda: pool)
+    renderer.calls, renderer.release = calls, release
+    yield renderer
+    release.set()
+    pool.shutdown()
+
+
+def test_chart_rendered_once_and_served_from_disk(renderer):
+    data = {'x': [1, 2, 3]}
+    key = renderer.submit('fake', data)
+    assert renderer.submit('fake', {'x': [1, 2, 3]}) == key
+    assert renderer.status(key) == ('pending', None)
+    assert renderer.data_uri(key) is None
+
+    renderer.release.set()
+    renderer.jobs[key].result()
+    assert renderer.status(key) == ('done', None)
+    assert renderer.find(key) == (renderer.path(key, 'png'), 'png')
+    assert renderer.data_uri(key) == 'data:image/png;base64,' + base64.b64encode(b'png:3').decode()
+    assert renderer.submit('fake', data) == key
+    assert len(renderer.calls) == 1
+    assert renderer.status('unknown-key') == ('unknown', None)
+
+
+def test_failed_chart_reports_the_error_and_is_retried(renderer):
+    renderer.release.set()
+    key = renderer.submit('fake', {'x': [], 'fail': True})
+    renderer.jobs[key].exception()
+    assert renderer.status(key) == ('error', 'cannot draw')
+    renderer.submit('fake', {'x': [], 'fail': True})
+    renderer.jobs[key].exception()
+    assert len(renderer.calls) == 2
+
+    with pytest.raises(ValueError):
+        renderer.submit('fake', {'x': []}, fmt='gif')
+
+
+def test_chart_key_depends_on_kind_format_and_data():
+    data = {'columns': pd.DataFrame({'route_id': ['R1', 'R2'], 'trips': [6, 5]})}
+    same = {'columns': pd.DataFrame({'route_id': ['R1', 'R2'], 'trips': [6, 5]})}
+    assert chart_key('pareto', data, 'png') == chart_key('pareto', same, 'png')
+    assert chart_key('pareto', data, 'png') != chart_key('pareto', data, 'svg')
+    assert chart_key('pareto', data, 'png') != chart_key('clusters', data, 'png')
+    changed = {'columns': same['columns'].assign(trips=[6, 4])}
+    assert chart_key('pareto', data, 'png') != chart_key('pareto', changed, 'png')
+    with Flask(__name__).test_request_context('/?orient=columns'):
+        assert chart_key('pareto', same, 'png') == chart_key('pareto', data, 'png')
+
+
+def test_chart_rendered_by_another_process_reports_its_markers(renderer, tmp_path):
+    data = {'x': [1]}
+    key = renderer.submit('fake', data)
+    other = ChartRenderer(tmp_path / 'charts')
+    assert other.status(key) == ('pending', None)
+    # Already being rendered, so the other process does not queue it again
+    assert other.submit('fake', data) == key
+    assert key not in other.jobs
+
+    renderer.release.set()
+    renderer.jobs[key].result()
+    assert other.status(key) == ('done', None)
+    assert not renderer._marker(key, 'png', 'pending').exists()
+
+    failed = renderer.submit('fake', {'x': [], 'fail': True})
+    renderer.jobs[failed].exception()
+    assert other.status(failed) == ('error', 'cannot draw')
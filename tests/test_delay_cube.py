@@ -0,0 +1,50 @@
+import numpy as np
+
+from conftest import write_mta_csv
+from delay_cube import HIST_EDGES, DelayCube
+from delay_snapshot import DelayStore
+from mta_ingest import ingest_csv
+
+
+def _data(tmp_path):
+    ingest_csv(write_mta_csv(tmp_path / 'positions.csv', 4000, seed=5), tmp_path / 'store', chunksize=1500)
+    return DelayStore(tmp_path / 'store').load().data
+
+
+def test_cube_rollups_match_groupby(tmp_path):
+    data = _data(tmp_path)
+    cube = DelayCube.build(data)
+    assert cube.rollup([])['count'].iat[0] == data['Delay'].notna().sum()
+
+    routes = cube.rollup(['PublishedLineName', 'Hour']).set_index(['PublishedLineName', 'Hour'])
+    grouped = data.groupby(['PublishedLineName', 'Hour'], observed=True)['Delay']
+    expected = grouped.agg(['mean', 'size']).assign(std=grouped.std(ddof=0))
+    expected = expected.loc[routes.index]
+    np.testing.assert_array_equal(routes['count'], expected['size'])
+    np.testing.assert_allclose(routes['mean'], expected['mean'], rtol=1e-5)
+    np.testing.assert_allclose(routes['std'], expected['std'], rtol=1e-4, atol=1e-6)
+
+
+def test_masked_histogram_matches_the_filtered_rows(tmp_path):
+    data = _data(tmp_path)
+    cube = DelayCube.build(data)
+    keep = cube.mask(start_date='2017-12-02', end_date='2017-12-02', hours=[8, 9], routes=['M1', 'M3'],
+                     days_of_week=[5])
+    rollup = cube.rollup(['OriginName'], keep, histogram=True).set_index('OriginName')
+
+    selected = data[(data['RecordedDate'] == '2017-12-02') & data['Hour'].isin([8, 9]) &
+                    data['PublishedLineName'].isin(['M1', 'M3'])]
+    for origin, rows in selected.groupby('OriginName', observed=True):
+        counts = np.bincount(np.searchsorted(HIST_EDGES, rows['Delay'].to_numpy(np.float64), side='right'),
+                             minlength=len(HIST_EDGES) + 1)
+        assert rollup.at[origin, 'histogram'] == counts.tolist()
+        assert rollup.at[origin, 'vehicles'] == rows['VehicleRef'].notna().sum()
+    assert rollup['count'].sum() == len(selected)
+    # 2017-12-02 was a Saturday
+    assert not cube.mask(start_date='2017-12-02', end_date='2017-12-02', days_of_week=[0]).any()
+
+
+def test_snapshot_carries_the_cube_of_its_rows(tmp_path):
+    ingest_csv(write_mta_csv(tmp_path / 'positions.csv', 1000, seed=6), tmp_path / 'store')
+    snapshot = DelayStore(tmp_path / 'store').load()
+    assert snapshot.cube.rollup([])['count'].iat[0] == len(snapshot.data)
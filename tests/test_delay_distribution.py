@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from conftest import write_mta_csv
+from delay_distribution import DelayDistribution, render_distribution
+from delay_snapshot import DelayStore
+from mta_ingest import ingest_csv
+
+
+@pytest.fixture
+def data(tmp_path):
+    ingest_csv(write_mta_csv(tmp_path / 'positions.csv', 3000, seed=8), tmp_path / 'store')
+    return DelayStore(tmp_path / 'store').load().data
+
+
+def test_counts_match_numpy_histogram(data):
+    distribution = DelayDistribution.build(data)
+    summary = distribution.summary(distribution.select())
+    counts, _ = np.histogram(data['Delay'].astype(np.float64), bins=distribution.edges)
+    assert summary['count'] == len(data)
+    np.testing.assert_array_equal(summary['counts'], counts)
+
+    selected = data[data['PublishedLineName'].isin(['M0']) & data['Hour'].isin([7, 8])]
+    counts, _ = np.histogram(selected['Delay'].astype(np.float64), bins=distribution.edges)
+    np.testing.assert_array_equal(distribution.select(['M0', 'unknown'], [7, 8, 30]), counts)
+    assert distribution.summary(distribution.select(['unknown']))['mean'] is None
+
+
+def test_kde_matches_a_direct_evaluation_on_the_bin_centres(data):
+    distribution = DelayDistribution.build(data)
+    counts = distribution.select()
+    summary = distribution.summary(counts)
+    centres = (distribution.edges[:-1] + distribution.edges[1:]) / 2
+    width = distribution.edges[1] - distribution.edges[0]
+
+    # Gaussian kernels at every delay, rounded to its bin centre, with Scott's bandwidth
+    delays = np.repeat(centres, counts)
+    assert summary['mean'] == pytest.approx(delays.mean())
+    assert summary['std'] == pytest.approx(delays.std())
+    bandwidth = max(delays.std() * len(delays) ** (-1 / 5), width / 2)
+    density = np.exp(-0.5 * ((centres[:, None] - delays[None, :]) / bandwidth) ** 2).sum(axis=1) / \
+        (bandwidth * np.sqrt(2 * np.pi))
+    np.testing.assert_allclose(summary['kde'], density * width, atol=1e-3)
+
+
+def test_image_rendered_once_per_content(data, tmp_path):
+    pytest.importorskip('matplotlib')
+    distribution = DelayDistribution.build(data)
+    summary = distribution.summary(distribution.select())
+    path = render_distribution(summary, tmp_path / 'images')
+    assert path.read_bytes().startswith(b'\x89PNG')
+    mtime = path.stat().st_mtime_ns
+    assert render_distribution(summary, tmp_path / 'images') == path and path.stat().st_mtime_ns == mtime
+    assert render_distribution(summary, tmp_path / 'images', title='Other') != path
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import delay_snapshot
+from conftest import write_mta_csv
+from delay_snapshot import DelaySketch, DelayStore
+from mta_ingest import ingest_csv
+
+
+@pytest.fixture
+def store(tmp_path):
+    ingest_csv(write_mta_csv(tmp_path / 'first.csv', 3000, seed=1), tmp_path / 'store', chunksize=1000)
+    store = DelayStore(tmp_path / 'store')
+    store.load()
+    return store
+
+
+def test_append_matches_a_full_recompute(store, tmp_path):
+    before = store.current
+    added = store.append(write_mta_csv(tmp_path / 'second.csv', 2000, seed=2, start='2017-12-03', routes=['M1', 'X9']))
+    assert added > 0
+    appended = store.current
+    assert before.version == 0 and len(before.raw) + added == len(appended.raw)
+
+    full = DelayStore(store.store_dir).load()
+    assert appended.version == 1 and len(appended.raw) == len(full.raw)
+    assert isinstance(appended.raw['PublishedLineName'].dtype, pd.CategoricalDtype)
+
+    totals = full.aggregates.totals
+    pd.testing.assert_frame_equal(appended.aggregates.totals, totals.loc[appended.aggregates.totals.index],
+                                  check_exact=False)
+    assert len(appended.aggregates.totals) == len(totals)
+    np.testing.assert_array_equal(appended.aggregates.sketch.counts, full.aggregates.sketch.counts)
+    assert appended.aggregates.route_sketches.keys() == full.aggregates.route_sketches.keys()
+    for route, sketch in full.aggregates.route_sketches.items():
+        np.testing.assert_array_equal(appended.aggregates.route_sketches[route].counts, sketch.counts)
+    for route, hour in [(None, None), ('M1', None), ('X9', 8)]:
+        assert appended.aggregates.summary(route, hour=hour) == pytest.approx(full.aggregates.summary(route, hour=hour))
+
+
+def test_aggregates_match_the_rows(store):
+    raw = store.current.raw
+    delay = raw['Delay'].astype(np.float64)
+    summary = store.current.aggregates.summary()
+    assert summary['count'] == delay.notna().sum()
+    assert summary['mean'] == pytest.approx(delay.mean())
+    assert summary['std'] == pytest.approx(delay.std(ddof=0))
+
+    rows = raw[(raw['PublishedLineName'] == 'M2') & (raw['Hour'] == 8)]['Delay'].astype(np.float64)
+    assert store.current.aggregates.summary('M2', hour=8) == pytest.approx(
+        {'count': len(rows), 'mean': rows.mean(), 'std': rows.std(ddof=0)})
+    assert store.current.aggregates.summary('nope') == {'count': 0, 'mean': None, 'std': None}
+    # Sketch quantiles are within one 0.1 minute bin
+    np.testing.assert_allclose(store.current.aggregates.sketch.quantile([0.5, 0.9]), delay.quantile([0.5, 0.9]),
+                               atol=0.1)
+
+
+def test_sketch_merge_equals_adding_everything():
+    rng = np.random.default_rng(0)
+    first, second = rng.normal(2, 5, 1000), rng.normal(-1, 3, 500)
+    merged = DelaySketch().add(first).merge(DelaySketch().add(second))
+    np.testing.assert_array_equal(merged.counts, DelaySketch().add(np.r_[first, second, np.nan]).counts)
+    assert merged.count == 1500
+    assert np.isnan(DelaySketch().quantile(0.5)).all()
+
+
+def test_batch_with_a_missing_route_appends_and_reloads(store, tmp_path):
+    path = tmp_path / 'no_route.csv'
+    batch = pd.read_csv(write_mta_csv(path, 1, seed=3))
+    batch['PublishedLineName'] = None
+    batch['OriginName'] = 'ORIGIN 0'
+    batch['NextStopPointName'] = 'A'
+    batch['ScheduledArrivalTime'] = '12:00:00'
+    batch.to_csv(path, index=False)
+
+    rows = len(store.current.raw)
+    assert store.append(path) == 1
+    assert len(store.current.raw) == rows + 1
+    assert store.current.aggregates.sketch.count == rows + 1
+    assert sum(sketch.count for sketch in store.current.aggregates.route_sketches.values()) == rows
+    assert len(DelayStore(store.store_dir).load().raw) == rows + 1
+
+
+def test_failed_append_leaves_the_store_and_snapshot_alone(store, tmp_path, monkeypatch):
+    before = store.current
+    files = sorted(p.relative_to(store.store_dir) for p in store.store_dir.rglob('*'))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('snapshot failed')
+
+    monkeypatch.setattr(delay_snapshot, 'DelaySnapshot', fail)
+    with pytest.raises(RuntimeError):
+        store.append(write_mta_csv(tmp_path / 'second.csv', 500, seed=4))
+    assert store.current is before
+    assert sorted(p.relative_to(store.store_dir) for p in store.store_dir.rglob('*')) == files
+    assert not [p for p in store.store_dir.parent.iterdir() if p.name.startswith('.append-')]
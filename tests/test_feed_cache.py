@@ -0,0 +1,91 @@
+import pytest
+
+import feed_cache
+from feed_cache import RouteStatsCache, TripStatsCache, feed_fingerprint
+
+
+def test_trip_stats_hit_returns_shared_frame(raw_feed, monkeypatch):
+    cache = TripStatsCache()
+    trip_stats = cache.get(raw_feed)
+    assert set(trip_stats['trip_id']) == set(raw_feed.trips['trip_id'])
+
+    monkeypatch.setattr(type(raw_feed), 'compute_trip_stats', lambda feed: 1 / 0)
+    assert cache.get(raw_feed) is trip_stats
+    # A reassigned table with the same content only costs a fingerprint
+    raw_feed.trips = raw_feed.trips.copy()
+    assert cache.get(raw_feed) is trip_stats
+
+
+def test_trip_stats_rebuilt_when_feed_changes(raw_feed):
+    cache = TripStatsCache()
+    before = cache.get(raw_feed)
+    fingerprint = cache.fingerprint
+
+    raw_feed.trips = raw_feed.trips[raw_feed.trips['route_id'] != 'R5']
+    after = cache.get(raw_feed)
+    assert after is not before
+    assert 'T5-0' in set(before['trip_id']) and 'T5-0' not in set(after['trip_id'])
+    assert cache.fingerprint == feed_fingerprint(raw_feed) != fingerprint
+
+
+def test_seed_and_invalidate(raw_feed, monkeypatch):
+    cache = TripStatsCache()
+    seeded = raw_feed.compute_trip_stats()
+    cache.seed(raw_feed, seeded)
+    monkeypatch.setattr(type(raw_feed), 'compute_trip_stats', lambda feed: 1 / 0)
+    trip_stats = cache.get(raw_feed)
+    assert trip_stats['trip_id'].tolist() == seeded['trip_id'].tolist()
+
+    cache.invalidate()
+    assert cache.fingerprint is None
+    monkeypatch.undo()
+    assert cache.get(raw_feed) is not trip_stats
+
+
+def test_module_cache(raw_feed, monkeypatch):
+    monkeypatch.setattr(feed_cache, 'trip_stats_cache', TripStatsCache())
+    assert feed_cache.cached_trip_stats(raw_feed) is feed_cache.cached_trip_stats(raw_feed)
+
+
+def test_active_dates_apply_calendar_exceptions(raw_feed):
+    assert feed_cache.active_dates(raw_feed) == ['20230904', '20230905', '20230906', '20230908']
+
+
+def test_route_stats_hit_returns_copy(raw_feed):
+    cache = RouteStatsCache(trip_stats=TripStatsCache())
+    first = cache.get(raw_feed, '20230904')
+    first['num_trips'] = -1
+    second = cache.get(raw_feed, '20230904')
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 256}
+    assert (second['num_trips'] > 0).all()
+    assert set(second['route_id']) == {'R1', 'R2', 'R3', 'R5'}
+
+
+def test_route_stats_evicts_and_follows_feed(raw_feed):
+    cache = RouteStatsCache(maxsize=2, trip_stats=TripStatsCache())
+    assert cache.prewarm(raw_feed) == 2
+    assert cache.stats()['size'] == 2 and cache.stats()['misses'] == 2
+
+    raw_feed.trips = raw_feed.trips[raw_feed.trips['route_id'] != 'R5']
+    route_stats = cache.get(raw_feed, '20230908')
+    assert 'R5' not in set(route_stats['route_id'])
+    assert cache.stats()['size'] == 1
+
+
+def test_trip_stats_carry_time_buckets(raw_feed):
+    trip_stats = TripStatsCache().get(raw_feed)
+    assert {'start_secs', 'time_of_day', 'time_period'}.issubset(trip_stats.columns)
+
+
+def test_route_stats_failure_releases_the_date(raw_feed, monkeypatch):
+    cache = RouteStatsCache(trip_stats=TripStatsCache())
+
+    def fail(dates, trip_stats=None):
+        raise RuntimeError('no stats')
+
+    monkeypatch.setattr(raw_feed, 'compute_route_stats', fail)
+    with pytest.raises(RuntimeError):
+        cache.get(raw_feed, '20230904')
+    assert not cache._pending
+    monkeypatch.undo()
+    assert not cache.get(raw_feed, '20230904').empty
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from feed_index import FeedIndex, feed_index, is_sorted_by, key_ranges
+from feed_loader import clean_feed_data
+
+
+def test_lookups_match_boolean_filters(raw_feed):
+    feed = clean_feed_data(raw_feed)
+    # Shuffle the tables so the index has to sort them
+    feed.trips = feed.trips.sample(frac=1, random_state=0)
+    feed.stop_times = feed.stop_times.sample(frac=1, random_state=0)
+    index = FeedIndex(feed)
+
+    for route_id in ['R1', 'R2', 'R3', 'R4', 'R5', 'missing']:
+        expected = feed.trips[feed.trips['route_id'] == route_id].sort_values('trip_id')
+        pd.testing.assert_frame_equal(index.trips_for_route(route_id), expected)
+        assert index.route(route_id)['route_id'].tolist() == \
+            feed.routes.loc[feed.routes['route_id'] == route_id, 'route_id'].tolist()
+    for trip_id in feed.trips['trip_id']:
+        expected = feed.stop_times[feed.stop_times['trip_id'] == trip_id].sort_values('stop_sequence')
+        pd.testing.assert_frame_equal(index.stop_times_for_trip(trip_id), expected)
+        assert index.trip(trip_id)['trip_id'].tolist() == [trip_id]
+    assert index.stop('S6')['stop_id'].tolist() == ['S6']
+    assert 'T2-4' in index.trips and 'T9' not in index.trips
+
+
+def test_feed_index_rebuilt_when_a_table_is_reassigned(raw_feed):
+    index = feed_index(raw_feed)
+    assert feed_index(raw_feed) is index
+    raw_feed.trips = raw_feed.trips[raw_feed.trips['route_id'] != 'R5']
+    rebuilt = feed_index(raw_feed)
+    assert rebuilt is not index and rebuilt.trips_for_route('R5').empty
+
+
+def test_sorted_helpers():
+    df = pd.DataFrame({'a': ['x', 'x', 'y', 'z'], 'b': [1, 2, 1, 0]})
+    assert is_sorted_by(df, ['a', 'b'])
+    assert not is_sorted_by(df, ['b'])
+    assert key_ranges(df['a']) == {'x': (0, 2), 'y': (2, 3), 'z': (3, 4)}
+
+
+def _scan_trips_between(stop_times, start_stop_id, end_stop_id):
+    trips = set()
+    for trip_id, calls in stop_times.groupby('trip_id'):
+        start = calls.loc[calls['stop_id'] == start_stop_id, 'stop_sequence']
+        end = calls.loc[calls['stop_id'] == end_stop_id, 'stop_sequence']
+        if len(start) and len(end) and start.min() < end.max():
+            trips.add(trip_id)
+    return trips
+
+
+def test_trips_between_matches_a_scan(raw_feed):
+    feed = clean_feed_data(raw_feed)
+    # A loop trip that calls at S2 twice, to cover repeated calls
+    loop = feed.stop_times[feed.stop_times['trip_id'] == 'T1-0'].assign(trip_id='T1-loop')
+    loop = pd.concat([loop, loop.iloc[[1]].assign(stop_sequence=4)])
+    feed.trips = pd.concat([feed.trips, feed.trips.iloc[[0]].assign(trip_id='T1-loop')], ignore_index=True)
+    feed.stop_times = pd.concat([feed.stop_times, loop], ignore_index=True)
+    index = FeedIndex(feed)
+
+    # A stop id without any calls, on either side of the query
+    stops = list(feed.stops['stop_id']) + ['missing']
+    for start in stops:
+        for end in stops:
+            assert set(index.trips_between(start, end)) == _scan_trips_between(feed.stop_times, start, end), \
+                (start, end)
+    assert set(index.trips_between('S3', 'S2')) == {'T1-loop'}
+
+
+def test_stop_id_by_name(raw_feed):
+    index = FeedIndex(raw_feed)
+    assert index.stop_id('Stop 4') == 'S4'
+    assert index.stop_id('Nowhere') is None
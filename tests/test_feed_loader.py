@@ -0,0 +1,97 @@
+import gtfs_kit as gk
+import pandas as pd
+import pytest
+
+from feed_cache import trip_stats_cache
+from feed_loader import CLEANING_STAGES, FEED_TABLES, build_snapshot, clean_feed_data, load_feed, snapshot_dir
+
+
+@pytest.fixture(autouse=True)
+def fresh_trip_stats_cache():
+    trip_stats_cache.invalidate()
+    yield
+    trip_stats_cache.invalidate()
+
+
+def test_snapshot_round_trip_matches_cleaned_feed(gtfs_zip, tmp_path):
+    root = tmp_path / 'snapshots'
+    expected = clean_feed_data(gk.read_feed(gtfs_zip, dist_units='km'))
+    out_dir = build_snapshot(gtfs_zip, root)
+    assert out_dir == snapshot_dir(gtfs_zip, root)
+
+    feed = load_feed(gtfs_zip, root)
+    for name in FEED_TABLES:
+        table = getattr(expected, name, None)
+        if table is None:
+            assert getattr(feed, name, None) is None
+            continue
+        pd.testing.assert_frame_equal(getattr(feed, name).reset_index(drop=True), table.reset_index(drop=True),
+                                      check_dtype=False)
+    assert list(feed.routes['route_id']) == ['R1', 'R2', 'R3', 'R5']
+
+
+def test_rebuilt_snapshot_replaces_the_old_one(gtfs_zip, tmp_path):
+    root = tmp_path / 'snapshots'
+    out_dir = build_snapshot(gtfs_zip, root)
+    first = out_dir.resolve()
+    assert build_snapshot(gtfs_zip, root) == out_dir
+    second = out_dir.resolve()
+    assert out_dir.is_symlink() and second != first
+    assert build_snapshot(gtfs_zip, root) == out_dir
+    # The replaced version stays for readers still loading it, the ones before it go
+    assert sorted(path.name for path in root.iterdir()) == sorted([out_dir.name, second.name,
+                                                                   out_dir.resolve().name])
+    assert list(load_feed(gtfs_zip, root).routes['route_id']) == ['R1', 'R2', 'R3', 'R5']
+
+
+def test_snapshot_written_in_place_is_replaced_by_a_link(gtfs_zip, tmp_path):
+    root = tmp_path / 'snapshots'
+    legacy = snapshot_dir(gtfs_zip, root)
+    legacy.mkdir(parents=True)
+    (legacy / 'manifest.json').write_text('{}')
+    build_snapshot(gtfs_zip, root)
+    assert legacy.is_symlink() and (legacy / 'stop_times.arrow').exists()
+
+
+def test_snapshot_seeds_trip_stats_so_the_first_lookup_is_a_hit(gtfs_zip, tmp_path, monkeypatch):
+    root = tmp_path / 'snapshots'
+    build_snapshot(gtfs_zip, root)
+    built = trip_stats_cache.get(load_feed(gtfs_zip, root))
+
+    def recompute(*args, **kwargs):
+        raise AssertionError('trip_stats recomputed despite the snapshot')
+
+    monkeypatch.setattr(gk.Feed, 'compute_trip_stats', recompute)
+    trip_stats_cache.invalidate()
+    feed = load_feed(gtfs_zip, root)
+    trip_stats = trip_stats_cache.get(feed)
+    assert trip_stats is trip_stats_cache.get(feed)
+    pd.testing.assert_frame_equal(trip_stats.reset_index(drop=True), built.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_load_feed_without_snapshot_parses_the_zip(gtfs_zip, tmp_path):
+    feed = load_feed(gtfs_zip, tmp_path / 'missing')
+    assert 'R4' not in set(feed.routes['route_id'])
+    assert not feed.stop_times['departure_time'].str.contains(' ').any()
+
+
+def test_cleaning_stages_match_the_row_by_row_cleanup(raw_feed):
+    assert raw_feed.stop_times['departure_time'].str.startswith(' ').sum() == 3
+    expected_routes = [route_id for route_id in raw_feed.routes['route_id']
+                       if len(raw_feed.trips[raw_feed.trips['route_id'] == route_id])]
+    expected_times = raw_feed.stop_times['departure_time'].map(lambda value: value.replace(' ', ''))
+
+    timings = {}
+    feed = clean_feed_data(raw_feed, timings=timings)
+    assert list(feed.routes['route_id']) == expected_routes == ['R1', 'R2', 'R3', 'R5']
+    assert feed.stop_times['departure_time'].tolist() == expected_times.tolist()
+    assert list(timings) == [name for name, _ in CLEANING_STAGES]
+    assert all(seconds >= 0 for seconds in timings.values())
+
+
+def test_cleaned_stop_times_are_ordered_by_trip_and_sequence(raw_feed):
+    raw_feed.stop_times = raw_feed.stop_times.iloc[::-1]
+    stop_times = clean_feed_data(raw_feed).stop_times
+    assert stop_times.index.tolist() == list(range(len(stop_times)))
+    assert stop_times[['trip_id', 'stop_sequence']].apply(tuple, axis=1).is_monotonic_increasing
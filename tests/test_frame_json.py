@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask, jsonify
+
+import frame_json
+from frame_json import dumps, frame_records, init_app
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'trip_id': ['T1', 'T2', None],
+        'count': np.array([1, 2, 3], dtype=np.int64),
+        'speed': [10.5, np.nan, 3.0],
+        'ok': [True, False, True],
+        'day': pd.to_datetime(['2023-09-04 07:00:00', None, '2023-09-05 00:02:00']),
+        'period': pd.Categorical(['a', None, 'b']),
+    })
+
+
+def _expected_records(df):
+    # The to_dict() conversion the encoder replaces, with every missing value as None
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    for record in records:
+        if record['day'] is not None:
+            record['day'] = record['day'].isoformat()
+    return records
+
+
+@pytest.mark.parametrize('encoder', ['orjson', 'json'])
+def test_frames_encode_like_records_with_nulls(frame, encoder, monkeypatch):
+    if encoder == 'json':
+        monkeypatch.setattr(frame_json, 'orjson', None)
+    elif frame_json.orjson is None:
+        pytest.skip('orjson is not installed')
+    payload = json.loads(dumps({'rows': frame, 'total': np.int64(3), 'mean': np.float64('nan'),
+                                'speeds': frame['speed']}))
+    assert payload['rows'] == _expected_records(frame) == frame_records(frame)
+    assert payload['total'] == 3 and payload['mean'] is None
+    assert payload['speeds'] == [10.5, None, 3.0]
+
+
+def test_jsonify_honours_orient_columns(frame):
+    app = init_app(Flask(__name__))
+
+    @app.route('/frame')
+    def frame_view():
+        return jsonify({'data': frame[['trip_id', 'speed']]})
+
+    client = app.test_client()
+    assert client.get('/frame').json['data'][1] == {'trip_id': 'T2', 'speed': None}
+    assert client.get('/frame?orient=columns').json['data'] == {'trip_id': ['T1', 'T2', None],
+                                                                'speed': [10.5, None, 3.0]}
+
+
+def test_nullable_columns_keep_their_type_with_null_for_na():
+    df = pd.DataFrame({
+        'route_type': pd.array([3, None], dtype='Int64'),
+        'wheelchair': pd.array([True, None], dtype='boolean'),
+    })
+    assert json.loads(dumps(df)) == [{'route_type': 3, 'wheelchair': True}, {'route_type': None, 'wheelchair': None}]
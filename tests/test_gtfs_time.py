@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gtfs_time import (NO_TIME, TIME_OF_DAY, TIME_PERIOD, add_time_buckets, add_time_columns, classify_hours,
+                        hour_buckets, seconds_to_datetime, seconds_to_time, time_to_seconds)
+
+
+def test_time_to_seconds_matches_a_scalar_parse():
+    times = ['07:00:00', '7:05:30', ' 08:10:00', '24:02:00', '25:59:59', '08:10:00', None, '', 'ab:cd:ef', '7:5:0']
+    expected = []
+    for value in times:
+        try:
+            h, m, s = value.strip().split(':')
+            expected.append(int(h) * 3600 + int(m) * 60 + int(s) if len(m) == len(s) == 2 else NO_TIME)
+        except (AttributeError, ValueError):
+            expected.append(NO_TIME)
+    seconds = time_to_seconds(times)
+    assert seconds.dtype == np.int32
+    assert seconds.tolist() == expected
+
+
+def test_seconds_round_trip_past_midnight():
+    seconds = np.array([0, 25200, 86520, 93599, NO_TIME])
+    assert seconds_to_time(seconds).tolist() == ['00:00:00', '07:00:00', '24:02:00', '25:59:59', None]
+    assert time_to_seconds(seconds_to_time(seconds)).tolist() == seconds.tolist()
+
+    datetimes = seconds_to_datetime(seconds, '2023-09-04')
+    assert datetimes[2] == pd.Timestamp('2023-09-05 00:02:00')
+    assert pd.isna(datetimes[4])
+
+
+def test_add_time_columns(raw_feed):
+    feed = add_time_columns(raw_feed)
+    late = feed.stop_times[feed.stop_times['trip_id'] == 'T2-4']
+    assert late['arrival_secs'].tolist() == [23 * 3600 + 3300, 24 * 3600 + 120]
+    assert (feed.stop_times['departure_secs'] != NO_TIME).all()
+
+
+def _time_of_day(hour):
+    # The row-by-row classification the buckets replace
+    for start, label in [(4, 'Morning'), (8, 'Peak Morning'), (12, 'Afternoon'), (16, 'Peak Evening'), (20, 'Night')]:
+        if start <= hour < start + 4:
+            return label
+    return 'Mid Night'
+
+
+def _time_period(hour):
+    for i in range(0, 23, 2):
+        if i <= hour < i + 2:
+            return f'{i}:00-{i + 1}:59'
+    return None
+
+
+def test_classify_hours_matches_the_row_by_row_rules():
+    hours = np.arange(0, 30)
+    assert list(classify_hours(hours, TIME_OF_DAY)) == [_time_of_day(hour) for hour in hours]
+    assert [None if pd.isna(label) else label for label in classify_hours(hours, TIME_PERIOD)] == \
+        [_time_period(hour) for hour in hours]
+
+
+def test_hour_buckets_needs_one_more_label_than_edges():
+    with pytest.raises(ValueError):
+        hour_buckets([4, 8], ['a', 'b'])
+
+
+def test_add_time_buckets(raw_feed):
+    trip_stats = add_time_buckets(raw_feed.compute_trip_stats())
+    by_trip = trip_stats.set_index('trip_id')
+    assert by_trip.loc['T1-2', 'time_of_day'] == 'Peak Morning'
+    assert by_trip.loc['T1-2', 'time_period'] == '8:00-9:59'
+    assert by_trip.loc['T2-4', 'time_of_day'] == 'Night'
+    assert by_trip['start_secs'].tolist() == time_to_seconds(trip_stats['start_time']).tolist()
+    assert trip_stats['time_of_day'].dtype == 'category'
@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+import pytest
+
+from feed_loader import clean_feed_data
+from frame_json import dumps
+from gtfs_time import time_to_seconds
+from isochrone import compute_isochrone, origin_sources, travel_times
+from journey_planner import INF, Timetable
+
+DATE = '20230905'
+
+
+@pytest.fixture
+def feed(raw_feed):
+    return clean_feed_data(raw_feed)
+
+
+@pytest.mark.parametrize('start_time, window', [('06:55:00', 0), ('07:00:00', 30), ('08:20:00', 20)])
+def test_travel_times_match_single_queries_over_the_window(feed, start_time, window):
+    timetable = Timetable(feed, DATE)
+    start = int(time_to_seconds([start_time])[0])
+    # Trips and transfers of the fixture take whole minutes, so trying each minute finds the best departure
+    departures = range(start, start + window * 60 + 1, 60)
+    for source in timetable.stop_ids:
+        seconds = travel_times(timetable, {timetable.stop_codes[source]: 0}, start, start + window * 60)
+        for target, code in timetable.stop_codes.items():
+            durations = [journeys[-1]['duration'] for journeys in
+                         (timetable.plan([source], [target], departure, 3) for departure in departures) if journeys]
+            assert seconds[code] == min(durations, default=INF), (source, target)
+
+
+def test_coordinate_origin_walks_to_nearby_stops(feed):
+    timetable = Timetable(feed, DATE)
+    stops = feed.stops.reset_index(drop=True)
+    sources = origin_sources(timetable, stops, lat=40.7202, lon=-74.0102)
+    assert {timetable.stop_ids[code] for code in sources} == {'S4', 'S6'}
+    assert all(0 < seconds < 60 for seconds in sources.values())
+    assert origin_sources(timetable, stops, stop_id='S1') == {timetable.stop_codes['S1']: 0}
+
+
+def test_isochrone_bands(feed):
+    isochrone = compute_isochrone(feed, DATE, '07:00:00', stop_id='S1', bands=(10, 30, 60), polygons=True)
+    bands = {band: rows['stop_id'].tolist() for band, rows in isochrone['bands'].items()}
+    # S2 after 5 minutes, S3 after 11, S4 after 27, S6 after 29 and S5 after 35
+    assert bands == {10: ['S1', 'S2'], 30: ['S3', 'S4', 'S6'], 60: ['S5']}
+    assert isochrone['num_stops'] == 6
+    assert [feature['properties']['minutes'] for feature in isochrone['polygons']['features']] == [10, 30, 60]
+    # Encoded by frame_json as lists of records
+    assert json.loads(dumps(isochrone['bands']))['30'][0] == {
+        'stop_id': 'S3', 'stop_name': 'Stop 3', 'stop_lat': 40.72, 'stop_lon': -74.0, 'travel_time': 11.0}
+
+    assert compute_isochrone(feed, DATE, '07:00:00', stop_id='missing') is None
+    with pytest.raises(ValueError):
+        compute_isochrone(feed, DATE, '25 past', stop_id='S1')
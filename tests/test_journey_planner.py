@@ -0,0 +1,126 @@
+import pytest
+
+from feed_loader import clean_feed_data
+from gtfs_time import time_to_seconds
+import journey_planner
+from journey_planner import DAY, INF, Timetable, plan_journeys, timetable_for
+
+DATE = '20230905'
+
+
+@pytest.fixture
+def feed(raw_feed):
+    return clean_feed_data(raw_feed)
+
+
+def _trips(feed, shift=0):
+    # Every trip of the feed as (stop ids, arrivals, departures), all services running on DATE and the day before
+    trips = []
+    for _, calls in feed.stop_times.sort_values(['trip_id', 'stop_sequence']).groupby('trip_id'):
+        arrivals = [time + shift for time in calls['arrival_secs']]
+        if shift and arrivals[-1] < 0:
+            continue
+        trips.append((list(calls['stop_id']), arrivals, [time + shift for time in calls['departure_secs']]))
+    return trips
+
+
+def _brute_force_rounds(feed, source, departure, rounds):
+    """
+    Earliest arrival at every stop using at most k trips, for k = 0..rounds, by
+    trying to board every trip at every stop in each round.
+    """
+    footpaths = {}
+    for from_id, to_id, seconds in zip(feed.transfers['from_stop_id'], feed.transfers['to_stop_id'],
+                                       feed.transfers['min_transfer_time']):
+        footpaths.setdefault(from_id, []).append((to_id, int(seconds)))
+    trips = _trips(feed) + _trips(feed, -DAY)
+
+    def walk(reached, best):
+        for stop, time in list(reached.items()):
+            for to_stop, seconds in footpaths.get(stop, ()):
+                best[to_stop] = min(best.get(to_stop, INF), time + seconds)
+
+    best = {source: departure}
+    walk({source: departure}, best)
+    by_round = [dict(best)]
+    for _ in range(rounds):
+        ridden = {}
+        for stops, arrivals, departures in trips:
+            for board, stop in enumerate(stops):
+                if best.get(stop, INF) <= departures[board]:
+                    for alight in range(board + 1, len(stops)):
+                        ridden[stops[alight]] = min(ridden.get(stops[alight], INF), arrivals[alight])
+                    break
+        best = {stop: min(best.get(stop, INF), ridden.get(stop, INF)) for stop in set(best) | set(ridden)}
+        walk(ridden, best)
+        by_round.append(dict(best))
+    return by_round
+
+
+@pytest.mark.parametrize('departure_time', ['06:50:00', '07:10:00', '07:25:00', '08:05:00', '09:40:00'])
+def test_plan_matches_brute_force_earliest_arrival(feed, departure_time):
+    departure = int(time_to_seconds([departure_time])[0])
+    stops = list(feed.stops['stop_id'])
+    for source in stops:
+        by_round = _brute_force_rounds(feed, source, departure, 5)
+        for target in stops:
+            expected, earliest = [], INF
+            for k, best in enumerate(by_round):
+                if best.get(target, INF) < earliest:
+                    earliest = best[target]
+                    expected.append((max(k - 1, 0), earliest - departure))
+
+            journeys = plan_journeys(feed, [source], [target], DATE, departure_time, max_transfers=4)
+            assert [(journey['num_transfers'], journey['duration']) for journey in journeys] == expected, \
+                (source, target)
+
+
+def test_legs_chain_from_source_to_target(feed):
+    # S1 -> S3 on R1, S3 -> S4 on R2, walk to S6 and R3 to S5 beats the slow direct R5
+    journeys = plan_journeys(feed, ['S1'], ['S5'], DATE, '06:55:00', max_transfers=4)
+    assert [journey['num_transfers'] for journey in journeys] == [0, 2]
+    assert [leg['route_id'] for leg in journeys[0]['legs']] == ['R5']
+
+    legs = journeys[-1]['legs']
+    assert [leg['type'] for leg in legs] == ['ride', 'ride', 'transfer', 'ride']
+    assert [leg.get('route_id') for leg in legs] == ['R1', 'R2', None, 'R3']
+    assert legs[0]['from_stop_id'] == 'S1' and legs[-1]['to_stop_id'] == 'S5'
+    for before, after in zip(legs, legs[1:]):
+        assert before['to_stop_id'] == after['from_stop_id']
+    assert legs[2]['duration'] == 120
+    assert journeys[-1]['arrival_time'] == legs[-1]['arrival_time'] == '07:35:00'
+
+
+def test_timetable_includes_previous_day_trips_past_midnight(feed):
+    patterns = Timetable(feed, DATE).patterns
+    late = [(pattern.arrivals[row], pattern.departures[row]) for pattern in patterns
+            for row, trip_id in enumerate(pattern.trip_ids) if trip_id == 'T2-4']
+    # Today's run and yesterday's, shifted to end 2 minutes after midnight
+    assert sorted(arrivals[-1] for arrivals, _ in late) == [120, DAY + 120]
+    # Monday follows a Sunday without service, and the 7th is removed by calendar_dates
+    assert len([row for pattern in Timetable(feed, '20230904').patterns for row in pattern.trip_ids]) == 17
+    assert plan_journeys(feed, ['S1'], ['S3'], '20230907', '07:00:00') == []
+
+
+def test_plan_rejects_bad_arguments(feed):
+    with pytest.raises(ValueError):
+        plan_journeys(feed, ['S1'], ['S3'], DATE, '7 am')
+    with pytest.raises(ValueError):
+        plan_journeys(feed, ['S1'], ['S3'], '2023-09-05', '07:00:00')
+
+
+def test_timetables_compiled_once_per_date(feed):
+    timetable = timetable_for(feed, DATE)
+    assert timetable_for(feed, DATE) is timetable
+    assert timetable_for(feed, '20230906') is not timetable
+    assert not journey_planner._timetables_pending
+
+
+def test_legs_report_a_boarding_stop_without_label(feed):
+    timetable = Timetable(feed, DATE)
+    s1, s3 = timetable.stop_codes['S1'], timetable.stop_codes['S3']
+    _, labels = timetable.raptor({s1: time_to_seconds(['07:00:00'])[0]}, {s3}, 1)
+    assert [leg['from_stop_id'] for leg in timetable._legs(labels, 1, s3)] == ['S1']
+    del labels[0][s1]
+    with pytest.raises(LookupError):
+        timetable._legs(labels, 1, s3)
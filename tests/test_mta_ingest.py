@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from conftest import write_mta_csv
+from mta_ingest import build_store, clock_seconds, ingest_csv, load_store, remove_delay_outliers, store_complete
+
+
+def _old_pipeline(path):
+    # load_and_clean_data before the store, without its outlier filter
+    def modify_time(row):
+        if type(row) is not float:
+            parts = row.split(':')
+            parts[0] = str(int(parts[0]) % 24)
+            return ':'.join(parts)
+        return np.nan
+
+    def classify(hour):
+        for low, high, label in [(8, 10, 'Rush Hour (Morning)'), (6, 11, 'Morning'), (12, 16, 'Afternoon'),
+                                 (17, 20, 'Rush Hour (Evening)'), (20, 24, 'Night')]:
+            if low <= hour < high:
+                return label
+        return 'Other'
+
+    df = pd.read_csv(path).dropna(subset=['OriginName', 'NextStopPointName']).reset_index(drop=True)
+    df['RecordedDate'] = df['RecordedAtTime'].str.split().str[0]
+    df['ModifiedScheduledTime'] = df['RecordedDate'] + ' ' + df['ScheduledArrivalTime'].apply(modify_time)
+    df['RecordedAtTime'] = pd.to_datetime(df['RecordedAtTime'])
+    df['ExpectedArrivalTime'] = pd.to_datetime(df['ExpectedArrivalTime'], errors='coerce')
+    df['ModifiedScheduledTime'] = pd.to_datetime(df['ModifiedScheduledTime'], errors='coerce')
+    df['ExpectedArrivalTime'] = df['ExpectedArrivalTime'].fillna(df['ModifiedScheduledTime'])
+    df = df.dropna(subset=['ModifiedScheduledTime'])
+    df['Delay'] = (df['ExpectedArrivalTime'] - df['ModifiedScheduledTime']).dt.total_seconds() / 60.0
+    df['Hour'] = df['RecordedAtTime'].dt.hour
+    df['TimeOfDay'] = df['Hour'].apply(classify)
+    return df
+
+
+def test_ingested_store_matches_the_old_pipeline(tmp_path):
+    path = write_mta_csv(tmp_path / 'positions.csv', 3000, seed=3)
+    rows = ingest_csv(path, tmp_path / 'store', chunksize=700)
+    expected = _old_pipeline(path).sort_values(['RecordedAtTime', 'VehicleRef']).reset_index(drop=True)
+    stored = load_store(tmp_path / 'store').sort_values(['RecordedAtTime', 'VehicleRef']).reset_index(drop=True)
+    assert rows == len(stored) == len(expected)
+    assert sorted(path.name for path in (tmp_path / 'store').glob('RecordedDate=*')) == \
+        ['RecordedDate=2017-12-01', 'RecordedDate=2017-12-02', 'RecordedDate=2017-12-03']
+
+    for column in ['RecordedAtTime', 'ExpectedArrivalTime', 'ModifiedScheduledTime']:
+        assert (stored[column] == expected[column]).all(), column
+    assert stored['VehicleRef'].astype(str).tolist() == expected['VehicleRef'].tolist()
+    assert stored['TimeOfDay'].astype(str).tolist() == expected['TimeOfDay'].tolist()
+    assert stored['Hour'].tolist() == expected['Hour'].tolist()
+    np.testing.assert_allclose(stored['Delay'], expected['Delay'], atol=1e-4)
+    assert (stored['RecordedDate'] == expected['RecordedAtTime'].dt.normalize()).all()
+
+
+def test_clock_seconds_wraps_past_midnight():
+    seconds = clock_seconds(['07:05:30', '24:10:00', ' 9:00:00', None, 'soon', '7:5:0'])
+    np.testing.assert_array_equal(seconds, [25530, 600, 32400, np.nan, np.nan, np.nan])
+
+
+def test_remove_delay_outliers_keeps_the_iqr_band():
+    data = pd.DataFrame({'Delay': [0.0, 1.0, 2.0, 3.0, 4.0, 100.0]})
+    assert remove_delay_outliers(data)['Delay'].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_build_store_marks_completion_and_replaces_a_partial_store(tmp_path):
+    store_dir = tmp_path / 'store'
+    (store_dir / 'RecordedDate=2017-12-01').mkdir(parents=True)
+    (store_dir / 'RecordedDate=2017-12-01' / 'part-stale.parquet').write_bytes(b'not parquet')
+    assert not store_complete(store_dir)
+
+    rows = build_store(write_mta_csv(tmp_path / 'first.csv', 500), store_dir)
+    assert store_complete(store_dir)
+    assert len(load_store(store_dir)) == rows
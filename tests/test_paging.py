@@ -0,0 +1,57 @@
+import json
+
+import pandas as pd
+import pytest
+from flask import Flask, request
+
+from frame_json import init_app
+from paging import encode_cursor, list_response
+
+
+@pytest.fixture
+def client():
+    frame = pd.DataFrame({
+        'trip_id': [f'T{i:04d}' for i in range(1, 1001)],
+        'route_id': [f'R{i % 7}' for i in range(1000)],
+        'headsign': [None if i % 5 == 0 else f'To {i}' for i in range(1000)],
+    })
+    app = init_app(Flask(__name__))
+
+    @app.route('/trips')
+    def trips():
+        return list_response(frame, 'trip_id', request.args)
+
+    return app.test_client()
+
+
+def test_cursor_walk_returns_every_row_once_in_key_order(client):
+    full = json.loads(client.get('/trips').data)
+    walked, cursor, pages = [], None, 0
+    while True:
+        args = {'limit': 137, 'fields': 'trip_id,headsign'}
+        if cursor:
+            args['cursor'] = cursor
+        body = client.get('/trips', query_string=args).json
+        walked += body['data']
+        cursor = body['next_cursor']
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 8
+    assert [row['trip_id'] for row in walked] == [row['trip_id'] for row in full]
+    assert walked[0] == {'trip_id': 'T0001', 'headsign': None}
+    assert set(walked[1]) == {'trip_id', 'headsign'}
+
+
+def test_ndjson_page_carries_next_cursor_header(client):
+    response = client.get('/trips?format=ndjson&limit=3')
+    lines = response.data.decode().splitlines()
+    assert [json.loads(line)['trip_id'] for line in lines] == ['T0001', 'T0002', 'T0003']
+    following = client.get('/trips', query_string={'limit': 2, 'cursor': response.headers['X-Next-Cursor']}).json
+    assert [row['trip_id'] for row in following['data']] == ['T0004', 'T0005']
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=10001', 'limit=abc', 'limit=', 'cursor=zz!',
+                                   f'cursor={encode_cursor(5)}', f'cursor={encode_cursor([1])}', 'fields=nope'])
+def test_bad_arguments_are_rejected(client, query):
+    assert client.get(f'/trips?{query}').status_code == 400
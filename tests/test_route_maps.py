@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import route_maps
+from feed_loader import clean_feed_data
+from route_maps import (RouteMaps, batch_route_maps, build_route_maps, etag_of, read_map_snapshot, route_map,
+                        write_map_snapshot)
+from shape_store import ShapeStore
+from stop_times_fact import StopTimesFact
+
+
+@pytest.fixture
+def feed(raw_feed):
+    return clean_feed_data(raw_feed)
+
+
+def test_route_maps_hold_each_stop_and_shape_once(feed):
+    maps = build_route_maps(StopTimesFact(feed), ShapeStore(feed.shapes))
+    assert sorted(maps) == ['R1', 'R2', 'R3', 'R5']
+
+    merged = feed.stop_times.merge(feed.trips, on='trip_id')
+    for route_id, collection in maps.items():
+        points = [f for f in collection['features'] if f['geometry']['type'] == 'Point']
+        lines = [f for f in collection['features'] if f['geometry']['type'] == 'LineString']
+        calls = merged[merged['route_id'] == route_id]
+        assert [f['properties']['stop_id'] for f in points] == \
+            list(calls.groupby('stop_id')['stop_sequence'].min().sort_values().index)
+        assert [f['properties']['num_stop_times'] for f in points] == \
+            [int((calls['stop_id'] == f['properties']['stop_id']).sum()) for f in points]
+        assert {f['properties']['shape_id']: f['properties']['num_trips'] for f in lines} == \
+            calls.drop_duplicates('trip_id')['shape_id'].value_counts().to_dict()
+        assert collection['properties']['route_id'] == route_id
+
+    r1 = maps['R1']
+    assert [f['properties']['role'] for f in r1['features'][:3]] == ['source', 'stop', 'destination']
+    assert r1['features'][0]['geometry']['coordinates'] == [-74.0, 40.7]
+    assert r1['bbox'] == [-74.0, 40.7, -74.0, 40.72]
+
+
+def test_route_maps_cached_on_disk_by_feed_fingerprint(feed, tmp_path, monkeypatch):
+    fact, shapes = StopTimesFact(feed), ShapeStore(feed.shapes)
+    maps = RouteMaps.for_feed(feed, fact, shapes, tmp_path)
+    body, etag = maps.get('R1')
+    assert etag == etag_of(body)
+    assert json.loads(body) == json.loads(json.dumps(build_route_maps(fact, shapes)['R1']))
+    assert maps.get('R4') is None
+
+    monkeypatch.setattr(route_maps, 'build_route_maps', lambda *args: pytest.fail('maps rebuilt'))
+    reread = RouteMaps.for_feed(feed, fact, shapes, tmp_path)
+    assert reread.get('R1') == (body, etag)
+    assert reread.route_ids() == ['R1', 'R2', 'R3', 'R5']
+
+
+def test_batch_writes_the_same_maps(feed, tmp_path):
+    fact, shapes = StopTimesFact(feed), ShapeStore(feed.shapes)
+    expected = build_route_maps(fact, shapes)
+    progress = []
+    index = batch_route_maps(fact, shapes, tmp_path / 'batch', processes=2,
+                             progress=lambda done, total: progress.append((done, total)))
+    assert index == {route_id: f'{route_id}.geojson' for route_id in sorted(expected)}
+    assert json.loads((tmp_path / 'batch' / 'index.json').read_text()) == index
+    for route_id, name in index.items():
+        assert json.loads((tmp_path / 'batch' / name).read_text()) == json.loads(json.dumps(expected[route_id]))
+    assert progress == [(done, 4) for done in range(1, 5)]
+    # The memory-mapped snapshot of the workers is gone once the batch is done
+    assert sorted(path.name for path in (tmp_path / 'batch').iterdir()) == sorted([*index.values(), 'index.json'])
+
+    assert batch_route_maps(fact, shapes, tmp_path / 'some', route_ids=['R2'], processes=1) == {'R2': 'R2.geojson'}
+    # R4 has no trips, so cleaning dropped it
+    with pytest.raises(ValueError):
+        batch_route_maps(fact, shapes, tmp_path / 'bad', route_ids=['R4'])
+    with pytest.raises(ValueError):
+        batch_route_maps(fact, shapes, tmp_path / 'bad', processes=0)
+
+
+def test_map_snapshot_builds_the_same_maps(feed, tmp_path):
+    fact, shapes = StopTimesFact(feed), ShapeStore(feed.shapes)
+    write_map_snapshot(fact, shapes, tmp_path)
+    tables, mapped = read_map_snapshot(tmp_path)
+    for shape_id in shapes.shape_ids:
+        assert (mapped.coordinates(shape_id) == shapes.coordinates(shape_id)).all()
+    assert mapped.coordinates('nope').shape == (0, 2)
+    route_ids = tables['routes']['route_id']
+    assert {route_ids.iat[code]: route_map(tables, mapped, code) for code in tables['stop_rows']} == \
+        build_route_maps(fact, shapes)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from shape_store import ShapeStore, haversine_steps, shape_store
+
+
+def test_slices_match_filtering_the_shapes(raw_feed):
+    shapes = raw_feed.shapes.sample(frac=1, random_state=0)
+    store = ShapeStore(shapes)
+    assert len(store) == 4 and 'SH1' in store and 'nope' not in store
+    for shape_id in store.shape_ids:
+        expected = shapes[shapes['shape_id'] == shape_id].sort_values('shape_pt_sequence')
+        np.testing.assert_array_equal(store.coordinates(shape_id), expected[['shape_pt_lat', 'shape_pt_lon']])
+        assert np.shares_memory(store.coordinates(shape_id), store.coords)
+    assert store.coordinates('nope').shape == (0, 2)
+    assert np.isnan(store.total_distance('nope'))
+
+
+def test_distances_fall_back_to_the_points(raw_feed):
+    store = ShapeStore(raw_feed.shapes)
+    np.testing.assert_allclose(store.distances('SH1'), [0.0, 1.11, 2.22])
+    # SH5 has no shape_dist_traveled, so it is measured along its points in km
+    points = store.coordinates('SH5')
+    expected = haversine_steps(points[:, 0], points[:, 1]).sum()
+    assert store.total_distance('SH5') == expected
+    assert 3.0 < expected < 4.0
+
+    summary = store.summary().set_index('shape_id')
+    assert summary.loc['SH1', 'num_points'] == 3
+    assert summary.loc['SH2', 'total_dist_traveled'] == 0.84
+
+
+def test_between_returns_the_points_in_a_distance_range(raw_feed):
+    store = ShapeStore(raw_feed.shapes)
+    np.testing.assert_array_equal(store.between('SH1', 1.0, 2.22), store.coordinates('SH1')[1:])
+    np.testing.assert_array_equal(store.between('SH1', 0.0, 1.11), store.coordinates('SH1')[:2])
+    assert len(store.between('SH1', 3.0, 4.0)) == 0
+
+
+def test_store_rebuilt_when_shapes_change(raw_feed):
+    store = shape_store(raw_feed)
+    assert shape_store(raw_feed) is store
+    raw_feed.shapes = raw_feed.shapes[raw_feed.shapes['shape_id'] != 'SH5']
+    assert 'SH5' not in shape_store(raw_feed)
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from feed_loader import clean_feed_data
+from stop_times_fact import StopTimesFact
+
+
+@pytest.fixture
+def feed(raw_feed):
+    return clean_feed_data(raw_feed)
+
+
+def _merged(feed):
+    # The wide inner merges the fact table replaces
+    trips = feed.trips.merge(feed.routes, on='route_id').merge(feed.shapes[['shape_id']].drop_duplicates(), on='shape_id')
+    return feed.stop_times.merge(trips, on='trip_id').merge(feed.stops, on='stop_id')
+
+
+def test_route_counts_match_merge_and_groupby(feed):
+    expected = _merged(feed).groupby('route_id').agg(
+        TotalStops=('stop_id', 'nunique'),
+        TotalTrips=('trip_id', 'nunique'),
+        TotalShapes=('shape_id', 'nunique'),
+    ).reset_index()
+    counts = StopTimesFact(feed).route_counts()
+    pd.testing.assert_frame_equal(counts.astype({'route_id': object}).sort_values('route_id').reset_index(drop=True),
+                                  expected, check_dtype=False)
+    assert counts['TotalStops'].is_monotonic_decreasing
+
+
+def test_facts_keep_the_inner_join_rows_in_trip_order(feed):
+    # Stop times of an unknown trip and at an unknown stop drop out
+    extra = feed.stop_times.iloc[:2].assign(trip_id=['T-unknown', 'T1-0'], stop_id=['S1', 'S-unknown'])
+    feed.stop_times = pd.concat([feed.stop_times, extra], ignore_index=True).sample(frac=1, random_state=1)
+    fact = StopTimesFact(feed)
+    merged = _merged(feed).sort_values(['trip_id', 'stop_sequence'])
+    assert len(fact) == len(merged)
+
+    trip_ids = fact.dimension_column('trips', 'trip_id', fact.facts['trip_idx'])
+    stop_ids = fact.dimension_column('stops', 'stop_id', fact.facts['stop_idx'])
+    assert list(zip(trip_ids, stop_ids)) == list(zip(merged['trip_id'], merged['stop_id']))
+    route_ids = fact.dimension_column('routes', 'route_id', fact.facts['route_idx'])
+    assert list(route_ids) == merged['route_id'].tolist()
+
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from feed_loader import clean_feed_data
+from shape_store import ShapeStore
+from stop_times_fact import StopTimesFact
+from travel_time_model import (FEATURES, feature_matrix, latest_version, list_versions, load_model, make_model,
+                               train_travel_time_model)
+from trip_segments import build_segments
+
+
+@pytest.fixture
+def fact_and_segments(raw_feed):
+    feed = clean_feed_data(raw_feed)
+    fact = StopTimesFact(feed)
+    return fact, build_segments(fact, ShapeStore(feed.shapes))
+
+
+def test_feature_matrix_in_batches_matches_the_columns(fact_and_segments):
+    _, segments = fact_and_segments
+    X, y = feature_matrix(segments, batch_size=4)
+    assert X.dtype == y.dtype == np.float32
+    assert X.shape == (len(segments), len(FEATURES))
+    np.testing.assert_allclose(X[:, FEATURES.index('distance')], segments['distance'])
+    np.testing.assert_array_equal(X[:, FEATURES.index('hour')], segments['departure_secs'] // 3600 % 24)
+    np.testing.assert_array_equal(X[:, FEATURES.index('route')], segments['route_idx'])
+    np.testing.assert_array_equal(y, segments['seconds'])
+
+
+@pytest.mark.parametrize('kind', ['hist_gradient_boosting', 'random_forest'])
+def test_training_saves_a_new_latest_version(fact_and_segments, tmp_path, kind):
+    fact, segments = fact_and_segments
+    steps = []
+    meta, actual, predicted = train_travel_time_model(segments, fact, kind, max_rows=20, test_size=0.3,
+                                                      model_dir=tmp_path, progress=steps.append)
+    assert steps == ['features', 'fit', 'evaluate', 'save']
+    assert meta['metrics']['train_rows'] + meta['metrics']['test_rows'] == 20
+    assert len(actual) == len(predicted) == meta['metrics']['test_rows']
+    assert meta['route_ids'] == ['R1', 'R2', 'R3', 'R5']
+
+    assert latest_version(tmp_path) == meta['version']
+    model, saved = load_model(model_dir=tmp_path)
+    assert saved == meta
+    X, _ = feature_matrix(segments)
+    assert model.predict(X).shape == (len(segments),)
+    assert [version['version'] for version in list_versions(tmp_path)] == [meta['version']]
+
+
+def test_no_model_and_unknown_kind(tmp_path):
+    assert latest_version(tmp_path) is None and list_versions(tmp_path / 'none') == []
+    with pytest.raises(FileNotFoundError):
+        load_model(model_dir=tmp_path)
+    with pytest.raises(ValueError):
+        make_model('linear')
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from feed_loader import clean_feed_data
+from shape_store import ShapeStore
+from stop_times_fact import StopTimesFact
+from travel_time_model import FEATURES
+from travel_time_service import MicroBatcher, SegmentIndex, TravelTimePredictor
+from trip_segments import build_segments
+
+
+class FeatureModel:
+    """
+    Predicts one feature of every segment, scaled, to check what reaches the model.
+    """
+
+    def __init__(self, feature, scale=1.0):
+        self.column = FEATURES.index(feature)
+        self.scale = scale
+
+    def predict(self, X):
+        return X[:, self.column] * self.scale
+
+
+@pytest.fixture
+def index(raw_feed):
+    feed = clean_feed_data(raw_feed)
+    fact = StopTimesFact(feed)
+    return SegmentIndex(fact, build_segments(fact, ShapeStore(feed.shapes)))
+
+
+def _predictor(index, feature, scale=1.0):
+    meta = {'version': 'v1', 'route_ids': ['R1', 'R2', 'R3', 'R5']}
+    return TravelTimePredictor(FeatureModel(feature, scale), meta, index)
+
+
+def test_prediction_sums_the_segments_between_the_stops(index):
+    queries = pd.DataFrame({
+        'trip_id': ['T1-0', 'T1-3', 'T1-0', 'T1-0', 'T9', 'T2-4'],
+        'from_stop_id': ['S1', 'S2', 'S3', 'S1', 'S1', 'S3'],
+        'to_stop_id': ['S3', 'S3', 'S1', 'S9', 'S2', 'S4'],
+    })
+    result = _predictor(index, 'distance', 100).predict(queries)
+    assert result['found'].tolist() == [True, True, False, False, False, True]
+    assert result['num_segments'].tolist() == [2, 1, 0, 0, 0, 1]
+    np.testing.assert_allclose(result['predicted_seconds'], [222, 111, np.nan, np.nan, np.nan, 84])
+    np.testing.assert_allclose(result['scheduled_seconds'], [660, 360, np.nan, np.nan, np.nan, 420])
+
+
+def test_hour_feature_follows_the_requested_departure(index):
+    queries = pd.DataFrame({
+        'trip_id': ['T1-0', 'T1-0', 'T2-4'],
+        'from_stop_id': ['S1', 'S1', 'S3'],
+        'to_stop_id': ['S3', 'S3', 'S4'],
+        'departure_time': [None, '17:30:00', None],
+    })
+    result = _predictor(index, 'hour').predict(queries)
+    assert result['predicted_seconds'].tolist() == [14, 34, 23]
+
+
+def test_routes_unknown_to_the_model_get_nan(index):
+    predictor = TravelTimePredictor(FeatureModel('route'), {'version': 'v1', 'route_ids': ['R2', 'R1']}, index)
+    routes = index.fact.routes['route_id'].astype(str).tolist()
+    assert dict(zip(routes, predictor.route_feature.tolist())) == \
+        pytest.approx({'R1': 1.0, 'R2': 0.0, 'R3': np.nan, 'R5': np.nan}, nan_ok=True)
+
+
+def test_micro_batcher_merges_concurrent_calls():
+    batches = []
+
+    def double(items):
+        batches.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_wait=0.2, max_items=8)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.submit(i))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: i * 2 for i in range(8)}
+    assert sum(batches) == 8 and len(batches) < 8
+
+    failing = MicroBatcher(lambda items: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        failing.submit(1)
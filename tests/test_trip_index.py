@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import write_mta_csv
+from delay_snapshot import DelayStore
+from mta_ingest import ingest_csv
+from trip_index import TRIP_COLUMNS, TripIndex
+
+
+@pytest.fixture
+def data(tmp_path):
+    ingest_csv(write_mta_csv(tmp_path / 'positions.csv', 3000, seed=7), tmp_path / 'store')
+    return DelayStore(tmp_path / 'store').load().data
+
+
+def _filtered(data, date=None, min_delay=None):
+    rows = data.dropna(subset=['Delay'])
+    if date is not None:
+        rows = rows[rows['RecordedDate'] == date]
+    if min_delay is not None:
+        rows = rows[rows['Delay'] >= min_delay]
+    return rows.sort_values(['RecordedDate', 'Delay'], kind='stable')
+
+
+@pytest.mark.parametrize('date, min_delay', [('2017-12-02', 2), ('2017-12-01', None), (None, 0.5), (None, None),
+                                             ('2017-12-25', 1)])
+def test_pages_match_a_filter(data, date, min_delay):
+    trips = TripIndex.build(data)
+    selected = _filtered(data, date, min_delay)
+    total, page = trips.query(date, min_delay)
+    assert total == len(selected)
+    delays = np.concatenate([trips.delays[start:stop] for start, stop in page] + [np.array([])])
+    np.testing.assert_allclose(delays, selected['Delay'].to_numpy(dtype=np.float64))
+
+    rows = np.concatenate([np.arange(start, stop) for start, stop in page] + [np.array([], dtype=int)])
+    _, window = trips.query(date, min_delay, offset=25, limit=40)
+    windowed = np.concatenate([np.arange(start, stop) for start, stop in window] + [np.array([], dtype=int)])
+    np.testing.assert_array_equal(windowed, rows[25:65])
+
+
+def test_page_as_json(data):
+    trips = TripIndex.build(data)
+    _, page = trips.query(None, 3, offset=10, limit=30)
+    records = json.loads(''.join(trips.iter_json(page, chunk_size=7)))
+    expected = _filtered(data, min_delay=3).iloc[10:40]
+    assert [record['VehicleRef'] for record in records] == expected['VehicleRef'].astype(str).tolist()
+    assert set(records[0]) == set(TRIP_COLUMNS)
+    assert json.loads(''.join(trips.iter_json([]))) == []
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feed_loader import clean_feed_data
+from shape_store import ShapeStore
+from stop_times_fact import StopTimesFact
+from trip_segments import build_segments, project_onto_shape, route_travel_metrics
+
+
+@pytest.fixture
+def feed(raw_feed):
+    return clean_feed_data(raw_feed)
+
+
+def _direct_segments(feed, store):
+    # Consecutive stop pairs of every trip, with the distance of stops lacking one taken from the shape ends
+    rows = []
+    stop_times = feed.stop_times.merge(feed.trips[['trip_id', 'route_id', 'shape_id']], on='trip_id')
+    for trip_id, calls in stop_times.sort_values(['trip_id', 'stop_sequence']).groupby('trip_id'):
+        distance = calls['shape_dist_traveled'].to_numpy(dtype=float)
+        if np.isnan(distance).all():
+            distance = np.array([0.0, store.total_distance(calls['shape_id'].iloc[0])])
+        for i in range(len(calls) - 1):
+            rows.append((trip_id, calls['route_id'].iloc[i], calls['stop_id'].iloc[i], calls['stop_id'].iloc[i + 1],
+                         calls['arrival_secs'].iloc[i + 1] - calls['departure_secs'].iloc[i],
+                         distance[i + 1] - distance[i]))
+    return pd.DataFrame(rows, columns=['trip_id', 'route_id', 'from_stop_id', 'to_stop_id', 'seconds', 'distance'])
+
+
+def test_segments_match_a_direct_computation(feed):
+    fact = StopTimesFact(feed)
+    store = ShapeStore(feed.shapes)
+    segments = build_segments(fact, store)
+    expected = _direct_segments(feed, store)
+
+    assert fact.dimension_column('trips', 'trip_id', segments['trip_idx']).tolist() == expected['trip_id'].tolist()
+    assert fact.dimension_column('routes', 'route_id', segments['route_idx']).tolist() == \
+        expected['route_id'].tolist()
+    assert fact.dimension_column('stops', 'stop_id', segments['from_stop_idx']).tolist() == \
+        expected['from_stop_id'].tolist()
+    assert fact.dimension_column('stops', 'stop_id', segments['to_stop_idx']).tolist() == \
+        expected['to_stop_id'].tolist()
+    np.testing.assert_allclose(segments['seconds'], expected['seconds'])
+    np.testing.assert_allclose(segments['distance'], expected['distance'], rtol=1e-6)
+
+
+def test_route_metrics_match_groupby(feed):
+    fact = StopTimesFact(feed)
+    segments = _direct_segments(feed, ShapeStore(feed.shapes)).assign(minutes=lambda df: df['seconds'] / 60)
+    trips = segments.groupby(['route_id', 'trip_id']).agg(minutes=('minutes', 'mean'), distance=('distance', 'sum'))
+    expected = trips.groupby('route_id').agg(AvgTravelTime=('minutes', 'mean'), TotalDistance=('distance', 'sum'))
+
+    metrics = route_travel_metrics(build_segments(fact, ShapeStore(feed.shapes)), fact)
+    metrics = metrics.astype({'route_id': object}).set_index('route_id').sort_index()
+    pd.testing.assert_frame_equal(metrics, expected, check_dtype=False, check_names=False, rtol=1e-6)
+
+
+def test_projection_onto_a_polyline():
+    coords = np.array([[40.70, -74.00], [40.71, -74.00], [40.71, -73.99]])
+    distance = np.array([0.0, 1.0, 2.0])
+    # Just off the middle of each leg, and beyond both ends
+    projected = project_onto_shape(coords, distance, [40.705, 40.7101, 40.69, 40.72], [-74.0001, -73.995, -74.0, -73.99])
+    np.testing.assert_allclose(projected, [0.5, 1.5, 0.0, 2.0], atol=1e-3)
@@ -0,0 +1,195 @@
+"""
+Offline training and versioned storage of the segment travel-time model.
+
+The model predicts the scheduled seconds of one segment (a pair of consecutive
+stops of a trip) from a compact float32 feature matrix built from the segment
+table: distance along the shape, hour of departure, route and the stop
+sequence of the segment's first stop. Every fit is saved under
+data/models/travel_time/<version>/ with its metadata, and LATEST names the
+version the prediction endpoint loads.
+
+Run python travel_time_model.py to train outside the web app.
+"""
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from gtfs_time import NO_TIME
+
+MODEL_DIR = Path('data/models/travel_time')
+FEATURES = ['distance', 'hour', 'route', 'stop_sequence']
+# Rows of features built at a time, so no float64 intermediate of the whole table exists
+BATCH_SIZE = 1_000_000
+# Segments fitted on by default; histogram gradient boosting gains little past a few million rows
+DEFAULT_MAX_ROWS = 2_000_000
+# Routes past this are an ordinal feature instead of a categorical one (the
+# histogram model bins a categorical feature into at most 255 categories)
+MAX_ROUTE_CATEGORIES = 255
+
+
+def feature_batch(segments):
+    """
+    Features of the rows of a segment table as a float32 matrix.
+    """
+    departure = segments['departure_secs'].to_numpy()
+    hour = np.where(departure == NO_TIME, np.nan, (departure // 3600) % 24)
+    return np.column_stack([
+        segments['distance'].to_numpy(),
+        hour,
+        segments['route_idx'].to_numpy(),
+        segments['stop_sequence'].to_numpy(),
+    ]).astype(np.float32)
+
+
+def feature_matrix(segments, rows=None, batch_size=BATCH_SIZE):
+    """
+    Float32 features (FEATURES order) and float32 target seconds of the given
+    segment rows (all segments with a travel time by default), built in batches.
+    """
+    if rows is None:
+        rows = np.flatnonzero(~np.isnan(segments['seconds'].to_numpy()))
+    X = np.empty((len(rows), len(FEATURES)), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        batch = segments.iloc[rows[start:start + batch_size]]
+        X[start:start + len(batch)] = feature_batch(batch)
+    y = segments['seconds'].to_numpy()[rows].astype(np.float32)
+    return X, y
+
+
+def make_model(kind='hist_gradient_boosting', categorical_route=True, random_state=42):
+    if kind == 'hist_gradient_boosting':
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
+        categorical = [FEATURES.index('route')] if categorical_route else None
+        return HistGradientBoostingRegressor(max_iter=300, learning_rate=0.1, categorical_features=categorical,
+                                             early_stopping=True, random_state=random_state)
+    if kind == 'random_forest':
+        from sklearn.ensemble import RandomForestRegressor
+
+        return RandomForestRegressor(n_estimators=100, min_samples_leaf=5, n_jobs=-1, random_state=random_state)
+    raise ValueError(f'Unknown model kind {kind!r}, use hist_gradient_boosting or random_forest')
+
+
+def train_travel_time_model(segments, fact, kind='hist_gradient_boosting', max_rows=DEFAULT_MAX_ROWS,
+                            test_size=0.2, random_state=42, model_dir=MODEL_DIR, progress=None):
+    """
+    Fit the travel-time model on a random sample of at most max_rows segments,
+    evaluate it on held-out segments and save it as a new version.
+
+    Returns the version's metadata and the held-out (actual, predicted) seconds.
+    """
+    from sklearn.metrics import mean_absolute_error, mean_squared_error
+
+    report = progress or (lambda step: None)
+    rng = np.random.default_rng(random_state)
+    rows = np.flatnonzero(~np.isnan(segments['seconds'].to_numpy()))
+    if max_rows is not None and len(rows) > max_rows:
+        rows = np.sort(rng.choice(rows, max_rows, replace=False))
+    # Split whole trips, so a trip's segments are not both fitted and scored
+    trips = segments['trip_idx'].to_numpy()[rows]
+    test_trips = rng.random(int(trips.max()) + 1 if len(trips) else 0) < test_size
+    test = test_trips[trips]
+
+    report('features')
+    X, y = feature_matrix(segments, rows)
+    categorical_route = len(fact.routes) <= MAX_ROUTE_CATEGORIES
+    model = make_model(kind, categorical_route, random_state)
+
+    report('fit')
+    model.fit(X[~test], y[~test])
+
+    report('evaluate')
+    predicted = model.predict(X[test]).astype(np.float32)
+    metrics = {
+        'mae_seconds': float(mean_absolute_error(y[test], predicted)),
+        'rmse_seconds': float(np.sqrt(mean_squared_error(y[test], predicted))),
+        'train_rows': int((~test).sum()),
+        'test_rows': int(test.sum()),
+    }
+    meta = {
+        'kind': kind,
+        'features': FEATURES,
+        'categorical_route': categorical_route,
+        # Route feature value i is route_ids[i], for building features at prediction time
+        'route_ids': fact.routes['route_id'].astype(str).tolist(),
+        'metrics': metrics,
+        'trained_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+    report('save')
+    meta['version'] = save_model(model, meta, model_dir)
+    return meta, y[test], predicted
+
+
+def save_model(model, meta, model_dir=MODEL_DIR):
+    """
+    Save a fitted model and its metadata as a new version, make it the latest
+    one and return the version name.
+    """
+    import joblib
+
+    model_dir = Path(model_dir)
+    version = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    out_dir = model_dir / version
+    out_dir.mkdir(parents=True)
+    joblib.dump(model, out_dir / 'model.joblib')
+    (out_dir / 'meta.json').write_text(json.dumps(dict(meta, version=version), indent=2))
+
+    # The pointer is replaced atomically, so readers see the old or the new version
+    tmp = model_dir / f'LATEST.{os.getpid()}.tmp'
+    tmp.write_text(version)
+    tmp.replace(model_dir / 'LATEST')
+    return version
+
+
+def latest_version(model_dir=MODEL_DIR):
+    path = Path(model_dir) / 'LATEST'
+    return path.read_text().strip() if path.exists() else None
+
+
+def list_versions(model_dir=MODEL_DIR):
+    """
+    Metadata of every saved version, oldest first.
+    """
+    model_dir = Path(model_dir)
+    if not model_dir.exists():
+        return []
+    return [json.loads(path.read_text()) for path in sorted(model_dir.glob('*/meta.json'))]
+
+
+def load_model(version=None, model_dir=MODEL_DIR):
+    """
+    (model, metadata) of a version, the latest one by default.
+    """
+    import joblib
+
+    version = version or latest_version(model_dir)
+    if version is None:
+        raise FileNotFoundError(f'No travel-time model has been trained in {model_dir}')
+    out_dir = Path(model_dir) / version
+    return joblib.load(out_dir / 'model.joblib'), json.loads((out_dir / 'meta.json').read_text())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the segment travel-time model.')
+    parser.add_argument('--feed', default='data/gtfs-nyc-2023.zip')
+    parser.add_argument('--kind', default='hist_gradient_boosting', choices=['hist_gradient_boosting', 'random_forest'])
+    parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS, help='segments to sample, 0 for all')
+    parser.add_argument('--model-dir', default=str(MODEL_DIR))
+    args = parser.parse_args()
+
+    from feed_loader import load_feed
+    from shape_store import shape_store
+    from stop_times_fact import StopTimesFact
+    from trip_segments import build_segments
+
+    feed = load_feed(args.feed)
+    fact = StopTimesFact(feed)
+    meta, _, _ = train_travel_time_model(build_segments(fact, shape_store(feed)), fact, args.kind,
+                                         args.max_rows or None, model_dir=args.model_dir,
+                                         progress=lambda step: print(f'{step}...'))
+    print(f"Model {meta['version']} saved, held-out MAE {meta['metrics']['mae_seconds']:.1f} s")
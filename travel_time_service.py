@@ -0,0 +1,244 @@
+"""
+Batched travel-time prediction with the latest saved travel-time model.
+
+A query is a trip, a stop to board at, a later stop of the same trip to alight
+at and optionally a departure time. It is answered by predicting every segment
+of the trip between the two stops and summing them: the segments are located
+by a binary search over (trip, stop) keys of the stop_times fact table, their
+features are taken from the segment table as arrays, and all the segments of
+all the queries go through one predict call. Requests arriving together are
+merged by a MicroBatcher into one such call.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from gtfs_time import NO_TIME, time_to_seconds
+from travel_time_model import MODEL_DIR, latest_version, load_model
+
+# How long the batcher waits for more requests after the first one, and the most it merges
+MAX_WAIT_SECONDS = 0.002
+MAX_BATCH_REQUESTS = 64
+
+
+class SegmentIndex:
+    """
+    Lookup of the segments of a trip between two of its stops, over the fact and segment tables.
+    """
+
+    def __init__(self, fact, segments):
+        self.fact = fact
+        self.segments = segments
+        facts = fact.facts
+        trip = facts['trip_idx'].to_numpy()
+        starts = np.r_[True, trip[1:] != trip[:-1]]
+        # Trips started before each fact row's own trip; the segment that starts
+        # at fact row r is segment r - trips_before[r]
+        self.trips_before = np.cumsum(starts) - 1
+        # (trip, stop) keys of the fact rows, sorted, for the first row of a stop in a trip
+        self.num_stops = len(fact.stops)
+        keys = trip.astype(np.int64) * self.num_stops + facts['stop_idx'].to_numpy()
+        self.key_order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.key_order]
+
+        self.trip_codes = pd.Index(fact.trips['trip_id'].astype(str))
+        self.stop_codes = pd.Index(fact.stops['stop_id'].astype(str))
+        self.departure = facts['departure_secs'].to_numpy()
+        self.arrival = facts['arrival_secs'].to_numpy()
+
+    def _rows(self, trip_codes, stop_codes, after=None):
+        """
+        Fact row of each (trip, stop), the first one after the given rows when after is set, -1 when missing.
+        """
+        keys = trip_codes.astype(np.int64) * self.num_stops + stop_codes
+        lo = np.searchsorted(self.sorted_keys, keys, side='left')
+        hi = np.searchsorted(self.sorted_keys, keys, side='right')
+        valid = (trip_codes >= 0) & (stop_codes >= 0) & (hi > lo)
+        # Equal keys keep the order of the rows, so the first one is at lo
+        rows = np.where(valid, self.key_order[np.minimum(lo, len(self.key_order) - 1)], -1)
+        if after is not None:
+            rows[rows <= after] = -1
+            # A trip that passes a stop twice (loops) may alight at its later visit
+            for i in np.flatnonzero(valid & (rows < 0) & (hi - lo > 1)):
+                candidates = self.key_order[lo[i]:hi[i]]
+                candidates = candidates[candidates > after[i]]
+                if len(candidates):
+                    rows[i] = candidates[0]
+        return rows
+
+    def locate(self, trip_ids, from_stop_ids, to_stop_ids):
+        """
+        Fact rows of the boarding and alighting stop of every query, -1 when not found.
+        """
+        trip_codes = self.trip_codes.get_indexer(trip_ids)
+        from_rows = self._rows(trip_codes, self.stop_codes.get_indexer(from_stop_ids))
+        to_rows = self._rows(trip_codes, self.stop_codes.get_indexer(to_stop_ids), after=from_rows)
+        to_rows[from_rows < 0] = -1
+        return from_rows, to_rows
+
+    def segment_rows(self, from_rows, to_rows):
+        """
+        Segment table rows between the found stops of every query, concatenated,
+        with the number of segments of each query.
+        """
+        found = (from_rows >= 0) & (to_rows >= 0)
+        first = np.where(found, from_rows - self.trips_before[np.maximum(from_rows, 0)], 0)
+        counts = np.where(found, to_rows - from_rows, 0)
+        offsets = np.repeat(first - np.r_[0, np.cumsum(counts)[:-1]], counts)
+        return np.arange(counts.sum()) + offsets, counts
+
+
+class TravelTimePredictor:
+    """
+    A loaded model version with the segment index and the route mapping it needs.
+    """
+
+    def __init__(self, model, meta, index):
+        self.model = model
+        self.meta = meta
+        self.index = index
+        # Route feature of the model for each route_idx of the current feed
+        route_ids = index.fact.routes['route_id'].astype(str)
+        self.route_feature = pd.Index(meta['route_ids']).get_indexer(route_ids).astype(np.float32)
+        self.route_feature[self.route_feature < 0] = np.nan
+
+    @property
+    def version(self):
+        return self.meta['version']
+
+    def features(self, segment_rows, shifts):
+        """
+        Float32 features of segment rows, their departures moved by shifts seconds.
+        """
+        segments = self.index.segments
+        departure = segments['departure_secs'].to_numpy()[segment_rows]
+        hour = np.where(departure == NO_TIME, np.nan, ((departure + shifts) // 3600) % 24)
+        return np.column_stack([
+            segments['distance'].to_numpy()[segment_rows],
+            hour,
+            self.route_feature[segments['route_idx'].to_numpy()[segment_rows]],
+            segments['stop_sequence'].to_numpy()[segment_rows],
+        ]).astype(np.float32)
+
+    def predict(self, queries):
+        """
+        Predicted and scheduled seconds for a frame of trip_id, from_stop_id,
+        to_stop_id and optional departure_time queries, one predict call for all.
+        """
+        index = self.index
+        from_rows, to_rows = index.locate(queries['trip_id'].astype(str), queries['from_stop_id'].astype(str),
+                                          queries['to_stop_id'].astype(str))
+        found = to_rows >= 0
+        scheduled_departure = np.where(found, index.departure[np.maximum(from_rows, 0)], NO_TIME)
+
+        departure = np.full(len(queries), NO_TIME, dtype=np.int32)
+        if 'departure_time' in queries:
+            given = queries['departure_time'].notna().to_numpy()
+            departure[given] = time_to_seconds(queries['departure_time'][given])
+        # The hour features of the later segments move with the requested departure
+        shift = np.where((departure != NO_TIME) & (scheduled_departure != NO_TIME), departure - scheduled_departure, 0)
+
+        segment_rows, counts = index.segment_rows(from_rows, to_rows)
+        predicted = np.zeros(len(queries))
+        if len(segment_rows):
+            per_segment = self.model.predict(self.features(segment_rows, np.repeat(shift, counts)))
+            owners = np.repeat(np.arange(len(queries)), counts)
+            predicted = np.bincount(owners, weights=per_segment, minlength=len(queries))
+
+        scheduled = np.where(found, index.arrival[np.maximum(to_rows, 0)] - scheduled_departure, np.nan)
+        scheduled[found & ((index.arrival[np.maximum(to_rows, 0)] == NO_TIME) | (scheduled_departure == NO_TIME))] = np.nan
+        return pd.DataFrame({
+            'predicted_seconds': np.where(found, np.round(predicted, 1), np.nan),
+            'scheduled_seconds': scheduled,
+            'num_segments': counts,
+            'found': found,
+        })
+
+
+class MicroBatcher:
+    """
+    Runs fn on the items submitted by concurrent callers together: the first
+    item waits up to max_wait seconds for others, then fn gets the list of
+    items and returns one result per item.
+    """
+
+    def __init__(self, fn, max_wait=MAX_WAIT_SECONDS, max_items=MAX_BATCH_REQUESTS):
+        self.fn = fn
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_items:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+
+def _serves(predictor, version, fact, segments):
+    return (predictor is not None and predictor.version == version and predictor.index.fact is fact
+            and predictor.index.segments is segments)
+
+
+def predictor_for(fact, segments, model_dir=MODEL_DIR):
+    """
+    Return the TravelTimePredictor of the latest model version, loading it once
+    per process and again only when a newer version is saved or the tables change.
+    """
+    global _predictor
+    version = latest_version(model_dir)
+    if _serves(_predictor, version, fact, segments):
+        return _predictor
+    with _predictor_lock:
+        if not _serves(_predictor, version, fact, segments):
+            model, meta = load_model(version, model_dir)
+            same_tables = _predictor is not None and _serves(_predictor, _predictor.version, fact, segments)
+            index = _predictor.index if same_tables else SegmentIndex(fact, segments)
+            _predictor = TravelTimePredictor(model, meta, index)
+        return _predictor
+
+
+def predict_batches(fact, segments, query_frames):
+    """
+    Predict the queries of several requests with one model call, one result frame per request.
+    """
+    predictor = predictor_for(fact, segments)
+    lengths = [len(frame) for frame in query_frames]
+    results = predictor.predict(pd.concat(query_frames, ignore_index=True))
+    bounds = np.r_[0, np.cumsum(lengths)]
+    return [(results.iloc[start:stop].reset_index(drop=True), predictor.version)
+            for start, stop in zip(bounds[:-1], bounds[1:])]
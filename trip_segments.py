@@ -0,0 +1,117 @@
+"""
+Per-trip segment table: one row per pair of consecutive stops of a trip, with
+the scheduled seconds between them and the distance travelled along the shape.
+
+Stop distances come from shape_dist_traveled. Stop times that do not give one
+are projected onto their trip's shape polyline, so every segment has a
+distance in the shape's units. The table is built once with array operations
+over the stop_times fact table, and the travel metrics aggregate from it.
+"""
+import numpy as np
+import pandas as pd
+
+from gtfs_time import NO_TIME
+
+
+def project_onto_shape(coords, distance, lat, lon):
+    """
+    Distance along a shape polyline, given as (lat, lon) points with their
+    cumulative distance, of the closest point to each (lat, lon).
+    """
+    if len(coords) < 2:
+        return np.full(len(lat), distance[0] if len(distance) else np.nan)
+    # Local equirectangular plane, good enough at the scale of a stop to its road
+    scale = np.cos(np.radians(coords[:, 0].mean()))
+    ax, ay = coords[:-1, 1] * scale, coords[:-1, 0]
+    dx, dy = coords[1:, 1] * scale - ax, coords[1:, 0] - ay
+    length2 = np.where(dx * dx + dy * dy > 0, dx * dx + dy * dy, 1.0)
+
+    px, py = np.asarray(lon)[:, None] * scale, np.asarray(lat)[:, None]
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / length2, 0, 1)
+    gap2 = (ax + t * dx - px) ** 2 + (ay + t * dy - py) ** 2
+    nearest = gap2.argmin(axis=1)
+    t = t[np.arange(len(nearest)), nearest]
+    return distance[nearest] + t * (distance[nearest + 1] - distance[nearest])
+
+
+def stop_distances(fact, shapes):
+    """
+    Distance along the shape of every stop time of the fact table, projecting
+    the stops whose shape_dist_traveled is missing, non-decreasing within a trip.
+    """
+    distance = fact.facts['shape_dist_traveled'].to_numpy(dtype=np.float64, copy=True)
+    missing = np.flatnonzero(np.isnan(distance))
+    if len(missing):
+        shape_codes = fact.facts['shape_idx'].to_numpy()[missing]
+        stop_codes = fact.facts['stop_idx'].to_numpy()[missing]
+        lat = fact.stops['stop_lat'].to_numpy(dtype=np.float64)[stop_codes]
+        lon = fact.stops['stop_lon'].to_numpy(dtype=np.float64)[stop_codes]
+        shape_ids = fact.shapes['shape_id'].astype(object).to_numpy()
+        for code in np.unique(shape_codes):
+            rows = shape_codes == code
+            shape_id = shape_ids[code]
+            distance[missing[rows]] = project_onto_shape(shapes.coordinates(shape_id), shapes.distances(shape_id),
+                                                         lat[rows], lon[rows])
+
+    # A stop projected past the next one (loops, stops off the road) is held back
+    trip = fact.facts['trip_idx'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, trip[1:] != trip[:-1]])
+    offset = np.repeat(np.arange(len(starts)) * (np.nanmax(distance, initial=0) + 1), np.diff(np.r_[starts, len(trip)]))
+    return np.fmax.accumulate(np.nan_to_num(distance) + offset) - offset
+
+
+def build_segments(fact, shapes):
+    """
+    Segment table of the fact table's trips: one row per consecutive stop pair.
+    """
+    trip = fact.facts['trip_idx'].to_numpy()
+    to_rows = np.flatnonzero(trip[1:] == trip[:-1]) + 1
+    from_rows = to_rows - 1
+
+    distance = stop_distances(fact, shapes)
+    arrival = fact.facts['arrival_secs'].to_numpy()
+    departure = fact.facts['departure_secs'].to_numpy()
+    seconds = (arrival[to_rows] - departure[from_rows]).astype(np.float32)
+    seconds[(arrival[to_rows] == NO_TIME) | (departure[from_rows] == NO_TIME)] = np.nan
+
+    return pd.DataFrame({
+        'trip_idx': trip[to_rows],
+        'route_idx': fact.facts['route_idx'].to_numpy()[to_rows],
+        'from_stop_idx': fact.facts['stop_idx'].to_numpy()[from_rows],
+        'to_stop_idx': fact.facts['stop_idx'].to_numpy()[to_rows],
+        'stop_sequence': fact.facts['stop_sequence'].to_numpy()[from_rows],
+        'departure_secs': departure[from_rows],
+        'seconds': seconds,
+        'distance': (distance[to_rows] - distance[from_rows]).astype(np.float32),
+    })
+
+
+def _group_mean(codes, values, size):
+    valid = ~np.isnan(values)
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=size)
+    counts = np.bincount(codes[valid], minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def route_travel_metrics(segments, fact):
+    """
+    Per route: AvgTravelTime, the mean over its trips of the mean minutes
+    between stops, and TotalDistance, the summed length of its trips.
+    """
+    num_trips = len(fact.trips)
+    trip_codes = segments['trip_idx'].to_numpy()
+    minutes = segments['seconds'].to_numpy(dtype=np.float64) / 60
+    trip_minutes = _group_mean(trip_codes, minutes, num_trips)
+    trip_distance = np.bincount(trip_codes, weights=segments['distance'].to_numpy(dtype=np.float64),
+                                minlength=num_trips)
+
+    trips = np.unique(trip_codes)
+    route_codes = fact.trips['route_idx'].to_numpy()[trips]
+    num_routes = len(fact.routes)
+    metrics = pd.DataFrame({
+        'AvgTravelTime': _group_mean(route_codes, trip_minutes[trips], num_routes),
+        'TotalDistance': np.bincount(route_codes, weights=trip_distance[trips], minlength=num_routes),
+    })
+    metrics.insert(0, 'route_id', fact.routes['route_id'].to_numpy())
+    return metrics.iloc[np.unique(route_codes)].reset_index(drop=True)